@@ -0,0 +1,54 @@
+import json
+
+from benchmarks.fakes import websocket
+from benchmarks.fakes.server import FakeHTTPServer, respond
+
+SESSION_ID = 1001
+HANDLE_ID = 2002
+STREAM_ID = 1
+OFFER_SDP = 'v=0\r\no=- 0 0 IN IP4 127.0.0.1\r\ns=Bench\r\nt=0 0\r\nm=video 9 UDP/TLS/RTP/SAVPF 96\r\na=rtpmap:96 H264/90000\r\n'
+
+
+class FakeJanus(FakeHTTPServer):
+	"""Janus websocket transport answering the create/attach/list/watch transactions the plugin issues."""
+
+	def __init__(self):
+		super(FakeJanus, self).__init__()
+		self.transactions = []
+
+	def handle(self, request, method):
+		if method == 'GET' and websocket.is_upgrade(request):
+			self._serve(websocket.upgrade(request, subprotocol='janus-protocol'))
+		else:
+			respond(request, 404, {'error': 'Not found'})
+
+	def _serve(self, connection):
+		while True:
+			message = connection.receive()
+			if message is None:
+				return
+			request = json.loads(message)
+			self.transactions.append(request.get('transaction'))
+			for reply in self._reply(request):
+				connection.send(json.dumps(reply))
+
+	@staticmethod
+	def _reply(request):
+		janus = request.get('janus')
+		transaction = request.get('transaction')
+		if janus == 'create':
+			return [{'janus': 'success', 'transaction': transaction, 'data': {'id': SESSION_ID}}]
+		if janus == 'attach':
+			return [{'janus': 'success', 'transaction': transaction, 'data': {'id': HANDLE_ID}}]
+		if janus == 'message':
+			body = request.get('body') or {}
+			if body.get('request') == 'list':
+				return [{'janus': 'success', 'transaction': transaction, 'sender': HANDLE_ID,
+						 'plugindata': {'plugin': 'janus.plugin.streaming', 'data': {'streaming': 'list', 'list': [
+							 {'id': STREAM_ID, 'type': 'rtp', 'description': 'Plabric', 'video_age_ms': 10}]}}}]
+			if body.get('request') in ('watch', 'start'):
+				return [{'janus': 'ack', 'transaction': transaction},
+						{'janus': 'event', 'transaction': transaction, 'sender': HANDLE_ID,
+						 'plugindata': {'plugin': 'janus.plugin.streaming', 'data': {'streaming': 'event', 'result': {'status': 'preparing'}}},
+						 'jsep': {'type': 'offer', 'sdp': OFFER_SDP}}]
+		return [{'janus': 'ack', 'transaction': transaction}]
@@ -0,0 +1,134 @@
+import json
+import re
+import threading
+import time
+from urllib.parse import unquote
+
+from benchmarks.fakes import websocket
+from benchmarks.fakes.server import FakeHTTPServer, discard_body, read_body, respond
+
+
+def file_listing(count):
+	files = []
+	for i in range(count):
+		files.append({
+			'name': 'part_%04d.gcode' % i,
+			'display': 'part_%04d.gcode' % i,
+			'path': 'plabric/part_%04d.gcode' % i,
+			'origin': 'local',
+			'type': 'machinecode',
+			'typePath': ['machinecode', 'gcode'],
+			'size': 1048576 + i * 977,
+			'date': 1600000000 + i * 60,
+			'hash': '%040x' % (i * 2654435761),
+			'refs': {'resource': 'http://localhost/api/files/local/plabric/part_%04d.gcode' % i,
+					 'download': 'http://localhost/downloads/files/local/plabric/part_%04d.gcode' % i},
+			'gcodeAnalysis': {'estimatedPrintTime': 3600.0 + i, 'filament': {'tool0': {'length': 1234.5 + i, 'volume': 9.87}},
+							  'dimensions': {'depth': 120.0, 'height': 30.0, 'width': 110.0},
+							  'printingArea': {'maxX': 160.0, 'maxY': 150.0, 'maxZ': 30.0, 'minX': 50.0, 'minY': 30.0, 'minZ': 0.2}},
+			'prints': {'failure': i % 3, 'success': i % 7, 'last': {'date': 1600000000 + i, 'success': True}},
+		})
+	return {'files': files, 'free': 12345678901, 'total': 31234567890}
+
+
+class FakeOctoPrint(FakeHTTPServer):
+	"""OctoPrint REST endpoints used by the plugin plus the raw SockJS websocket endpoint."""
+
+	def __init__(self, files=200):
+		super(FakeOctoPrint, self).__init__()
+		self._listing = json.dumps(file_listing(files)).encode('utf-8')
+		self._sockets = []
+		self._lock = threading.Lock()
+		self.requests = 0
+		self.uploaded_bytes = 0
+		self.uploads = 0
+		self.selects = 0
+		self.stored = {}
+		self.socket_messages = []
+
+	def handle(self, request, method):
+		self.requests += 1
+		path = request.path.split('?')[0]
+		if method == 'GET' and path == '/sockjs/websocket' and websocket.is_upgrade(request):
+			self._serve_socket(websocket.upgrade(request))
+		elif method == 'GET' and path.startswith('/api/files/local/') and path.endswith('.gcode'):
+			info = self.stored.get(unquote(path[len('/api/files/local/'):]))
+			respond(request, 200 if info else 404, info or {'error': 'File not found'})
+		elif method == 'GET' and path.startswith('/api/files'):
+			respond(request, 200, self._listing)
+		elif method == 'GET' and path == '/api/version':
+			respond(request, 200, {'api': '0.1', 'server': '1.4.2', 'text': 'OctoPrint 1.4.2'})
+		elif method == 'GET' and path == '/api/printer':
+			respond(request, 200, {'state': {'text': 'Printing', 'flags': {'printing': True, 'operational': True}},
+								   'temperature': {'tool0': {'actual': 210.1, 'target': 210.0}, 'bed': {'actual': 60.0, 'target': 60.0}}})
+		elif method == 'GET' and path == '/api/job':
+			respond(request, 200, {'job': {'file': {'name': 'part_0001.gcode'}}, 'progress': {'completion': 42.0}, 'state': 'Printing'})
+		elif method == 'POST' and path == '/api/login':
+			read_body(request)
+			respond(request, 200, {'name': 'bench', 'session': 'bench-session', 'active': True, 'admin': True})
+		elif method == 'POST' and path.startswith('/api/files/local/') and path.endswith('.gcode'):
+			command = json.loads(read_body(request) or b'{}')
+			if command.get('command') == 'select' and unquote(path[len('/api/files/local/'):]) in self.stored:
+				self.selects += 1
+				respond(request, 204)
+			else:
+				respond(request, 404, {'error': 'File not found'})
+		elif method == 'POST' and path.startswith('/api/files/local'):
+			info = self._upload(request)
+			respond(request, 201, {'done': True, 'files': {'local': {'name': info['name'], 'path': info['path'], 'origin': 'local'}},
+								   'effectiveSelect': True, 'effectivePrint': False})
+		elif method in ('POST', 'PUT', 'PATCH', 'DELETE'):
+			read_body(request)
+			respond(request, 204)
+		else:
+			respond(request, 404, {'error': 'Not found'})
+
+	def _upload(self, request):
+		"""Drops an uploaded multipart body, keeping the file name and the size of its file part."""
+		head = []
+		length = discard_body(request, head=head)
+		head = head[0] if head else b''
+		boundary = request.headers.get('Content-Type', '').partition('boundary=')[2]
+		match = re.search(br'filename="([^"]*)"', head)
+		path = 'plabric/tmp/%s' % (match.group(1).decode('utf-8') if match else 'bench.gcode')
+		start = head.find(b'\r\n\r\n', match.end()) + 4 if match else 0
+		size = length - start - len('\r\n--%s--\r\n' % boundary)
+		info = {'name': path.rsplit('/', 1)[1], 'path': path, 'origin': 'local', 'type': 'machinecode', 'size': size,
+				'date': int(time.time()), 'refs': {'resource': 'http://localhost/api/files/local/%s' % path}}
+		with self._lock:
+			self.uploaded_bytes += length
+			self.uploads += 1
+			self.stored[path] = info
+		return info
+
+	def _serve_socket(self, connection):
+		with self._lock:
+			self._sockets.append(connection)
+		connection.send(json.dumps({'connected': {'version': '1.4.2', 'display_version': '1.4.2'}}))
+		while True:
+			message = connection.receive()
+			if message is None:
+				break
+			self.socket_messages.append(message)
+		with self._lock:
+			self._sockets.remove(connection)
+
+	def connected_sockets(self):
+		with self._lock:
+			return len(self._sockets)
+
+	def push(self, message):
+		text = json.dumps(message)
+		with self._lock:
+			sockets = list(self._sockets)
+		for connection in sockets:
+			connection.send(text)
+		return len(sockets)
+
+	def wait_for_socket(self, timeout):
+		deadline = time.time() + timeout
+		while time.time() < deadline:
+			if self.connected_sockets():
+				return True
+			time.sleep(0.01)
+		return False
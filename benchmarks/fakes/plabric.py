@@ -0,0 +1,208 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import namedtuple
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import socketio
+
+NAMESPACE = '/octoprint/plugin/socket'
+
+PLUGIN_EVENTS = ('jr_slave', 'lr', 'close', 'ready', 'socket_event', 'api_command_response', 'api_command_batch_response',
+				 'webrtc_ready', 'signaling', 'codecs_selected', 'ping_probe', 'transfer_progress')
+
+Record = namedtuple('Record', ('time', 'event', 'data', 'size'))
+
+
+class Recorder(object):
+
+	def __init__(self):
+		self._records = []
+		self._condition = threading.Condition()
+
+	def add(self, event, data):
+		size = len(data) if isinstance(data, (str, bytes)) else len(json.dumps(data)) if data is not None else 0
+		with self._condition:
+			self._records.append(Record(time.time(), event, data, size))
+			self._condition.notify_all()
+
+	def records(self, event=None, since=0.0):
+		with self._condition:
+			return [r for r in self._records if r.time >= since and (event is None or r.event == event)]
+
+	def wait_for(self, predicate, timeout):
+		deadline = time.time() + timeout
+		with self._condition:
+			while True:
+				result = predicate(self._records)
+				if result:
+					return result
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					return None
+				self._condition.wait(remaining)
+
+	def wait_event(self, event, since=0.0, timeout=10.0, match=None):
+		def predicate(records):
+			for r in records:
+				if r.time >= since and r.event == event and (match is None or match(r)):
+					return r
+			return None
+		return self.wait_for(predicate, timeout)
+
+
+GCODE_LINE = b'G1 X10 Y10 E0.5 F1800 ; bench\n'
+
+
+def gcode_chunks(start, end, chunk_size=65536):
+	"""Bytes ``start`` to ``end`` of an endless repetition of GCODE_LINE, generated without holding the file."""
+	block = GCODE_LINE * (chunk_size // len(GCODE_LINE) + 2)
+	position = start
+	while position < end:
+		offset = position % len(GCODE_LINE)
+		chunk = block[offset:offset + min(chunk_size, end - position)]
+		position += len(chunk)
+		yield chunk
+
+
+def gcode_sha256(size):
+	digest = hashlib.sha256()
+	for chunk in gcode_chunks(0, size):
+		digest.update(chunk)
+	return digest.hexdigest()
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+	daemon_threads = True
+	block_on_close = False
+
+
+class _QuietHandler(WSGIRequestHandler):
+
+	def log_message(self, *args):
+		pass
+
+
+class FakePlabric(object):
+	"""Plabric relay: the socket.io namespace the plugin joins plus the REST endpoints it calls."""
+
+	def __init__(self, download_size=0, drop_after=None, drops=0, ranges=True, digest=False, connection_rate=None):
+		self.recorder = Recorder()
+		self.sid = None
+		self.rest_calls = []
+		self.served_bytes = 0
+		self._download_size = download_size
+		self._drop_after = drop_after
+		self._drops = drops
+		self._ranges = ranges
+		self._connection_rate = connection_rate
+		self.range_requests = 0
+		self._sha256 = gcode_sha256(download_size) if digest and download_size else None
+		self._sio = socketio.Server(async_mode='threading')
+		self._register_handlers()
+		app = socketio.WSGIApp(self._sio, self._rest)
+		self._server = make_server('127.0.0.1', 0, app, server_class=_ThreadingWSGIServer, handler_class=_QuietHandler)
+		self._thread = None
+
+	@property
+	def url(self):
+		return 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+	def start(self):
+		self._thread = threading.Thread(target=self._server.serve_forever, name='FakePlabric')
+		self._thread.daemon = True
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self._server.shutdown()
+		self._server.server_close()
+
+	def emit(self, event, data=None):
+		self._sio.emit(event, json.dumps(data) if data is not None else None, room=self.sid, namespace=NAMESPACE)
+
+	def _register_handlers(self):
+		def connect(sid, environ):
+			self.recorder.add('connect', None)
+
+		self._sio.on('connect', connect, namespace=NAMESPACE)
+
+		for event in PLUGIN_EVENTS:
+			self._sio.on(event, self._handler(event), namespace=NAMESPACE)
+
+	def _handler(self, event):
+		def handler(sid, data=None):
+			if event == 'jr_slave':
+				self.sid = sid
+			elif event == 'ping_probe':
+				probe = json.loads(data) if isinstance(data, str) else data or {}
+				self._sio.emit('pong_probe', json.dumps({'id': probe.get('id'), 'server_time': time.time()}), room=sid, namespace=NAMESPACE)
+			self.recorder.add(event, data)
+		return handler
+
+	def _rest(self, environ, start_response):
+		path = '/' + environ.get('PATH_INFO', '').lstrip('/')
+		length = int(environ.get('CONTENT_LENGTH') or 0)
+		body = environ['wsgi.input'].read(length) if length else b''
+		self.rest_calls.append(path)
+
+		if path == '/octoprint/plugin/servers':
+			return self._json(start_response, [])
+		if path == '/octoprint/plugin/file/url':
+			params = json.loads(body or b'{}')
+			data = {'url': '%s/files/%s' % (self.url, params.get('id'))}
+			if self._sha256:
+				data['sha256'] = self._sha256
+			return self._json(start_response, data)
+		if path == '/octoprint/plugin/token':
+			return self._json(start_response, {'token': 'bench-token'})
+		if path.startswith('/files/'):
+			return self._file(environ, start_response)
+		return self._json(start_response, {})
+
+	def _file(self, environ, start_response):
+		"""Serves the download, honouring ``Range`` when enabled and cutting the first ``drops`` responses after ``drop_after`` bytes.
+
+		``connection_rate`` caps each response in bytes per second, standing in for a link whose round trip time limits
+		a single connection.
+		"""
+		size = self._download_size
+		headers = [('Content-Type', 'application/octet-stream'), ('ETag', '"bench-%d"' % size), ('Accept-Ranges', 'bytes' if self._ranges else 'none')]
+		start, end = 0, size
+		match = re.match(r'bytes=(\d+)-(\d*)$', environ.get('HTTP_RANGE', ''))
+		if match and self._ranges and environ.get('HTTP_IF_RANGE', headers[1][1]) == headers[1][1]:
+			self.range_requests += 1
+			start = int(match.group(1))
+			end = min(size, int(match.group(2)) + 1) if match.group(2) else size
+			if start >= size or start >= end:
+				start_response('416 Range Not Satisfiable', headers + [('Content-Range', 'bytes */%d' % size), ('Content-Length', '0')])
+				return [b'']
+			start_response('206 Partial Content', headers + [('Content-Range', 'bytes %d-%d/%d' % (start, end - 1, size)),
+															  ('Content-Length', str(end - start))])
+		else:
+			start_response('200 OK', headers + [('Content-Length', str(size))])
+		if self._drops > 0 and self._drop_after is not None:
+			self._drops -= 1
+			end = min(end, start + self._drop_after)
+		return self._count(gcode_chunks(start, end))
+
+	def _count(self, chunks):
+		started_at = time.time()
+		sent = 0
+		for chunk in chunks:
+			self.served_bytes += len(chunk)
+			sent += len(chunk)
+			yield chunk
+			if self._connection_rate:
+				delay = started_at + float(sent) / self._connection_rate - time.time()
+				if delay > 0:
+					time.sleep(delay)
+
+	@staticmethod
+	def _json(start_response, data):
+		body = json.dumps(data).encode('utf-8')
+		start_response('200 OK', [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+		return [body]
@@ -0,0 +1,97 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeHTTPServer(object):
+	"""Threaded HTTP/1.1 server on a free loopback port. Subclasses route requests in ``handle``."""
+
+	def __init__(self):
+		owner = self
+
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1'
+
+			def log_message(self, *args):
+				pass
+
+			def do_GET(self):
+				owner.handle(self, 'GET')
+
+			def do_POST(self):
+				owner.handle(self, 'POST')
+
+			def do_PUT(self):
+				owner.handle(self, 'PUT')
+
+			def do_PATCH(self):
+				owner.handle(self, 'PATCH')
+
+			def do_DELETE(self):
+				owner.handle(self, 'DELETE')
+
+		self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+		self._server.daemon_threads = True
+		self._server.block_on_close = False
+		self._thread = None
+
+	@property
+	def port(self):
+		return self._server.server_address[1]
+
+	@property
+	def url(self):
+		return 'http://127.0.0.1:%d' % self.port
+
+	def start(self):
+		self._thread = threading.Thread(target=self._server.serve_forever, name=type(self).__name__)
+		self._thread.daemon = True
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self._server.shutdown()
+		self._server.server_close()
+
+	def handle(self, request, method):
+		raise NotImplementedError
+
+
+def read_body(request):
+	length = int(request.headers.get('Content-Length') or 0)
+	remaining = length
+	chunks = []
+	while remaining > 0:
+		chunk = request.rfile.read(min(remaining, 1 << 16))
+		if not chunk:
+			break
+		chunks.append(chunk)
+		remaining -= len(chunk)
+	return b''.join(chunks)
+
+
+def discard_body(request, head=None):
+	"""Reads and drops the request body, returning its length; the first chunk is appended to ``head`` when given."""
+	length = int(request.headers.get('Content-Length') or 0)
+	remaining = length
+	while remaining > 0:
+		chunk = request.rfile.read(min(remaining, 1 << 16))
+		if not chunk:
+			break
+		if head is not None and not head:
+			head.append(chunk)
+		remaining -= len(chunk)
+	return length - remaining
+
+
+def respond(request, status, body=b'', content_type='application/json'):
+	if not isinstance(body, bytes):
+		body = json.dumps(body).encode('utf-8')
+	try:
+		request.send_response(status)
+		request.send_header('Content-Type', content_type)
+		request.send_header('Content-Length', str(len(body)))
+		request.end_headers()
+		request.wfile.write(body)
+	except (BrokenPipeError, ConnectionResetError):
+		request.close_connection = True
@@ -0,0 +1,110 @@
+import base64
+import hashlib
+import struct
+import threading
+
+_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+def accept_key(key):
+	return base64.b64encode(hashlib.sha1((key + _GUID).encode('ascii')).digest()).decode('ascii')
+
+
+def upgrade(handler, subprotocol=None):
+	key = handler.headers.get('Sec-WebSocket-Key')
+	handler.send_response(101, 'Switching Protocols')
+	handler.send_header('Upgrade', 'websocket')
+	handler.send_header('Connection', 'Upgrade')
+	handler.send_header('Sec-WebSocket-Accept', accept_key(key))
+	requested = [p.strip() for p in (handler.headers.get('Sec-WebSocket-Protocol') or '').split(',') if p.strip()]
+	if subprotocol and subprotocol in requested:
+		handler.send_header('Sec-WebSocket-Protocol', subprotocol)
+	handler.end_headers()
+	handler.wfile.flush()
+	handler.close_connection = True
+	return WebSocketConnection(handler.rfile, handler.connection)
+
+
+def is_upgrade(handler):
+	return (handler.headers.get('Upgrade') or '').lower() == 'websocket'
+
+
+class WebSocketConnection(object):
+
+	def __init__(self, rfile, sock):
+		self._rfile = rfile
+		self._sock = sock
+		self._lock = threading.Lock()
+		self.closed = False
+
+	def send(self, text):
+		self._send_frame(OP_TEXT, text.encode('utf-8'))
+
+	def _send_frame(self, opcode, payload):
+		header = bytearray([0x80 | opcode])
+		length = len(payload)
+		if length < 126:
+			header.append(length)
+		elif length < 65536:
+			header.append(126)
+			header += struct.pack('>H', length)
+		else:
+			header.append(127)
+			header += struct.pack('>Q', length)
+		with self._lock:
+			if self.closed:
+				return
+			try:
+				self._sock.sendall(bytes(header) + payload)
+			except (IOError, OSError):
+				self.closed = True
+
+	def _read(self, size):
+		data = self._rfile.read(size)
+		if data is None or len(data) < size:
+			raise EOFError()
+		return data
+
+	def receive(self):
+		message = bytearray()
+		try:
+			while True:
+				first, second = bytearray(self._read(2))
+				fin, opcode = first & 0x80, first & 0x0F
+				length = second & 0x7F
+				if length == 126:
+					length = struct.unpack('>H', self._read(2))[0]
+				elif length == 127:
+					length = struct.unpack('>Q', self._read(8))[0]
+				mask = bytearray(self._read(4)) if second & 0x80 else None
+				payload = bytearray(self._read(length)) if length else bytearray()
+				if mask:
+					for i in range(length):
+						payload[i] ^= mask[i % 4]
+
+				if opcode == OP_CLOSE:
+					self._send_frame(OP_CLOSE, bytes(payload[:2]))
+					self.closed = True
+					return None
+				if opcode == OP_PING:
+					self._send_frame(OP_PONG, bytes(payload))
+					continue
+				if opcode == OP_PONG:
+					continue
+				message += payload
+				if fin:
+					return message.decode('utf-8')
+		except (EOFError, IOError, OSError, ValueError):
+			self.closed = True
+			return None
+
+	def close(self):
+		self._send_frame(OP_CLOSE, struct.pack('>H', 1000))
+		self.closed = True
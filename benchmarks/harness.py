@@ -0,0 +1,253 @@
+import gc
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+
+import yaml
+
+from benchmarks.fakes.janus import FakeJanus
+from benchmarks.fakes.octoprint import FakeOctoPrint
+from benchmarks.fakes.plabric import FakePlabric
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLABRIC_API_KEY = 'bench-plabric-key'
+OCTOPRINT_API_KEY = 'bench-octoprint-key'
+
+
+def load_package(path=None):
+	"""Import the plugin controllers without running the OctoPrint plugin entry point in ``__init__``."""
+	path = os.path.abspath(path or os.path.join(ROOT, 'octoprint_plabric'))
+	package = sys.modules.get('octoprint_plabric')
+	if package is None:
+		package = types.ModuleType('octoprint_plabric')
+		package.__path__ = [path]
+		package.__file__ = os.path.join(path, '__init__.py')
+		sys.modules['octoprint_plabric'] = package
+	elif os.path.abspath(package.__path__[0]) != path:
+		raise RuntimeError('octoprint_plabric already loaded from %s' % package.__path__[0])
+	return importlib.import_module('octoprint_plabric.config')
+
+
+def package_revision(path=None):
+	path = os.path.abspath(path or os.path.join(ROOT, 'octoprint_plabric'))
+	try:
+		import subprocess
+		return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=path, stderr=subprocess.STDOUT).decode().strip()
+	except Exception:
+		return None
+
+
+class FakePrinter(object):
+	"""The slice of OctoPrint's PrinterInterface used by the event bridge and printer monitor."""
+
+	def __init__(self):
+		self._callbacks = []
+
+	def register_callback(self, callback):
+		self._callbacks.append(callback)
+		callback.on_printer_send_initial_data({'temps': [], 'logs': [], 'messages': [], 'state': {'text': 'Printing'}})
+
+	def unregister_callback(self, callback):
+		if callback in self._callbacks:
+			self._callbacks.remove(callback)
+
+	def is_printing(self):
+		return True
+
+	def is_paused(self):
+		return False
+
+	def push(self, data):
+		data = dict(data)
+		temps = data.pop('temps', [])
+		logs = data.pop('logs', [])
+		messages = data.pop('messages', [])
+		data.pop('busyFiles', None)
+		for callback in list(self._callbacks):
+			for temperature in temps:
+				callback.on_printer_add_temperature(temperature)
+			for line in logs:
+				callback.on_printer_add_log(line)
+			for message in messages:
+				callback.on_printer_add_message(message)
+			callback.on_printer_send_current_data(data)
+
+
+class FakePluginManager(object):
+
+	def register_message_receiver(self, receiver):
+		pass
+
+	def unregister_message_receiver(self, receiver):
+		pass
+
+	def send_plugin_message(self, identifier, data):
+		pass
+
+
+class FakePlugin(object):
+	"""The PlabricPlugin surface Main relies on."""
+
+	def __init__(self, data_folder, host, printer):
+		self._data_folder = data_folder
+		self._host = host
+		self._printer = printer
+		self._plugin_manager = FakePluginManager()
+
+	def get_plugin_data_folder(self):
+		return self._data_folder
+
+	def get_host(self):
+		return self._host
+
+	def get_printer(self):
+		return self._printer
+
+	def get_plugin_manager(self):
+		return self._plugin_manager
+
+	def get_file_manager(self):
+		return None
+
+	def get_version(self):
+		return 'benchmark'
+
+	def get_video_stream_url(self):
+		return None
+
+	def get_webcam_params(self):
+		return {}
+
+	def update_ui_status(self):
+		pass
+
+
+class Harness(object):
+	"""Runs one Main instance against local fakes of the Plabric relay, OctoPrint and Janus."""
+
+	def __init__(self, bridge=True, janus=False, files=200, download_size=0, download_options=None, config_overrides=None, package_path=None):
+		self._bridge = bridge
+		self._janus_enabled = janus
+		self._overrides = dict(config_overrides or {})
+		self._package_path = package_path
+		self._saved = {}
+		self._tmp = None
+		self.plabric = FakePlabric(download_size=download_size, **(download_options or {}))
+		self.octoprint = FakeOctoPrint(files=files)
+		self.janus = FakeJanus() if janus else None
+		self.printer = FakePrinter() if bridge else None
+		self.config = None
+		self.main = None
+		self.threads_before = set()
+		self.rss_kb_before = 0
+
+	def __enter__(self):
+		self.plabric.start()
+		self.octoprint.start()
+		if self.janus:
+			self.janus.start()
+		self._tmp = tempfile.mkdtemp(prefix='plabric-bench-')
+		for name in ('data', 'ffmpeg', 'janus'):
+			os.makedirs(os.path.join(self._tmp, name))
+		with open(os.path.join(self._tmp, 'data', '.config.yaml'), 'w') as f:
+			yaml.dump({'plabric_api_key': PLABRIC_API_KEY}, f)
+
+		self.config = load_package(self._package_path)
+		self._patch_config(dict({
+			'DEBUG': False,
+			'HOST_PLABRIC_API': self.plabric.url,
+			'FFMPEG_DIR': os.path.join(self._tmp, 'ffmpeg'),
+			'JANUS_DIR': os.path.join(self._tmp, 'janus'),
+			'JANUS_RUN_LOCAL': False,
+			'OCTOPRINT_EVENT_BRIDGE': self._bridge,
+		}, **self._overrides))
+
+		from octoprint_plabric.controllers.main import Main
+		plugin = FakePlugin(data_folder=os.path.join(self._tmp, 'data'), host=self.octoprint.url, printer=self.printer)
+		gc.collect()
+		self.threads_before = set(threading.enumerate())
+		self.rss_kb_before = rss_kb()
+		self.main = Main(plugin)
+		if self.janus:
+			webrtc = self.main.plabric_webrtc
+			webrtc._enabled = True
+			webrtc._url = 'ws://127.0.0.1:%d/' % self.janus.port
+			webrtc._janus_dir = os.path.join(self._tmp, 'janus')
+		started_at = time.time()
+		self.main.start()
+		if not self.plabric.recorder.wait_event('jr_slave', since=started_at, timeout=15):
+			self.__exit__(None, None, None)
+			raise RuntimeError('Plugin did not join the fake Plabric relay')
+		return self
+
+	def __exit__(self, *args):
+		if self.main is not None:
+			try:
+				self.main.shutdown() if hasattr(self.main, 'shutdown') else self.main.disconnect()
+			except Exception:
+				pass
+		for server in (self.plabric, self.octoprint, self.janus):
+			if server is not None:
+				try:
+					server.stop()
+				except Exception:
+					pass
+		self._restore_config()
+		if self._tmp:
+			shutil.rmtree(self._tmp, ignore_errors=True)
+		return False
+
+	def _patch_config(self, values):
+		for name, value in values.items():
+			self._saved[name] = getattr(self.config, name, _MISSING)
+			setattr(self.config, name, value)
+
+	def _restore_config(self):
+		for name, value in self._saved.items():
+			if value is _MISSING:
+				delattr(self.config, name)
+			else:
+				setattr(self.config, name, value)
+		self._saved = {}
+
+	def emit(self, event, data=None):
+		self.plabric.emit(event, data)
+
+	def join(self, stream_config=None, timeout=15):
+		joined_at = time.time()
+		self.emit('user_joined', {'user_nick': 'bench', 'octoprint_api_key': OCTOPRINT_API_KEY, 'stream_config': stream_config or {}})
+		if not self.plabric.recorder.wait_event('ready', since=joined_at, timeout=timeout):
+			raise RuntimeError('Plugin did not answer user_joined')
+		if not self._bridge and not self.octoprint.wait_for_socket(timeout):
+			raise RuntimeError('Plugin did not open the OctoPrint socket')
+		return joined_at
+
+	def force_fresh_connections(self):
+		for api in (self.main.octoprint_api, self.main.plabric_api):
+			session = getattr(api, '_session', None)
+			if session is not None:
+				session.headers['Connection'] = 'close'
+
+	def stats(self):
+		return self.main.get_stats() if hasattr(self.main, 'get_stats') else {}
+
+	def plugin_threads(self):
+		"""Threads started since the plugin was created, leaving out the request threads of the fake servers."""
+		return [t for t in threading.enumerate() if t not in self.threads_before and not t.name.startswith('Fake')
+				and 'process_request_thread' not in t.name]
+
+
+def rss_kb():
+	with open('/proc/self/status') as status:
+		for line in status:
+			if line.startswith('VmRSS:'):
+				return int(line.split()[1])
+	return 0
+
+
+_MISSING = object()
@@ -0,0 +1,62 @@
+HIGHER_IS_BETTER = ('throughput', 'mb_per_second', 'cpu_speedup', 'completed', 'delivered', 'hits', 'hit_rate', 'saved_download_bytes',
+					'saved_upload_bytes')
+NEUTRAL = ('count', 'commands', 'concurrency', 'iterations', 'pushed', 'response_bytes', 'size_bytes', 'range_requests', 'quota',
+		   'selects', 'transfers', 'chunk_bytes', 'status_code', 'workers')
+
+
+def flatten(data, prefix=''):
+	"""Numeric leaves of a result tree keyed by their dotted path."""
+	values = {}
+	if isinstance(data, dict):
+		for key, value in data.items():
+			if key.startswith('plugin_'):
+				continue
+			values.update(flatten(value, '%s%s.' % (prefix, key)))
+	elif isinstance(data, (int, float)) and not isinstance(data, bool):
+		values[prefix[:-1]] = data
+	return values
+
+
+def direction(path):
+	"""1 when a larger value is an improvement, -1 when a smaller one is, 0 for run parameters."""
+	names = path.split('.')
+	if names[-1] in NEUTRAL:
+		return 0
+	if any(name in HIGHER_IS_BETTER or name.endswith('_ratio') for name in names):
+		return 1
+	return -1
+
+
+def summarize(results):
+	lines = []
+	for path, value in sorted(flatten(results.get('scenarios', {})).items()):
+		lines.append('%-70s %14s' % (path, _format(value)))
+	return '\n'.join(lines)
+
+
+def compare(baseline, current):
+	old = flatten(baseline.get('scenarios', {}))
+	new = flatten(current.get('scenarios', {}))
+	lines = ['%-70s %14s %14s %9s' % ('metric', _revision(baseline), _revision(current), 'change')]
+	for path in sorted(set(old) & set(new)):
+		before, after = old[path], new[path]
+		if before:
+			change = (after - before) * 100.0 / abs(before)
+			marker = ''
+			if abs(change) >= 5 and direction(path):
+				marker = ' +' if change * direction(path) > 0 else ' -'
+			change = '%+8.1f%%%s' % (change, marker)
+		else:
+			change = ''
+		lines.append('%-70s %14s %14s %s' % (path, _format(before), _format(after), change))
+	return '\n'.join(lines)
+
+
+def _revision(results):
+	return (results.get('meta') or {}).get('revision') or 'baseline'
+
+
+def _format(value):
+	if isinstance(value, float):
+		return '%.6g' % value
+	return str(value)
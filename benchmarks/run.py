@@ -0,0 +1,61 @@
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+
+from benchmarks import report
+from benchmarks.harness import package_revision
+from benchmarks.scenarios import SCENARIOS
+
+DEFAULTS = dict(files=200, commands=500, concurrency=8, iterations=200, messages=400, rate=50, session_samples=28800,
+				joins=5, transfers=3, transfer_mb=128, segment_mb=64, connection_mbps=8, idle_seconds=40)
+QUICK = dict(files=50, commands=60, concurrency=4, iterations=20, messages=60, rate=50, session_samples=2000,
+			 joins=1, transfers=1, transfer_mb=2, segment_mb=8, connection_mbps=8, idle_seconds=40)
+
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(description='Offline Plabric plugin benchmarks against fake Plabric, OctoPrint and Janus servers.')
+	parser.add_argument('--scenarios', default=','.join(sorted(SCENARIOS)), help='Comma separated scenarios (%s)' % ', '.join(sorted(SCENARIOS)))
+	parser.add_argument('--output', help='Write the results as JSON to this file')
+	parser.add_argument('--compare', help='Baseline results JSON to compare against')
+	parser.add_argument('--package-path', help='octoprint_plabric package to benchmark, defaults to the one in this tree')
+	parser.add_argument('--quick', action='store_true', help='Small run for smoke testing')
+	for name, value in sorted(DEFAULTS.items()):
+		parser.add_argument('--%s' % name.replace('_', '-'), type=type(value), default=None)
+	args = parser.parse_args(argv)
+	for name, value in (QUICK if args.quick else DEFAULTS).items():
+		if getattr(args, name) is None:
+			setattr(args, name, value)
+	return args
+
+
+def main(argv=None):
+	args = parse_args(sys.argv[1:] if argv is None else argv)
+	logging.basicConfig(level=logging.WARNING)
+	names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+	unknown = [name for name in names if name not in SCENARIOS]
+	if unknown:
+		sys.exit('Unknown scenarios: %s' % ', '.join(unknown))
+
+	results = {'meta': {'python': sys.version.split()[0], 'platform': platform.platform(), 'revision': package_revision(args.package_path),
+						'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'options': vars(args)},
+			   'scenarios': {}}
+	for name in names:
+		sys.stderr.write('Running %s\n' % name)
+		results['scenarios'][name] = SCENARIOS[name](args)
+
+	print(report.summarize(results))
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(results, f, indent=2, sort_keys=True)
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)
+		print('')
+		print(report.compare(baseline, results))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,492 @@
+import gc
+import json
+import threading
+import time
+import tracemalloc
+
+from benchmarks.fakes.octoprint import file_listing
+from benchmarks.harness import Harness, load_package
+from benchmarks.session import print_session
+
+
+def percentiles(values):
+	if not values:
+		return {'count': 0}
+	ordered = sorted(values)
+
+	def pick(fraction):
+		return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+	return {'count': len(ordered), 'mean': sum(ordered) / len(ordered), 'min': ordered[0], 'max': ordered[-1],
+			'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99)}
+
+
+def _decode(record):
+	data = record.data
+	return json.loads(data) if isinstance(data, (str, bytes)) else data
+
+
+# ~~ api_command round trips (connection reuse, cache and single-flight)
+
+API_COMMAND_VARIANTS = ('pooled_cached', 'pooled_uncached', 'fresh_connections')
+
+
+def api_commands(options):
+	results = {}
+	for variant in API_COMMAND_VARIANTS:
+		overrides = {'OCTOPRINT_CACHE_TTLS': {}} if variant != 'pooled_cached' else {}
+		with Harness(files=options.files, config_overrides=overrides, package_path=options.package_path) as harness:
+			harness.join()
+			if variant == 'fresh_connections':
+				harness.force_fresh_connections()
+			results[variant] = _run_api_commands(harness, count=options.commands, concurrency=options.concurrency,
+												 unique=variant != 'pooled_cached')
+	return results
+
+
+def _run_api_commands(harness, count, concurrency, unique):
+	recorder = harness.plabric.recorder
+	requests_before = harness.octoprint.requests
+	started_at = time.time()
+	sent_at = {}
+	for i in range(count):
+		if i >= concurrency:
+			recorder.wait_for(lambda records, n=i - concurrency + 1: _responses_since(records, started_at) >= n, timeout=30)
+		command = {'bench_id': i, 'api': 'files', 'method': 'get', 'url': '/api/files', 'params': {'recursive': True}}
+		if unique:
+			command['params']['bench'] = i
+		sent_at[i] = time.time()
+		harness.emit('api_command', command)
+	recorder.wait_for(lambda records: _responses_since(records, started_at) >= count, timeout=60)
+	finished_at = time.time()
+
+	latencies = []
+	errors = 0
+	for record in recorder.records('api_command_response', since=started_at):
+		data = _decode(record)
+		if data.get('bench_id') not in sent_at:
+			continue
+		if data.get('status_code') != 200:
+			errors += 1
+		latencies.append(record.time - sent_at[data['bench_id']])
+
+	result = {'commands': count, 'concurrency': concurrency, 'completed': len(latencies), 'errors': errors,
+			  'seconds': finished_at - started_at, 'throughput': len(latencies) / (finished_at - started_at),
+			  'latency': percentiles(latencies), 'octoprint_requests': harness.octoprint.requests - requests_before}
+	stats = harness.stats()
+	for key in ('latency', 'octoprint_cache', 'octoprint_coalescing'):
+		if key in stats:
+			result['plugin_' + key] = stats[key]
+	return result
+
+
+def _responses_since(records, since):
+	return sum(1 for r in records if r.time >= since and r.event == 'api_command_response')
+
+
+# ~~ Response forwarding cost (in-process, no sockets)
+
+def forwarding(options):
+	load_package(options.package_path)
+	import requests
+	from octoprint_plabric.controllers.common import rawjson
+
+	body = json.dumps(file_listing(options.files)).encode('utf-8')
+
+	def response(content=body):
+		resp = requests.Response()
+		resp.status_code = 200
+		resp.headers['Content-Type'] = 'application/json'
+		resp.headers['Content-Length'] = str(len(body))
+		resp._content = content
+		return resp
+
+	def parsed():
+		return json.dumps({'bench_id': 1, 'status_code': 200, 'response': response().json()})
+
+	def raw():
+		return rawjson.dumps({'bench_id': 1, 'status_code': 200, 'response': rawjson.from_response(response())})
+
+	results = {'response_bytes': len(body)}
+	for name, fn in (('parse_and_dump', parsed), ('raw_passthrough', raw)):
+		results[name] = _measure(fn, options.iterations)
+	if results['raw_passthrough']['cpu_per_call']:
+		results['cpu_speedup'] = results['parse_and_dump']['cpu_per_call'] / results['raw_passthrough']['cpu_per_call']
+	if results['raw_passthrough']['peak_bytes']:
+		results['peak_memory_ratio'] = float(results['parse_and_dump']['peak_bytes']) / results['raw_passthrough']['peak_bytes']
+	try:
+		rawjson.from_response(response(body[:len(body) // 2]))
+		results['truncated_rejected'] = False
+	except ValueError:
+		results['truncated_rejected'] = True
+	return results
+
+
+def _measure(fn, iterations):
+	fn()
+	gc.collect()
+	started_at = time.process_time()
+	for _ in range(iterations):
+		fn()
+	cpu = time.process_time() - started_at
+	tracemalloc.start()
+	fn()
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return {'iterations': iterations, 'cpu_per_call': cpu / iterations, 'peak_bytes': peak}
+
+
+# ~~ socket_event relay (event bridge vs SockJS, delta encoding)
+
+SOCKET_EVENT_OVERRIDES = {'THROTTLE_DEFAULT': 1, 'THROTTLE_VISIBLE': 1, 'THROTTLE_HIDDEN': 1,
+						  'THROTTLE_QUEUE_HIGH': 1 << 20, 'THROTTLE_RTT_HIGH': 1e9}
+
+
+def socket_events(options):
+	results = {}
+	for bridge in (True, False):
+		for delta in (False, True):
+			name = '%s_%s' % ('bridge' if bridge else 'sockjs', 'delta' if delta else 'full')
+			with Harness(bridge=bridge, files=options.files, config_overrides=SOCKET_EVENT_OVERRIDES, package_path=options.package_path) as harness:
+				harness.join({'delta': delta})
+				results[name] = _run_socket_events(harness, bridge, options.messages, options.rate)
+	for transport in ('bridge', 'sockjs'):
+		full = results['%s_full' % transport]['bytes']
+		delta = results['%s_delta' % transport]['bytes']
+		results['%s_delta_ratio' % transport] = float(full) / delta if delta else 0.0
+	results['delta_encoder_session'] = _delta_session_ratio(options)
+	return results
+
+
+def _run_socket_events(harness, bridge, count, rate):
+	recorder = harness.plabric.recorder
+	time.sleep(0.2)
+	started_at = time.time()
+	interval = 1.0 / rate if rate else 0
+	for i, sample in enumerate(print_session(count)):
+		if bridge:
+			harness.printer.push(sample)
+		else:
+			sample = dict(sample, serverTime=time.time())
+			harness.octoprint.push({'current': sample})
+		if interval:
+			time.sleep(max(0, started_at + (i + 1) * interval - time.time()))
+	recorder.wait_for(lambda records: _progress_delivered(records, started_at, count), timeout=10)
+	time.sleep(0.2)
+	finished_at = time.time()
+
+	latencies = []
+	size = 0
+	delivered = 0
+	for record in recorder.records('socket_event', since=started_at):
+		message = _decode(record)
+		body = message.get('current') or (message.get('current_delta') or {}).get('patch')
+		if body is None:
+			continue
+		delivered += 1
+		size += record.size
+		if body.get('serverTime'):
+			latencies.append(record.time - body['serverTime'])
+	return {'pushed': count, 'delivered': delivered, 'bytes': size, 'bytes_per_message': float(size) / delivered if delivered else 0,
+			'seconds': finished_at - started_at, 'throughput': delivered / (finished_at - started_at), 'latency': percentiles(latencies),
+			'plugin_delta': harness.stats().get('delta')}
+
+
+def _progress_delivered(records, since, count):
+	for r in reversed(records):
+		if r.time < since:
+			return False
+		if r.event == 'socket_event' and '"printTime": %d' % int((count - 1) * 0.5) in r.data:
+			return True
+	return False
+
+
+def _delta_session_ratio(options):
+	load_package(options.package_path)
+	from octoprint_plabric import config
+	from octoprint_plabric.controllers.octoprint.delta import DeltaEncoder, VOLATILE_KEYS, apply
+
+	encoder = DeltaEncoder(keyframe_interval=config.DELTA_KEYFRAME_INTERVAL, keyframe_seconds=config.DELTA_KEYFRAME_SECONDS)
+	raw = 0
+	encoded = 0
+	mismatches = 0
+	client = None
+	samples = list(print_session(options.session_samples))
+	for sample in samples + [_print_finished(samples[-1])]:
+		raw += len(json.dumps({'current': sample}))
+		message = json.loads(json.dumps(encoder.encode(sample)))
+		encoded += len(json.dumps(message))
+		if 'current' in message:
+			client = message['current']
+		else:
+			delta = message['current_delta']
+			client = apply(client, delta['patch'], delta.get('removed', []))
+		stable = lambda body: dict((k, v) for k, v in body.items() if k not in VOLATILE_KEYS)
+		if stable(client) != json.loads(json.dumps(stable(sample))):
+			mismatches += 1
+	return {'ratio': float(raw) / encoded if encoded else 0.0, 'roundtrip_mismatches': mismatches}
+
+
+def _print_finished(sample):
+	"""The push after a print ends: progress and job values turn null and some keys go away."""
+	finished = json.loads(json.dumps(sample))
+	finished['state'] = {'text': 'Operational', 'flags': dict(finished['state']['flags'], printing=False)}
+	finished['progress'] = dict(finished['progress'], completion=None, printTime=None, printTimeLeft=None)
+	finished['job']['file']['name'] = None
+	del finished['job']['file']['display']
+	del finished['busyFiles']
+	return finished
+
+
+# ~~ User join to live stream
+
+def join(options):
+	"""The relay client asks for video as soon as webrtc_ready arrives; join_to_stream_ready ends at the Janus SDP offer."""
+	samples = {'ready': [], 'first_current': [], 'history_snapshot': [], 'webrtc_ready': [], 'join_to_stream_ready': []}
+	for _ in range(options.joins):
+		with Harness(janus=True, files=options.files, config_overrides=SOCKET_EVENT_OVERRIDES, package_path=options.package_path) as harness:
+			recorder = harness.plabric.recorder
+			joined_at = time.time()
+			harness.emit('user_joined', {'user_nick': 'bench', 'octoprint_api_key': 'bench-octoprint-key', 'stream_config': {'history': 'compact'}})
+			events = {'ready': recorder.wait_event('ready', since=joined_at, timeout=15)}
+			harness.printer.push(next(print_session(1)))
+			events['webrtc_ready'] = recorder.wait_event('webrtc_ready', since=joined_at, timeout=15)
+			if events['webrtc_ready']:
+				harness.emit('video_command', {'enable': True})
+				events['join_to_stream_ready'] = recorder.wait_event('signaling', since=joined_at, timeout=15)
+			events['first_current'] = recorder.wait_event('socket_event', since=joined_at, timeout=5, match=lambda r: r.data.startswith('{"current"'))
+			events['history_snapshot'] = recorder.wait_event('socket_event', since=joined_at, timeout=5, match=lambda r: 'historySnapshot' in r.data)
+			for name, record in events.items():
+				if record is not None:
+					samples[name].append(record.time - joined_at)
+	return dict((name, percentiles(values)) for name, values in samples.items())
+
+
+# ~~ Plabric download to OctoPrint upload
+
+TRANSFER_VARIANTS = (
+	('stable', {'digest': True}),
+	('dropped_with_ranges', {'digest': True, 'drops': 3, 'ranges': True}),
+	('dropped_without_ranges', {'digest': True, 'drops': 3, 'ranges': False}),
+)
+TRANSFER_OVERRIDES = {'DOWNLOAD_RETRY_BASE': 0.05, 'DOWNLOAD_RETRY_CAP': 0.5, 'DOWNLOAD_SEGMENTS': 1}
+SEGMENT_COUNTS = (1, 2, 4, 8)
+
+
+def transfer(options):
+	"""End-to-end time and RSS growth of the benchmark process (plugin and fakes) while a file moves from Plabric to OctoPrint.
+
+	The dropped variants cut the first three download responses a quarter of the way in, with and without Range support.
+	"""
+	size = options.transfer_mb * 1024 * 1024
+	results = {'size_bytes': size}
+	for name, download_options in TRANSFER_VARIANTS:
+		download_options = dict(download_options, drop_after=size // 4)
+		with Harness(files=options.files, download_size=size, download_options=download_options, config_overrides=TRANSFER_OVERRIDES,
+					 package_path=options.package_path) as harness:
+			results[name] = _run_transfers(harness, size, options.transfers)
+	return results
+
+
+def segments(options):
+	"""Transfer MB/s by number of concurrent download ranges, with each download connection capped at ``connection_mbps``."""
+	size = options.segment_mb * 1024 * 1024
+	rate = options.connection_mbps * 1024 * 1024
+	results = {'size_bytes': size}
+	for count in SEGMENT_COUNTS:
+		overrides = dict(TRANSFER_OVERRIDES, DOWNLOAD_SEGMENTS=count, DOWNLOAD_SEGMENT_MIN_SIZE=min(size // count, 1024 * 1024))
+		with Harness(files=options.files, download_size=size, download_options={'connection_rate': rate}, config_overrides=overrides,
+					 package_path=options.package_path) as harness:
+			result = _run_transfers(harness, size, options.transfers)
+			result['range_requests'] = harness.plabric.range_requests
+		results['segments_%d' % count] = result
+	return results
+
+
+CACHE_VARIANTS = (('announced_digest', {'digest': True}), ('etag_only', {}))
+
+
+def cache(options):
+	"""Repeat prints of one file: the first transfer fills the G-code cache, the repeats skip the download and the upload."""
+	size = options.transfer_mb * 1024 * 1024
+	results = {'size_bytes': size}
+	for name, download_options in CACHE_VARIANTS:
+		with Harness(files=options.files, download_size=size, download_options=download_options, config_overrides=TRANSFER_OVERRIDES,
+					 package_path=options.package_path) as harness:
+			result = _run_transfers(harness, size, options.transfers + 1, file_id='bench-repeat')
+			result['first_seconds'] = result['runs'][0].get('seconds')
+			result['repeat_seconds'] = percentiles([r['seconds'] for r in result['runs'][1:] if 'seconds' in r])
+			result['uploads'] = harness.octoprint.uploads
+			result['selects'] = harness.octoprint.selects
+			result['file_cache'] = harness.stats().get('file_cache')
+		results[name] = result
+	return results
+
+
+TRANSFERS_OVERRIDES = dict(TRANSFER_OVERRIDES, FILE_CACHE_QUOTA=0, DOWNLOAD_SEGMENTS=4, DOWNLOAD_SEGMENT_MIN_SIZE=1024 * 1024,
+						   TRANSFER_WORKERS=2, TRANSFER_QUEUE=8, TRANSFER_PROGRESS_INTERVAL=0.25)
+
+
+def transfers(options):
+	"""Concurrent uploads of one file, cancelling a running transfer, and the CPU cost of progress accounting.
+
+	Downloads are capped at ``connection_mbps`` per connection and the cache is off so the transfers overlap; they are
+	segmented, so every transfer stages the same file id on disk.
+	"""
+	size = options.segment_mb * 1024 * 1024
+	rate = options.connection_mbps * 1024 * 1024
+	results = {'size_bytes': size, 'progress': _progress_cost(options)}
+	with Harness(files=options.files, download_size=size, download_options={'connection_rate': rate}, config_overrides=TRANSFERS_OVERRIDES,
+				 package_path=options.package_path) as harness:
+		harness.join()
+		results['concurrent'] = _run_concurrent(harness, size, max(4, options.transfers * 2))
+		results['cancel'] = _run_cancel(harness)
+		results['manager'] = harness.stats().get('transfers')
+	return results
+
+
+def _run_concurrent(harness, size, count):
+	recorder = harness.plabric.recorder
+	started_at = time.time()
+	for i in range(count):
+		harness.emit('api_command', {'bench_id': i, 'api': 'files', 'method': 'post', 'url': '/api/files/local',
+									 'params': {'file_id': 'bench-shared', 'file_name': 'shared_%d' % i}})
+	done = recorder.wait_for(lambda records: len([r for r in records if r.time >= started_at and r.event == 'api_command_response']) >= count
+							 or None, timeout=600)
+	responses = [_decode(r) for r in recorder.records('api_command_response', since=started_at)]
+	events = [_decode(r) for r in recorder.records('transfer_progress', since=started_at)]
+	stored = [harness.octoprint.stored.get('plabric/tmp/shared_%d.gcode' % i, {}).get('size') for i in range(count)]
+	return {'transfers': count, 'seconds': time.time() - started_at if done else None,
+			'failed': len([r for r in responses if r.get('status_code') != 200]) + count - len(responses),
+			'corrupted': len([s for s in stored if s != size]), 'progress_events': len(events)}
+
+
+def _run_cancel(harness):
+	recorder = harness.plabric.recorder
+	started_at = time.time()
+	harness.emit('api_command', {'bench_id': 'cancel', 'api': 'files', 'method': 'post', 'url': '/api/files/local',
+								 'params': {'file_id': 'bench-cancel', 'file_name': 'cancel'}})
+	running = recorder.wait_event('transfer_progress', since=started_at, timeout=60,
+								  match=lambda r: _decode(r).get('file_name') == 'cancel' and _decode(r).get('state') == 'downloading')
+	if running is None:
+		return {'error': 'timeout'}
+	cancelled_at = time.time()
+	harness.plabric.emit('transfer_cancel', {'transfer_id': _decode(running)['transfer_id']})
+	done = recorder.wait_event('api_command_response', since=started_at, timeout=60, match=lambda r: _decode(r).get('bench_id') == 'cancel')
+	if done is None:
+		return {'error': 'timeout'}
+	return {'cancel_seconds': done.time - cancelled_at, 'status_code': _decode(done).get('status_code')}
+
+
+def _progress_cost(options):
+	"""CPU per Transfer.advance call, with a progress event every call and with the throttle holding them back."""
+	load_package(options.package_path)
+	from octoprint_plabric.controllers.plabric.transfers import Transfer
+
+	calls = options.iterations * 1000
+	results = {'chunk_bytes': 65536}
+	for name, interval in (('every_chunk', 0), ('throttled', 1.0)):
+		transfer = Transfer({'params': {'file_id': 'bench'}}, send=lambda progress: None, on_succeed=None, on_error=None, interval=interval)
+		transfer.start('transferring', size=calls * 65536)
+		started_at = time.process_time()
+		for _ in range(calls):
+			transfer.advance(65536)
+		results[name] = {'cpu_per_call': (time.process_time() - started_at) / calls}
+	results['cpu_per_gb'] = results['throttled']['cpu_per_call'] * (1 << 30) / 65536
+	return results
+
+
+def _run_transfers(harness, size, count, file_id=None):
+	from octoprint_plabric.controllers.common.utils import process_stats
+
+	harness.join()
+	recorder = harness.plabric.recorder
+	downloads_before = harness.stats().get('downloads') or {}
+	runs = []
+	for i in range(count):
+		uploaded_before = harness.octoprint.uploaded_bytes
+		served_before = harness.plabric.served_bytes
+		sampler = RssSampler(process_stats)
+		started_at = time.time()
+		harness.emit('api_command', {'bench_id': i, 'api': 'files', 'method': 'post', 'url': '/api/files/local',
+									 'params': {'file_id': file_id or 'bench-%d' % i, 'file_name': file_id or 'bench_%d' % i}})
+		done = recorder.wait_event('api_command_response', since=started_at, timeout=600,
+								   match=lambda r, i=i: _decode(r).get('bench_id') == i)
+		growth = sampler.stop()
+		if done is None:
+			runs.append({'error': 'timeout'})
+			continue
+		seconds = done.time - started_at
+		progress = [r for r in recorder.records('transfer_progress', since=started_at) if _decode(r).get('file_name') == (file_id or 'bench_%d' % i)]
+		runs.append({'seconds': seconds, 'mb_per_second': size / seconds / 1024 / 1024, 'status_code': _decode(done).get('status_code'),
+					 'progress_events': len(progress), 'uploaded_bytes': harness.octoprint.uploaded_bytes - uploaded_before,
+					 'served_bytes': harness.plabric.served_bytes - served_before, 'rss_growth_kb': growth})
+	completed = [r for r in runs if 'seconds' in r]
+	result = {'runs': runs, 'seconds': percentiles([r['seconds'] for r in completed]),
+			  'mb_per_second': percentiles([r['mb_per_second'] for r in completed]),
+			  'rss_growth_kb': max([r['rss_growth_kb'] for r in completed] or [0]),
+			  'failed': len([r for r in runs if r.get('status_code') != 200])}
+	downloads = harness.stats().get('downloads')
+	if downloads:
+		result['downloads'] = dict((key, value - downloads_before.get(key, 0)) for key, value in downloads.items())
+	return result
+
+
+class RssSampler(object):
+
+	def __init__(self, process_stats, interval=0.01):
+		self._process_stats = process_stats
+		self._interval = interval
+		self._baseline = process_stats().get('rss_kb', 0)
+		self._peak = self._baseline
+		self._stopped = threading.Event()
+		self._thread = threading.Thread(target=self._run, name='RssSampler')
+		self._thread.daemon = True
+		self._thread.start()
+
+	def _run(self):
+		while not self._stopped.wait(self._interval):
+			self._peak = max(self._peak, self._process_stats().get('rss_kb', 0))
+
+	def stop(self):
+		self._stopped.set()
+		self._thread.join()
+		return self._peak - self._baseline
+
+
+# ~~ Idle footprint
+
+def footprint(options):
+	"""Threads and RSS growth of the plugin after a user joins and runs a few commands, then after ``idle_seconds`` without work.
+
+	RSS is the whole benchmark process minus its size before ``Main`` was created, so it includes the fakes' buffers.
+	"""
+	with Harness(janus=True, files=options.files, package_path=options.package_path) as harness:
+		harness.join()
+		_run_api_commands(harness, count=options.concurrency * 4, concurrency=options.concurrency, unique=True)
+		results = {'active': _footprint(harness)}
+		time.sleep(options.idle_seconds)
+		results['idle'] = _footprint(harness)
+		results['idle_seconds'] = options.idle_seconds
+	return results
+
+
+def _footprint(harness):
+	from benchmarks.harness import rss_kb
+
+	gc.collect()
+	threads = harness.plugin_threads()
+	return {'threads': len(threads), 'thread_names': sorted(t.name for t in threads), 'rss_growth_kb': rss_kb() - harness.rss_kb_before}
+
+
+SCENARIOS = {
+	'api_commands': api_commands,
+	'forwarding': forwarding,
+	'socket_events': socket_events,
+	'join': join,
+	'transfer': transfer,
+	'segments': segments,
+	'cache': cache,
+	'transfers': transfers,
+	'footprint': footprint,
+}
@@ -0,0 +1,47 @@
+import random
+
+LAYER_HEIGHT = 0.2
+
+
+def print_session(count, seed=1, interval=0.5):
+	"""Deterministic stand-in for a recorded print: OctoPrint 'current' payloads every ``interval`` seconds.
+
+	Temperatures jitter on every sample, progress and position move slowly and state/job blocks almost never change,
+	which is the shape of a real long print as seen on the SockJS socket.
+	"""
+	rng = random.Random(seed)
+	started_at = 1600000000.0
+	job = {
+		'file': {'name': 'bench_part.gcode', 'display': 'bench_part.gcode', 'path': 'plabric/bench_part.gcode',
+				 'origin': 'local', 'size': 12582912, 'date': 1599999000},
+		'estimatedPrintTime': 4 * 3600.0,
+		'averagePrintTime': None,
+		'lastPrintTime': None,
+		'filament': {'tool0': {'length': 15234.2, 'volume': 36.6}},
+		'user': 'bench',
+	}
+	state = {'text': 'Printing', 'flags': {'operational': True, 'printing': True, 'paused': False, 'pausing': False,
+										  'cancelling': False, 'sdReady': True, 'error': False, 'ready': True, 'closedOrError': False}}
+	offsets = {}
+	z = LAYER_HEIGHT
+	for i in range(count):
+		now = started_at + i * interval
+		completion = 100.0 * i / max(count, 1)
+		if rng.random() < 0.02:
+			z = round(z + LAYER_HEIGHT, 2)
+		tool = 210.0 + rng.uniform(-0.6, 0.6)
+		bed = 60.0 + rng.uniform(-0.3, 0.3)
+		yield {
+			'state': state,
+			'job': job,
+			'currentZ': z,
+			'progress': {'completion': completion, 'filepos': int(12582912 * completion / 100), 'printTime': int(i * interval),
+						 'printTimeLeft': int((count - i) * interval), 'printTimeLeftOrigin': 'estimate'},
+			'offsets': offsets,
+			'resends': {'count': 0, 'transmitted': i * 40, 'ratio': 0},
+			'temps': [{'time': int(now), 'tool0': {'actual': round(tool, 2), 'target': 210.0}, 'bed': {'actual': round(bed, 2), 'target': 60.0}}],
+			'logs': ['Send: N%d G1 X%.3f Y%.3f E%.5f*%d' % (i, rng.uniform(50, 150), rng.uniform(30, 150), rng.uniform(0, 2), i % 97),
+					 'Recv: ok'],
+			'messages': [],
+			'busyFiles': [{'origin': 'local', 'path': 'plabric/bench_part.gcode'}],
+		}
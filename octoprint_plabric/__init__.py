@@ -1,12 +1,13 @@
 # coding=utf-8
 from __future__ import absolute_import
 
+import flask
 import octoprint.plugin
 from octoprint.server import admin_permission
 from octoprint.settings import settings
 
 from octoprint_plabric import config
-from octoprint_plabric.controllers.common import logger as _logger, utils as _utils, storage as _storage
+from octoprint_plabric.controllers.common import logger as _logger, utils as _utils, storage as _storage, tracing as _tracing
 from octoprint_plabric.controllers.main import Step, Main
 import json as _json
 
@@ -25,6 +26,9 @@ class PlabricPlugin(octoprint.plugin.SettingsPlugin,
 		self._main = None
 
 	def on_event(self, event, payload):
+		if self._main:
+			self._main.on_octoprint_event(event, payload)
+
 		if event == 'ClientOpened':
 			self.update_ui_status()
 		elif event == 'PrintDone':
@@ -43,7 +47,7 @@ class PlabricPlugin(octoprint.plugin.SettingsPlugin,
 	def on_shutdown(self):
 		_logger.log('On Plabric Shutdown')
 		if self._main:
-			self._main.disconnect()
+			self._main.shutdown()
 
 	def get_host(self):
 		if self._host is None or len(self._host) == 0 or self._host =="::":
@@ -58,6 +62,15 @@ class PlabricPlugin(octoprint.plugin.SettingsPlugin,
 			pass
 		return None
 
+	def get_printer(self):
+		return self._printer
+
+	def get_plugin_manager(self):
+		return self._plugin_manager
+
+	def get_file_manager(self):
+		return self._file_manager
+
 	def get_webcam_params(self):
 		return settings().get(["webcam"])
 
@@ -79,9 +92,11 @@ class PlabricPlugin(octoprint.plugin.SettingsPlugin,
 
 	def get_template_vars(self):
 		if self._main:
-			return dict(plabric_token=self._main.plabric_token, step=self._main.step.value, status=self._main.get_status(), error=self._main.error, loading=self._main.loading, navbar_enabled=self.get_navbar_enabled())
+			return dict(plabric_token=self._main.plabric_token, step=self._main.step.value, status=self._main.get_status(), error=self._main.error, loading=self._main.loading, navbar_enabled=self.get_navbar_enabled(),
+						profiling=self._main.profiler.running(), tracing_enabled=_tracing.TRACER.enabled)
 		else:
-			return dict(plabric_token=None, step=Step.LOGIN_NEEDED.value, status='Login need', error='', loading=False, navbar_enabled=self.get_navbar_enabled())
+			return dict(plabric_token=None, step=Step.LOGIN_NEEDED.value, status='Login need', error='', loading=False, navbar_enabled=self.get_navbar_enabled(),
+						profiling=False, tracing_enabled=False)
 
 	# ~~ AssetPlugin mixin
 	def get_assets(self):
@@ -115,6 +130,16 @@ class PlabricPlugin(octoprint.plugin.SettingsPlugin,
 	def status_data(self):
 		return _json.dumps(self.get_template_vars())
 
+	@octoprint.plugin.BlueprintPlugin.route("/stats", methods=["GET"])
+	@admin_permission.require(403)
+	def stats_data(self):
+		return _json.dumps(self._main.get_stats() if self._main else {})
+
+	@octoprint.plugin.BlueprintPlugin.route("/metrics", methods=["GET"])
+	@admin_permission.require(403)
+	def metrics_data(self):
+		return flask.Response(self._main.get_metrics() if self._main else '', mimetype='text/plain; version=0.0.4')
+
 	@octoprint.plugin.BlueprintPlugin.route("/authorize", methods=["POST"])
 	@admin_permission.require(403)
 	def oauth_octoprint(self):
@@ -141,6 +166,27 @@ class PlabricPlugin(octoprint.plugin.SettingsPlugin,
 		self.update_ui_status()
 		return ''
 
+	@octoprint.plugin.BlueprintPlugin.route("/profile", methods=["POST"])
+	@admin_permission.require(403)
+	def profile(self):
+		data = flask.request.get_json(silent=True) or {}
+		seconds = data.get('seconds') if isinstance(data, dict) else None
+		if seconds is not None:
+			try:
+				seconds = float(seconds)
+			except (TypeError, ValueError):
+				flask.abort(400)
+			if not seconds > 0:
+				flask.abort(400)
+		started = self._main.start_profile(seconds=seconds)
+		return _json.dumps(dict(started=started))
+
+	@octoprint.plugin.BlueprintPlugin.route("/tracing/switch", methods=["POST"])
+	@admin_permission.require(403)
+	def tracing_switch(self):
+		self._main.set_tracing(not _tracing.TRACER.enabled)
+		return ''
+
 # If you want your plugin to be registered within OctoPrint under a different name than what you defined in setup.py
 # ("OctoPrint-PluginSkeleton"), you may define that here. Same goes for the other metadata derived from setup.py that
 # can be overwritten via __plugin_xyz__ control properties. See the documentation for that.
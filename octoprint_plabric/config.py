@@ -11,3 +11,142 @@ JANUS_DIR = os.path.join(BASE_DIR, 'bin', 'janus')
 JANUS_RUN_LOCAL = True
 JANUS_HOST = 'localhost'
 JANUS_VIDEO_HOST = 'localhost'
+
+# HTTP sessions: (connect, read) timeouts in seconds per request class
+API_TIMEOUTS = {
+	'octoprint': (2, 30),
+	'plabric': (5, 20),
+	'upload': (2, 600),
+	'download': (10, 60),
+}
+API_POOL_CONNECTIONS = 2
+API_POOL_MAXSIZE = 8
+API_MAX_RETRIES = 2
+API_RETRY_BACKOFF = 0.3
+
+# Relayed api_command execution
+API_COMMAND_WORKERS = 4
+API_COMMAND_QUEUE = 64
+API_COMMAND_DEADLINE = 60
+
+# Relayed OctoPrint GET responses: TTL in seconds per resource family
+OCTOPRINT_CACHE_TTLS = {
+	'/api/version': 300,
+	'/api/settings': 30,
+	'/api/printerprofiles': 30,
+	'/api/files': 10,
+	'/api/connection': 5,
+	'/api/printer': 1,
+	'/api/job': 1,
+}
+OCTOPRINT_CACHE_MAX_ENTRIES = 64
+OCTOPRINT_CACHE_RELATED = {
+	'/api/job': ['/api/printer', '/api/files'],
+	'/api/printer': ['/api/job'],
+	'/api/connection': ['/api/printer', '/api/job'],
+	'/api/printerprofiles': ['/api/printer', '/api/connection'],
+}
+OCTOPRINT_CACHE_EVENTS = {
+	'UpdatedFiles': ['/api/files'],
+	'FileAdded': ['/api/files'],
+	'FileRemoved': ['/api/files'],
+	'FolderAdded': ['/api/files'],
+	'FolderRemoved': ['/api/files'],
+	'MetadataAnalysisFinished': ['/api/files'],
+	'MetadataStatisticsUpdated': ['/api/files'],
+	'SettingsUpdated': ['/api/settings'],
+	'PrinterProfileAdded': ['/api/printerprofiles'],
+	'PrinterProfileModified': ['/api/printerprofiles'],
+	'PrinterProfileDeleted': ['/api/printerprofiles'],
+	'Connected': ['/api/connection'],
+	'Disconnected': ['/api/connection'],
+	'PrinterStateChanged': ['/api/printer'],
+	'FileSelected': ['/api/job'],
+	'FileDeselected': ['/api/job'],
+	'PrintStarted': ['/api/job'],
+	'PrintDone': ['/api/job'],
+	'PrintFailed': ['/api/job'],
+	'PrintCancelled': ['/api/job'],
+	'PrintPaused': ['/api/job'],
+	'PrintResumed': ['/api/job'],
+}
+
+# Plabric socket payload encoding, used only when the server advertises support
+SOCKET_COMPRESSION_THRESHOLD = 1024
+SOCKET_COMPRESSION_LEVEL = 6
+
+# Plabric socket outbound queue: byte budget and message limit per priority class
+# (signaling, command, status, telemetry)
+OUTBOUND_MAX_BYTES = 4 * 1024 * 1024
+OUTBOUND_MAX_MESSAGES = [256, 256, 64, 16]
+
+# Delta encoding of OctoPrint 'current' pushes, enabled per remote client via stream_config
+DELTA_KEYFRAME_INTERVAL = 60
+DELTA_KEYFRAME_SECONDS = 60
+
+# OctoPrint push throttle factor (1 = every 500 ms), adapted to remote client demand and link quality
+THROTTLE_DEFAULT = 10
+THROTTLE_VISIBLE = 2
+THROTTLE_HIDDEN = 30
+THROTTLE_MAX = 60
+THROTTLE_QUEUE_HIGH = 8
+THROTTLE_RTT_HIGH = 1.0
+THROTTLE_MIN_INTERVAL = 10
+
+# Relay OctoPrint push messages from inside the plugin process instead of the loopback SockJS websocket
+OCTOPRINT_EVENT_BRIDGE = True
+
+# Terminal lines kept in the plugin and served by the terminal api_command path
+TERMINAL_LOG_SIZE = 2000
+TERMINAL_PAGE_MAX = 500
+TERMINAL_PATH = '/plugin/Plabric/terminal'
+
+# Temperature/progress history tiers kept in the plugin: (resolution in seconds, samples)
+HISTORY_TIERS = [(1, 600), (10, 720), (60, 1440)]
+
+# Plabric server reconnect: decorrelated jitter backoff bounds and network route polling, in seconds
+RECONNECT_BACKOFF_BASE = 15
+RECONNECT_BACKOFF_CAP = 720
+NETWORK_WATCH_INTERVAL = 5
+
+# Workers running scheduled tasks (connects, OAuth polling, probes) off the event loop; a stuck connect and its retry leave one free
+SCHEDULER_WORKERS = 3
+SCHEDULER_QUEUE = 32
+
+# Seconds a worker thread of the task, command and transfer executors waits for work before it exits
+WORKER_IDLE_TIMEOUT = 30
+
+# Relay latency probe: ping_probe interval in seconds, unanswered probes kept, samples kept per latency histogram
+PROBE_INTERVAL = 15
+PROBE_PENDING_MAX = 8
+LATENCY_WINDOW = 512
+
+# api_command tracing (off until switched on from settings) and sampling profiler, in seconds
+TRACE_RECENT = 50
+PROFILE_INTERVAL = 0.01
+PROFILE_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+
+# File transfers: bytes read from the Plabric download and written to the OctoPrint upload at a time
+TRANSFER_CHUNK_SIZE = 64 * 1024
+
+# File downloads: resume attempts without progress after a dropped connection and their backoff bounds in seconds
+DOWNLOAD_RETRIES = 5
+DOWNLOAD_RETRY_BASE = 1
+DOWNLOAD_RETRY_CAP = 30
+
+# File downloads: concurrent byte ranges for large files (1 disables them) and the smallest range worth its own connection
+DOWNLOAD_SEGMENTS = 4
+DOWNLOAD_SEGMENT_MIN_SIZE = 8 * 1024 * 1024
+
+# File downloads: largest read in bytes and the time in seconds each read should take as the read size adapts
+DOWNLOAD_CHUNK_MAX = 1024 * 1024
+DOWNLOAD_CHUNK_TIME = 0.1
+
+# File transfers: transfers run at once, transfers waiting for a worker, and seconds between progress events of a transfer
+TRANSFER_WORKERS = 2
+TRANSFER_QUEUE = 8
+TRANSFER_PROGRESS_INTERVAL = 1.0
+
+# File cache: disk space in bytes kept for downloaded G-code files, least recently used evicted first (0 disables it)
+FILE_CACHE_QUOTA = 512 * 1024 * 1024
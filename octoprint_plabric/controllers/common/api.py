@@ -1,7 +1,45 @@
-
 import requests
+from requests.adapters import HTTPAdapter
+
+from octoprint_plabric import config
+from octoprint_plabric.controllers.common import logger as _logger, metrics as _metrics, rawjson as _rawjson, tracing as _tracing
+
+try:
+	from urllib3.util.retry import Retry
+except ImportError:
+	from requests.packages.urllib3.util.retry import Retry
+
+
+IDEMPOTENT_METHODS = frozenset(['HEAD', 'GET', 'PUT', 'DELETE', 'OPTIONS'])
+
+_responses = _metrics.REGISTRY.counter('plabric_http_responses_total', 'HTTP responses received', ('api', 'status'))
+_response_bytes = _metrics.REGISTRY.counter('plabric_http_response_bytes_total', 'HTTP response body bytes received', ('api', ))
+_transfer_bytes = _metrics.REGISTRY.counter('plabric_transfer_bytes_total', 'File transfer bytes', ('direction', ))
+_transfer_seconds = _metrics.REGISTRY.counter('plabric_transfer_seconds_total', 'Time spent in file transfers', ('direction', ))
+
+
+def count_transfer(direction, size, seconds):
+	_transfer_bytes.inc((direction, ), size)
+	_transfer_seconds.inc((direction, ), seconds)
+
 
-from octoprint_plabric.controllers.common import logger as _logger
+def create_session(pool_connections=None, pool_maxsize=None, max_retries=None):
+	pool_connections = pool_connections if pool_connections is not None else config.API_POOL_CONNECTIONS
+	pool_maxsize = pool_maxsize if pool_maxsize is not None else config.API_POOL_MAXSIZE
+	max_retries = max_retries if max_retries is not None else config.API_MAX_RETRIES
+
+	retry_args = dict(total=max_retries, connect=max_retries, read=max_retries, status=0, redirect=3,
+					  backoff_factor=config.API_RETRY_BACKOFF, raise_on_status=False)
+	try:
+		retry = Retry(allowed_methods=IDEMPOTENT_METHODS, **retry_args)
+	except TypeError:
+		retry = Retry(method_whitelist=IDEMPOTENT_METHODS, **retry_args)
+
+	adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+	session = requests.Session()
+	session.mount('http://', adapter)
+	session.mount('https://', adapter)
+	return session
 
 
 class APIProtocol:
@@ -15,42 +53,72 @@ class APIProtocol:
 
 class API(object):
 
-	def __init__(self, domain, name):
+	def __init__(self, domain, name, timeout_class=None):
 		self._domain = domain
 		self._name = name
+		self._timeout = config.API_TIMEOUTS.get(timeout_class)
+		self._session = create_session()
 		_logger.log('%s: Initializing' % name)
 
 	def _get_url(self, path):
 		return "%s%s" % (self._domain, path)
 
-	def get(self, path, params=None, headers=None, callback=None):
+	def get_timeout(self, timeout_class=None):
+		if timeout_class:
+			return config.API_TIMEOUTS.get(timeout_class, self._timeout)
+		return self._timeout
+
+	def close(self):
+		self._session.close()
+
+	def get(self, path, params=None, headers=None, callback=None, raw=False):
 		_logger.log('%s: Get - %s' % (self._name, self._get_url(path)))
-		self._execute(requests.get(self._get_url(path), params=params, headers=headers), callback)
+		self._request('get', path, callback, raw=raw, params=params, headers=headers)
 
-	def post(self, path, params=None, headers=None, callback=None):
+	def post(self, path, params=None, headers=None, callback=None, raw=False):
 		_logger.log('%s: Post - %s' % (self._name, self._get_url(path)))
-		self._execute(requests.post(self._get_url(path), json=params, headers=headers), callback)
+		self._request('post', path, callback, raw=raw, json=params, headers=headers)
 
-	def put(self, path, params=None, headers=None, callback=None):
+	def put(self, path, params=None, headers=None, callback=None, raw=False):
 		_logger.log('%s: Put - %s' % (self._name, self._get_url(path)))
-		self._execute(requests.put(self._get_url(path), json=params, headers=headers), callback)
+		self._request('put', path, callback, raw=raw, json=params, headers=headers)
 
-	def patch(self, path, params=None, headers=None, callback=None):
+	def patch(self, path, params=None, headers=None, callback=None, raw=False):
 		_logger.log('%s: Patch - %s' % (self._name, self._get_url(path)))
-		self._execute(requests.patch(self._get_url(path), json=params, headers=headers), callback)
+		self._request('patch', path, callback, raw=raw, json=params, headers=headers)
 
-	def delete(self, path, params=None, headers=None, callback=None):
+	def delete(self, path, params=None, headers=None, callback=None, raw=False):
 		_logger.log('%s: Delete - %s' % (self._name, self._get_url(path)))
-		self._execute(requests.delete(self._get_url(path), json=params, headers=headers), callback)
+		self._request('delete', path, callback, raw=raw, json=params, headers=headers)
+
+	def _request(self, method, path, callback=None, timeout_class=None, raw=False, **kwargs):
+		trace = _tracing.current()
+		try:
+			with trace.span('http'):
+				resp = self._session.request(method, self._get_url(path), timeout=self.get_timeout(timeout_class), **kwargs)
+		except requests.exceptions.Timeout as e:
+			_logger.log('%s: Timeout - %s' % (self._name, e))
+			if callback:
+				callback.on_error(504)
+			return
+		except requests.exceptions.RequestException as e:
+			_logger.log('%s: Error - %s' % (self._name, e))
+			if callback:
+				callback.on_error(503)
+			return
+		with trace.span('execute'):
+			self._execute(resp, callback, raw=raw)
 
-	def _execute(self, resp, callback=None):
+	def _execute(self, resp, callback=None, raw=False):
 		try:
 			status = resp.status_code
+			_responses.inc((self._name, status))
+			_response_bytes.inc((self._name, ), len(resp.content or b''))
 			if 200 <= status < 300:
 				_logger.log('%s: Succeed - %d' % (self._name, status))
 				if callback:
 					try:
-						callback.on_succeed(resp.json())
+						callback.on_succeed(_rawjson.from_response(resp) if raw else resp.json())
 					except Exception as e:
 						callback.on_succeed(None)
 			else:
@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import deque
+
+from octoprint_plabric.controllers.common import logger as _logger
+
+
+class Task(object):
+
+	def __init__(self, target, args=(), deadline=None, group=None, on_expired=None):
+		self.target = target
+		self.args = args
+		self.deadline = deadline
+		self.group = group
+		self.on_expired = on_expired
+		self.cancelled = False
+		self.settled = False
+		self.submitted_at = time.time()
+		self.started_at = None
+		self._lock = threading.Lock()
+
+	def cancel(self):
+		self.cancelled = True
+
+	def settle(self):
+		"""True for the first caller only, so a running task's answer and its deadline can race without answering twice."""
+		with self._lock:
+			if self.settled:
+				return False
+			self.settled = True
+			return True
+
+	def expired(self):
+		return self.deadline is not None and time.time() > self.deadline
+
+	def remaining(self):
+		if self.deadline is None:
+			return None
+		return max(0.0, self.deadline - time.time())
+
+
+class Executor(object):
+	"""Bounded queue of tasks run by up to ``workers`` threads.
+
+	Threads are started only when every existing one is busy, and exit after ``idle_timeout`` seconds without work
+	(never when it is None).
+	"""
+
+	def __init__(self, name, workers, max_queue, idle_timeout=None):
+		self._name = name
+		self._workers = workers
+		self._max_queue = max_queue
+		self._idle_timeout = idle_timeout
+		self._queue = deque()
+		self._threads = []
+		self._idle = 0
+		self._started = 0
+		self._pending = set()
+		self._running = set()
+		self._lock = threading.Lock()
+		self._condition = threading.Condition(self._lock)
+		self._completed = 0
+		self._expired = 0
+		self._cancelled = 0
+		self._rejected = 0
+		self._failed = 0
+
+	def submit(self, target, args=(), deadline=None, group=None, on_expired=None):
+		task = Task(target=target, args=args, deadline=deadline, group=group, on_expired=on_expired)
+		with self._lock:
+			if len(self._queue) >= self._max_queue:
+				self._rejected += 1
+				_logger.warn('%s: Queue full, task rejected' % self._name)
+				return None
+			self._queue.append(task)
+			self._pending.add(task)
+			if len(self._queue) > self._idle and len(self._threads) < self._workers:
+				self._start_worker()
+			self._condition.notify()
+		return task
+
+	def _start_worker(self):
+		self._started += 1
+		thread = threading.Thread(target=self._work, name='%s-%d' % (self._name, self._started))
+		thread.daemon = True
+		self._threads.append(thread)
+		thread.start()
+
+	def cancel(self, group=None):
+		with self._lock:
+			tasks = list(self._pending) + list(self._running)
+		for task in tasks:
+			if group is None or task.group == group:
+				task.cancel()
+
+	def _work(self):
+		while True:
+			task = self._next()
+			if task is None:
+				return
+			self._run(task)
+
+	def _next(self):
+		with self._lock:
+			self._idle += 1
+			try:
+				until = time.time() + self._idle_timeout if self._idle_timeout else None
+				while not self._queue:
+					remaining = until - time.time() if until is not None else None
+					if remaining is not None and remaining <= 0:
+						self._threads.remove(threading.current_thread())
+						return None
+					self._condition.wait(remaining)
+				return self._queue.popleft()
+			finally:
+				self._idle -= 1
+
+	def _run(self, task):
+		with self._lock:
+			self._pending.discard(task)
+		if task.cancelled:
+			with self._lock:
+				self._cancelled += 1
+			return
+		if task.expired():
+			with self._lock:
+				self._expired += 1
+			if task.on_expired:
+				try:
+					task.on_expired()
+				except Exception as e:
+					_logger.warn(e)
+			return
+
+		task.started_at = time.time()
+		with self._lock:
+			self._running.add(task)
+		try:
+			task.target(*task.args, task=task)
+			with self._lock:
+				self._completed += 1
+		except Exception as e:
+			_logger.warn('%s: Task failed - %s' % (self._name, e))
+			with self._lock:
+				self._failed += 1
+		finally:
+			with self._lock:
+				self._running.discard(task)
+
+	def get_stats(self):
+		with self._lock:
+			return dict(workers=self._workers, threads=len(self._threads), queue_depth=len(self._queue), in_flight=len(self._running),
+						completed=self._completed, expired=self._expired, cancelled=self._cancelled,
+						rejected=self._rejected, failed=self._failed)
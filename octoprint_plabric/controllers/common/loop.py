@@ -0,0 +1,175 @@
+import heapq
+import itertools
+import os
+import select
+import threading
+import time
+
+from octoprint_plabric.controllers.common import logger as _logger
+
+try:
+	import asyncio
+except ImportError:
+	asyncio = None
+
+
+class Handle(object):
+
+	def __init__(self, fn, args):
+		self._fn = fn
+		self._args = args
+		self.cancelled = False
+
+	def cancel(self):
+		self.cancelled = True
+
+	def run(self):
+		if self.cancelled:
+			return
+		try:
+			self._fn(*self._args)
+		except Exception as e:
+			_logger.warn(e)
+
+
+class EventLoop(object):
+
+	def __init__(self, name):
+		self._name = name
+		self._thread = None
+		self._ident = None
+		self._started = threading.Event()
+
+	def start(self):
+		if self._thread is None:
+			self._thread = threading.Thread(target=self._run, name=self._name)
+			self._thread.daemon = True
+			self._thread.start()
+			self._started.wait()
+
+	def _run(self):
+		self._ident = threading.current_thread().ident
+		self._started.set()
+		self._run_forever()
+
+	def in_loop(self):
+		return threading.current_thread().ident == self._ident
+
+	def call_soon(self, fn, *args):
+		return self.call_later(0, fn, *args)
+
+	def call_later(self, delay, fn, *args):
+		handle = Handle(fn, args)
+		self._schedule(max(delay, 0), handle)
+		return handle
+
+	def add_reader(self, fileobj, fn):
+		fd = fileobj if isinstance(fileobj, int) else fileobj.fileno()
+		self.call_soon(self._add_reader, fd, fn)
+		return fd
+
+	def remove_reader(self, fd):
+		self.call_soon(self._remove_reader, fd)
+
+	def stop(self):
+		raise NotImplementedError
+
+	def _run_forever(self):
+		raise NotImplementedError
+
+	def _schedule(self, delay, handle):
+		raise NotImplementedError
+
+	def _add_reader(self, fd, fn):
+		raise NotImplementedError
+
+	def _remove_reader(self, fd):
+		raise NotImplementedError
+
+
+class AsyncioEventLoop(EventLoop):
+
+	def __init__(self, name):
+		super(AsyncioEventLoop, self).__init__(name)
+		self._loop = asyncio.new_event_loop()
+
+	def _run_forever(self):
+		asyncio.set_event_loop(self._loop)
+		self._loop.run_forever()
+
+	def stop(self):
+		self._loop.call_soon_threadsafe(self._loop.stop)
+
+	def _schedule(self, delay, handle):
+		if delay:
+			self._loop.call_soon_threadsafe(self._loop.call_later, delay, handle.run)
+		else:
+			self._loop.call_soon_threadsafe(handle.run)
+
+	def _add_reader(self, fd, fn):
+		self._loop.add_reader(fd, Handle(fn, ()).run)
+
+	def _remove_reader(self, fd):
+		self._loop.remove_reader(fd)
+
+
+class SelectEventLoop(EventLoop):
+
+	def __init__(self, name):
+		super(SelectEventLoop, self).__init__(name)
+		self._timers = []
+		self._sequence = itertools.count()
+		self._readers = {}
+		self._lock = threading.Lock()
+		self._wake_r, self._wake_w = os.pipe()
+		self._running = True
+
+	def _run_forever(self):
+		while self._running:
+			with self._lock:
+				timeout = max(self._timers[0][0] - time.time(), 0) if self._timers else None
+			try:
+				ready, _, _ = select.select([self._wake_r] + list(self._readers), [], [], timeout)
+			except (OSError, select.error) as e:
+				_logger.warn(e)
+				ready = []
+			for fd in ready:
+				if fd == self._wake_r:
+					os.read(self._wake_r, 4096)
+				elif fd in self._readers:
+					Handle(self._readers[fd], ()).run()
+			now = time.time()
+			while True:
+				with self._lock:
+					if not self._timers or self._timers[0][0] > now:
+						break
+					handle = heapq.heappop(self._timers)[2]
+				handle.run()
+
+	def stop(self):
+		self._running = False
+		self._wake()
+
+	def _wake(self):
+		try:
+			os.write(self._wake_w, b'x')
+		except OSError:
+			pass
+
+	def _schedule(self, delay, handle):
+		with self._lock:
+			heapq.heappush(self._timers, (time.time() + delay, next(self._sequence), handle))
+		if not self.in_loop():
+			self._wake()
+
+	def _add_reader(self, fd, fn):
+		self._readers[fd] = fn
+
+	def _remove_reader(self, fd):
+		self._readers.pop(fd, None)
+
+
+def create_event_loop(name):
+	if asyncio is not None:
+		return AsyncioEventLoop(name)
+	return SelectEventLoop(name)
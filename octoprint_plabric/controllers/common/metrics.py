@@ -0,0 +1,159 @@
+import threading
+from collections import deque
+
+
+class Histogram(object):
+
+	def __init__(self, size):
+		self._window = deque(maxlen=size)
+		self._count = 0
+		self._sum = 0.0
+		self._lock = threading.Lock()
+
+	def observe(self, value):
+		with self._lock:
+			self._window.append(value)
+			self._count += 1
+			self._sum += value
+
+	def get_stats(self):
+		with self._lock:
+			window = sorted(self._window)
+			count, total = self._count, self._sum
+		stats = dict(count=count, sum=total)
+		if window:
+			stats.update(min=window[0], max=window[-1], p50=_percentile(window, 0.5), p95=_percentile(window, 0.95),
+						 p99=_percentile(window, 0.99))
+		return stats
+
+
+def _percentile(values, q):
+	return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class HistogramSet(object):
+
+	def __init__(self, names, size):
+		self._histograms = dict((name, Histogram(size)) for name in names)
+
+	def observe(self, name, value):
+		self._histograms[name].observe(value)
+
+	def get_stats(self):
+		return dict((name, h.get_stats()) for name, h in self._histograms.items())
+
+
+class _Metric(object):
+	kind = 'untyped'
+
+	def __init__(self, name, description, labels=()):
+		self.name = name
+		self.description = description
+		self.labels = labels
+		self._values = {}
+
+	def label_names(self, labels):
+		return self.labels
+
+
+class Counter(_Metric):
+	kind = 'counter'
+
+	def __init__(self, name, description, labels=(), collect=None):
+		super(Counter, self).__init__(name, description, labels)
+		self._collect = collect
+
+	def inc(self, labels=(), value=1):
+		self._values[labels] = self._values.get(labels, 0) + value
+
+	def total(self):
+		return sum(list(self._values.values()))
+
+	def samples(self):
+		values = self._collect() if self._collect else self._values
+		return [(self.name, labels, value) for labels, value in list(values.items()) if value is not None]
+
+
+class Gauge(_Metric):
+	kind = 'gauge'
+
+	def __init__(self, name, description, labels=(), collect=None):
+		super(Gauge, self).__init__(name, description, labels)
+		self._collect = collect
+
+	def set(self, value, labels=()):
+		self._values[labels] = value
+
+	def samples(self):
+		values = self._collect() if self._collect else self._values
+		return [(self.name, labels, value) for labels, value in list(values.items()) if value is not None]
+
+
+class Summary(_Metric):
+	kind = 'summary'
+
+	def __init__(self, name, description, label, histograms):
+		super(Summary, self).__init__(name, description, (label, ))
+		self._histograms = histograms
+
+	def samples(self):
+		samples = []
+		for key, stats in sorted(self._histograms.get_stats().items()):
+			for quantile in ('0.5', '0.95', '0.99'):
+				value = stats.get('p%d' % int(float(quantile) * 100))
+				if value is not None:
+					samples.append((self.name, (key, quantile), value))
+			samples.append((self.name + '_sum', (key, ), stats['sum']))
+			samples.append((self.name + '_count', (key, ), stats['count']))
+		return samples
+
+	def label_names(self, labels):
+		return self.labels + ('quantile', ) if len(labels) > len(self.labels) else self.labels
+
+
+class Registry(object):
+
+	def __init__(self):
+		self._metrics = {}
+		self._lock = threading.Lock()
+
+	def register(self, metric):
+		with self._lock:
+			return self._metrics.setdefault(metric.name, metric)
+
+	def unregister(self, name):
+		with self._lock:
+			self._metrics.pop(name, None)
+
+	def counter(self, name, description, labels=(), collect=None):
+		return self.register(Counter(name, description, labels, collect=collect))
+
+	def gauge(self, name, description, labels=(), collect=None):
+		return self.register(Gauge(name, description, labels, collect=collect))
+
+	def render(self):
+		with self._lock:
+			metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+		lines = []
+		for metric in metrics:
+			lines.append('# HELP %s %s' % (metric.name, metric.description))
+			lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+			for name, labels, value in metric.samples():
+				lines.append('%s%s %s' % (name, _format_labels(metric.label_names(labels), labels), _format_value(value)))
+		return '\n'.join(lines) + '\n'
+
+
+def _format_labels(names, values):
+	if not names:
+		return ''
+	pairs = ['%s="%s"' % (n, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for n, v in zip(names, values)]
+	return '{%s}' % ','.join(pairs)
+
+
+def _format_value(value):
+	if isinstance(value, bool):
+		return '1' if value else '0'
+	return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
@@ -0,0 +1,75 @@
+import uuid
+
+
+class MultipartStream(object):
+	"""multipart/form-data body read lazily, the file part pulled from ``chunks`` as the upload consumes it.
+
+	``size`` must be the exact length of the file part so the request can be sent with a Content-Length instead of
+	being buffered or chunked; a source that ends early or runs long raises IOError and aborts the upload. ``progress``
+	is called with the length of every file chunk sent. An exception raised by ``chunks`` or ``progress`` is kept in
+	``error``, since the HTTP client reports it wrapped in its own connection error.
+	"""
+
+	def __init__(self, fields, name, file_name, chunks, size, content_type='application/octet-stream', progress=None):
+		self.boundary = uuid.uuid4().hex
+		head = []
+		for key, value in fields:
+			head.append('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' % (self.boundary, _quote(key), value))
+		head.append('--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\nContent-Type: %s\r\n\r\n'
+					% (self.boundary, _quote(name), _quote(file_name), content_type))
+		self._head = ''.join(head).encode('utf-8')
+		self._tail = ('\r\n--%s--\r\n' % self.boundary).encode('utf-8')
+		self._chunks = iter(chunks)
+		self._size = size
+		self._progress = progress
+		self._parts = self._iter_parts()
+		self._buffer = b''
+		self._offset = 0
+		self.file_bytes = 0
+		self.error = None
+
+	@property
+	def content_type(self):
+		return 'multipart/form-data; boundary=%s' % self.boundary
+
+	def __len__(self):
+		return len(self._head) + self._size + len(self._tail)
+
+	def _iter_parts(self):
+		yield self._head
+		try:
+			for chunk in self._chunks:
+				if not chunk:
+					continue
+				self.file_bytes += len(chunk)
+				if self.file_bytes > self._size:
+					raise IOError('Upload source is longer than %d bytes' % self._size)
+				if self._progress:
+					self._progress(len(chunk))
+				yield chunk
+			if self.file_bytes != self._size:
+				raise IOError('Upload source ended after %d of %d bytes' % (self.file_bytes, self._size))
+		except Exception as e:
+			self.error = e
+			raise
+		yield self._tail
+
+	def read(self, size=-1):
+		if size is None or size < 0:
+			data = self._buffer[self._offset:] + b''.join(self._parts)
+			self._buffer, self._offset = b'', 0
+			return data
+		while len(self._buffer) - self._offset < size:
+			part = next(self._parts, None)
+			if part is None:
+				break
+			self._buffer = self._buffer[self._offset:] + part if self._offset < len(self._buffer) else part
+			self._offset = 0
+		data = self._buffer[self._offset:self._offset + size]
+		self._offset += len(data)
+		return data
+
+
+def _quote(value):
+	# Percent-encodes the characters that would end the parameter or the header line, as urllib3 and browsers do
+	return value.replace('\n', '%0A').replace('\r', '%0D').replace('"', '%22')
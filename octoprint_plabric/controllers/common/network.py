@@ -0,0 +1,47 @@
+from octoprint_plabric.controllers.common import logger as _logger
+
+_ROUTE_TABLE = '/proc/net/route'
+_RTF_UP = 0x1
+_DEFAULT_DESTINATION = '00000000'
+
+
+def read_routes(path=_ROUTE_TABLE):
+	routes = set()
+	try:
+		with open(path, 'r') as table:
+			next(table, None)
+			for line in table:
+				fields = line.split()
+				if len(fields) >= 4 and int(fields[3], 16) & _RTF_UP:
+					routes.add((fields[0], fields[1], fields[2]))
+	except (IOError, OSError, ValueError):
+		return None
+	return frozenset(routes)
+
+
+def has_default_route(routes):
+	return any(destination == _DEFAULT_DESTINATION for _, destination, _ in routes)
+
+
+class RouteWatcher(object):
+
+	def __init__(self, on_network_up):
+		self._on_network_up = on_network_up
+		self._routes = None
+		self._changes = 0
+
+	def reset(self):
+		self._routes = read_routes()
+
+	def poll(self):
+		routes = read_routes()
+		if routes is None or routes == self._routes:
+			return
+		previous, self._routes = self._routes, routes
+		if previous is not None and has_default_route(routes):
+			self._changes += 1
+			_logger.log('Network: Routes changed')
+			self._on_network_up()
+
+	def get_stats(self):
+		return dict(changes=self._changes, available=self._routes is not None)
@@ -0,0 +1,69 @@
+import os
+import sys
+import threading
+import time
+
+from octoprint_plabric.controllers.common import logger as _logger
+
+
+class SamplingProfiler(object):
+
+	def __init__(self, interval):
+		self._interval = interval
+		self._thread = None
+		self._stop = threading.Event()
+		self._last_path = None
+		self._until = None
+
+	def running(self):
+		return self._thread is not None and self._thread.is_alive()
+
+	def start(self, seconds, directory):
+		if self.running():
+			return False
+		self._stop.clear()
+		self._until = time.time() + seconds
+		path = os.path.join(directory, 'profile-%s.folded' % time.strftime('%Y%m%d-%H%M%S'))
+		self._thread = threading.Thread(target=self._run, args=(seconds, path), name='Plabric profiler')
+		self._thread.daemon = True
+		self._thread.start()
+		return True
+
+	def stop(self):
+		self._stop.set()
+
+	def _run(self, seconds, path):
+		_logger.log('Profiler: Sampling for %d seconds' % seconds)
+		own = threading.current_thread().ident
+		names = {}
+		stacks = {}
+		samples = 0
+		deadline = time.time() + seconds
+		while time.time() < deadline and not self._stop.wait(self._interval):
+			for thread in threading.enumerate():
+				names[thread.ident] = thread.name
+			for ident, frame in sys._current_frames().items():
+				if ident == own:
+					continue
+				stack = []
+				while frame is not None:
+					code = frame.f_code
+					stack.append('%s:%s:%d' % (os.path.basename(code.co_filename), code.co_name, frame.f_lineno))
+					frame = frame.f_back
+				stack.append(names.get(ident, str(ident)))
+				key = ';'.join(reversed(stack))
+				stacks[key] = stacks.get(key, 0) + 1
+			samples += 1
+
+		try:
+			with open(path, 'w') as f:
+				for stack, count in sorted(stacks.items(), key=lambda item: -item[1]):
+					f.write('%s %d\n' % (stack, count))
+			self._last_path = path
+			_logger.log('Profiler: %d samples written to %s' % (samples, path))
+		except (IOError, OSError) as e:
+			_logger.warn(e)
+		self._until = None
+
+	def get_stats(self):
+		return dict(running=self.running(), remaining=max(self._until - time.time(), 0) if self._until else 0, last_profile=self._last_path)
@@ -0,0 +1,53 @@
+import json as _json
+import re
+import uuid
+
+_TOKEN = 'plabric_raw_%s_' % uuid.uuid4().hex
+_TOKEN_RE = re.compile('"%s(\\d+)"' % _TOKEN)
+
+
+class RawJSON(object):
+	__slots__ = ('text',)
+
+	def __init__(self, text):
+		self.text = text
+
+	def __len__(self):
+		return len(self.text)
+
+	def loads(self):
+		return _json.loads(self.text)
+
+
+def from_response(resp):
+	"""RawJSON with the body of a JSON response, spliced into the reply without being parsed.
+
+	A body that may be incomplete (shorter or longer than its Content-Length) or that was decoded from a
+	Content-Encoding goes through ``resp.json()`` instead, which raises ValueError when it is malformed.
+	"""
+	content_type = resp.headers.get('content-type', '')
+	if 'json' not in content_type:
+		return resp.json()
+	content = resp.content
+	if not content or not content.strip():
+		return None
+	length = resp.headers.get('content-length')
+	encoding = resp.headers.get('content-encoding', 'identity').lower()
+	if encoding != 'identity' or (length is not None and length.strip() != str(len(content))):
+		return resp.json()
+	return RawJSON(content.decode('utf-8'))
+
+
+def dumps(obj):
+	raws = []
+
+	def default(o):
+		if isinstance(o, RawJSON):
+			raws.append(o.text)
+			return '%s%d' % (_TOKEN, len(raws) - 1)
+		raise TypeError('%r is not JSON serializable' % o)
+
+	text = _json.dumps(obj, default=default)
+	if not raws:
+		return text
+	return _TOKEN_RE.sub(lambda m: raws[int(m.group(1))], text)
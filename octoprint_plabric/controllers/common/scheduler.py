@@ -0,0 +1,127 @@
+import random
+import threading
+import time
+
+from octoprint_plabric.controllers.common import logger as _logger
+
+
+class _Task(object):
+
+	def __init__(self, name, fn, args, interval=None):
+		self.name = name
+		self.fn = fn
+		self.args = args
+		self.interval = interval
+		self.cancelled = False
+		self.running = False
+
+	def cancel(self):
+		self.cancelled = True
+
+
+class Scheduler(object):
+	"""Named timers kept on ``loop``; the functions themselves run on ``executor`` so blocking work never stalls the loop."""
+
+	def __init__(self, loop, executor):
+		self._loop = loop
+		self._executor = executor
+		self._tasks = {}
+		self._runs = {}
+		self._skipped = 0
+		self._lock = threading.Lock()
+
+	def schedule(self, name, delay, fn, *args):
+		return self._add(_Task(name, fn, args), delay)
+
+	def every(self, name, interval, fn, *args):
+		return self._add(_Task(name, fn, args, interval=interval), interval)
+
+	def _add(self, task, delay):
+		with self._lock:
+			previous = self._tasks.get(task.name)
+			if previous is not None:
+				previous.cancel()
+			self._tasks[task.name] = task
+		self._loop.call_later(delay, self._run, task)
+		return task
+
+	def cancel(self, name):
+		with self._lock:
+			task = self._tasks.pop(name, None)
+		if task is not None:
+			task.cancel()
+
+	def cancel_all(self):
+		with self._lock:
+			tasks, self._tasks = list(self._tasks.values()), {}
+		for task in tasks:
+			task.cancel()
+
+	def pending(self, name):
+		with self._lock:
+			return name in self._tasks
+
+	def _run(self, task):
+		with self._lock:
+			if task.cancelled:
+				return
+			if task.interval:
+				self._loop.call_later(task.interval, self._run, task)
+			elif self._tasks.get(task.name) is task:
+				del self._tasks[task.name]
+			if task.running:
+				self._skipped += 1
+				return
+			task.running = True
+			self._runs[task.name] = self._runs.get(task.name, 0) + 1
+		if self._executor.submit(target=self._call, args=(task, )) is None:
+			task.running = False
+			_logger.warn('Scheduler: %s not run' % task.name)
+
+	def _call(self, scheduled, task=None):
+		try:
+			scheduled.fn(*scheduled.args)
+		except Exception as e:
+			_logger.warn(e)
+		finally:
+			scheduled.running = False
+
+	def get_stats(self):
+		with self._lock:
+			return dict(self._executor.get_stats(), pending=sorted(self._tasks), runs=dict(self._runs), skipped=self._skipped)
+
+
+class DecorrelatedJitterBackoff(object):
+
+	def __init__(self, base, cap):
+		self._base = base
+		self._cap = cap
+		self._delay = base
+		self._down_since = None
+		self._lock = threading.Lock()
+		self._stats = dict(attempts=0, reconnects=0, last_time_to_reconnect=0.0, max_time_to_reconnect=0.0, total_downtime=0.0)
+
+	def failure(self):
+		with self._lock:
+			if self._down_since is None:
+				self._down_since = time.time()
+			self._delay = min(self._cap, random.uniform(self._base, self._delay * 3))
+			self._stats['attempts'] += 1
+			return self._delay
+
+	def success(self):
+		with self._lock:
+			self._delay = self._base
+			if self._down_since is not None:
+				downtime = time.time() - self._down_since
+				self._down_since = None
+				self._stats['reconnects'] += 1
+				self._stats['last_time_to_reconnect'] = downtime
+				self._stats['max_time_to_reconnect'] = max(self._stats['max_time_to_reconnect'], downtime)
+				self._stats['total_downtime'] += downtime
+
+	def get_stats(self):
+		with self._lock:
+			stats = dict(self._stats)
+			stats['down_for'] = time.time() - self._down_since if self._down_since is not None else 0.0
+			return stats
@@ -0,0 +1,64 @@
+import threading
+
+from octoprint_plabric.controllers.common import logger as _logger
+from octoprint_plabric.controllers.common.api import APIProtocol
+
+
+class SingleFlight(object):
+
+	def __init__(self, name):
+		self._name = name
+		self._calls = {}
+		self._lock = threading.Lock()
+		self._requests = 0
+		self._executions = 0
+		self._coalesced = 0
+
+	def do(self, key, callback, fn):
+		with self._lock:
+			self._requests += 1
+			waiters = self._calls.get(key)
+			if waiters is not None:
+				waiters.append(callback)
+				self._coalesced += 1
+				return
+			self._calls[key] = [callback]
+			self._executions += 1
+
+		fan_out = _FanOutCallback(self, key)
+		try:
+			fn(fan_out)
+		except Exception as e:
+			_logger.warn('%s: Shared call failed - %s' % (self._name, e))
+			fan_out.on_error(500)
+
+	def _finish(self, key):
+		with self._lock:
+			return self._calls.pop(key, [])
+
+	def get_stats(self):
+		with self._lock:
+			return dict(requests=self._requests, executions=self._executions, coalesced=self._coalesced,
+						in_flight=len(self._calls),
+						coalescing_ratio=float(self._coalesced) / self._requests if self._requests else 0.0)
+
+
+class _FanOutCallback(APIProtocol):
+
+	def __init__(self, flight, key):
+		self._flight = flight
+		self._key = key
+
+	def on_succeed(self, data):
+		for callback in self._flight._finish(self._key):
+			try:
+				callback.on_succeed(data)
+			except Exception as e:
+				_logger.warn(e)
+
+	def on_error(self, error):
+		for callback in self._flight._finish(self._key):
+			try:
+				callback.on_error(error)
+			except Exception as e:
+				_logger.warn(e)
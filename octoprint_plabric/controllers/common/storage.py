@@ -55,6 +55,9 @@ class Storage:
 			file_name = 'tmp.gcode'
 		return "%s/%s" % (directory, file_name)
 
+	def get_file_cache_folder(self):
+		return self._plugin.get_plugin_data_folder() + "/.cache/files"
+
 	def delete_file_temporal(self, path):
 		if os.path.exists(path):
 			os.remove(path)
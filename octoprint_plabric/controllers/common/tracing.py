@@ -0,0 +1,135 @@
+import threading
+import time
+from collections import deque
+
+from octoprint_plabric import config
+from octoprint_plabric.controllers.common.metrics import Histogram
+
+_local = threading.local()
+
+
+class _NullSpan(object):
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class NullTrace(object):
+
+	def __bool__(self):
+		return False
+
+	__nonzero__ = __bool__
+
+	def span(self, name):
+		return _NULL_SPAN
+
+	def add(self, name, started_at, ended_at):
+		pass
+
+	def finish(self):
+		pass
+
+
+NULL_TRACE = NullTrace()
+
+
+class _Span(object):
+	__slots__ = ('_trace', '_name', '_started_at')
+
+	def __init__(self, trace, name):
+		self._trace = trace
+		self._name = name
+		self._started_at = None
+
+	def __enter__(self):
+		self._started_at = time.time()
+		return self
+
+	def __exit__(self, *args):
+		self._trace.add(self._name, self._started_at, time.time())
+		return False
+
+
+class Trace(object):
+
+	def __init__(self, tracer, name, started_at=None):
+		self._tracer = tracer
+		self.name = name
+		self.started_at = started_at or time.time()
+		self.spans = []
+		self._finished = False
+
+	def span(self, name):
+		return _Span(self, name)
+
+	def add(self, name, started_at, ended_at):
+		self.spans.append((name, started_at, ended_at))
+
+	def finish(self):
+		if not self._finished:
+			self._finished = True
+			self._tracer.record(self, time.time())
+
+
+class Tracer(object):
+
+	def __init__(self, recent, window):
+		self.enabled = False
+		self._recent = deque(maxlen=recent)
+		self._window = window
+		self._histograms = {}
+		self._lock = threading.Lock()
+
+	def set_enabled(self, enabled):
+		self.enabled = bool(enabled)
+
+	def start(self, name, started_at=None):
+		return Trace(self, name, started_at) if self.enabled else NULL_TRACE
+
+	def record(self, trace, ended_at):
+		spans = [dict(name=name, start=round((s - trace.started_at) * 1000, 3), duration=round((e - s) * 1000, 3))
+				 for name, s, e in trace.spans]
+		with self._lock:
+			self._recent.append(dict(name=trace.name, started_at=trace.started_at,
+									 duration=round((ended_at - trace.started_at) * 1000, 3), spans=spans))
+			for span in spans:
+				histogram = self._histograms.get(span['name'])
+				if histogram is None:
+					histogram = self._histograms[span['name']] = Histogram(self._window)
+				histogram.observe(span['duration'])
+
+	def get_stats(self):
+		with self._lock:
+			recent = list(self._recent)
+			histograms = dict(self._histograms)
+		return dict(enabled=self.enabled, spans_ms=dict((name, h.get_stats()) for name, h in histograms.items()), recent=recent)
+
+
+TRACER = Tracer(recent=config.TRACE_RECENT, window=config.LATENCY_WINDOW)
+
+
+def current():
+	return getattr(_local, 'trace', NULL_TRACE)
+
+
+class activate(object):
+
+	def __init__(self, trace):
+		self._trace = trace
+		self._previous = None
+
+	def __enter__(self):
+		self._previous = current()
+		_local.trace = self._trace
+		return self._trace
+
+	def __exit__(self, *args):
+		_local.trace = self._previous
+		return False
@@ -1,4 +1,5 @@
 from __future__ import absolute_import
+import os
 import platform
 import re
 import sys
@@ -81,3 +82,22 @@ def get_free_ports(count=3, starting_port=9010):
 			ports.append(port)
 		port += 1
 	return ports
+
+
+def process_stats(pid='self'):
+	stats = {}
+	try:
+		with open('/proc/%s/status' % pid, 'r') as status:
+			for line in status:
+				if line.startswith('VmRSS:'):
+					stats['rss_kb'] = int(line.split()[1])
+				elif line.startswith('VmHWM:'):
+					stats['rss_peak_kb'] = int(line.split()[1])
+				elif line.startswith('Threads:'):
+					stats['threads'] = int(line.split()[1])
+		with open('/proc/%s/stat' % pid, 'r') as stat:
+			fields = stat.read().rsplit(')', 1)[1].split()
+			stats['cpu_seconds'] = float(int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+	except Exception:
+		pass
+	return stats
@@ -1,19 +1,43 @@
+import json
+import os
 import threading
 import time
 from enum import Enum
-from random import randrange
 
 from octoprint_plabric import config
-from octoprint_plabric.controllers.common import logger as _logger, utils as _utils
+from octoprint_plabric.controllers.common import logger as _logger, metrics as _metrics, tracing as _tracing, utils as _utils
 from octoprint_plabric.controllers.common.api import APIProtocol
+from octoprint_plabric.controllers.common.executor import Executor
+from octoprint_plabric.controllers.common.loop import create_event_loop
+from octoprint_plabric.controllers.common.metrics import HistogramSet, Summary
+from octoprint_plabric.controllers.common.network import RouteWatcher
+from octoprint_plabric.controllers.common.profiler import SamplingProfiler
+from octoprint_plabric.controllers.common.rawjson import RawJSON
+from octoprint_plabric.controllers.common.scheduler import Scheduler, DecorrelatedJitterBackoff
 from octoprint_plabric.controllers.common.storage import Storage
 from octoprint_plabric.controllers.octoprint.api import OctoprintAPI, OctoprintAPIProtocol
+from octoprint_plabric.controllers.octoprint.batch import ApiCommandBatch
+from octoprint_plabric.controllers.octoprint.bridge import OctoprintBridge
+from octoprint_plabric.controllers.octoprint.delta import DeltaEncoder
+from octoprint_plabric.controllers.octoprint.history import HistoryRing
+from octoprint_plabric.controllers.octoprint.message import OctoprintMessage
+from octoprint_plabric.controllers.octoprint.monitor import PrinterMonitor
 from octoprint_plabric.controllers.octoprint.socket import OctoprintSocket, OctoprintSocketProtocol
+from octoprint_plabric.controllers.octoprint.subscriptions import MessageFilter
+from octoprint_plabric.controllers.octoprint.terminal import TerminalLog
+from octoprint_plabric.controllers.octoprint.throttle import ThrottleController
+from octoprint_plabric.controllers.plabric import download as _download
 from octoprint_plabric.controllers.plabric.api import PlabricAPI
+from octoprint_plabric.controllers.plabric.cache import FileCache
+from octoprint_plabric.controllers.plabric.download import DownloadError, PartialFile
 from octoprint_plabric.controllers.plabric.janus import Janus, JanusProtocol
+from octoprint_plabric.controllers.plabric.outbound import PRIORITY_STATUS
 from octoprint_plabric.controllers.plabric.socket import PlabricSocket, PlabricSocketProtocol
+from octoprint_plabric.controllers.plabric.transfers import TransferManager
 from octoprint_plabric.controllers.video.video import VideoStreamer, VideoStreamProtocol
 
+_steps = _metrics.REGISTRY.counter('plabric_step_transitions_total', 'Connection step transitions', ('step', ))
+
 
 class Step(Enum):
 	ERROR_CONNECTION = 'error_connection'
@@ -33,6 +57,13 @@ class Main:
 		self.loading = False
 		self.user_nick = None
 		self.step = None
+
+		self.loop = create_event_loop(name='Plabric loop')
+		self.loop.start()
+		tasks = Executor(name='Plabric tasks', workers=config.SCHEDULER_WORKERS, max_queue=config.SCHEDULER_QUEUE, idle_timeout=config.WORKER_IDLE_TIMEOUT)
+		self.scheduler = Scheduler(self.loop, tasks)
+		self.reconnect_backoff = DecorrelatedJitterBackoff(base=config.RECONNECT_BACKOFF_BASE, cap=config.RECONNECT_BACKOFF_CAP)
+		self.route_watcher = RouteWatcher(on_network_up=self.on_network_up)
 		self.set_step(Step.LOGIN_NEEDED)
 
 		self.plabric_api = None
@@ -41,14 +72,67 @@ class Main:
 		self.octoprint_api = None
 		self.octoprint_socket = None
 		self.video_streamer = None
+		self.command_executor = Executor(name='Plabric commands', workers=config.API_COMMAND_WORKERS, max_queue=config.API_COMMAND_QUEUE,
+										 idle_timeout=config.WORKER_IDLE_TIMEOUT)
+		self.stream_config = {}
+		self.delta_encoder = DeltaEncoder(keyframe_interval=config.DELTA_KEYFRAME_INTERVAL, keyframe_seconds=config.DELTA_KEYFRAME_SECONDS)
+		self.message_filter = MessageFilter()
+		self.terminal_log = TerminalLog(size=config.TERMINAL_LOG_SIZE)
+		self.history = HistoryRing(tiers=config.HISTORY_TIERS)
+		self.printer_monitor = None
+		self.latency = HistogramSet(names=('rtt', 'queue', 'octoprint', 'send', 'total'), size=config.LATENCY_WINDOW)
+		self.clock_offset = None
+		self.profiler = SamplingProfiler(interval=config.PROFILE_INTERVAL)
+		self.file_cache = FileCache(directory=Storage(self.plugin).get_file_cache_folder(), quota=config.FILE_CACHE_QUOTA)
+		self.transfers = TransferManager(run=self.download_temporal_file, send=self.send_transfer_progress,
+										 on_succeed=self.call_octoprint_api_succeed, on_error=self.call_octoprint_api_error,
+										 workers=config.TRANSFER_WORKERS, max_queue=config.TRANSFER_QUEUE, interval=config.TRANSFER_PROGRESS_INTERVAL,
+										 idle_timeout=config.WORKER_IDLE_TIMEOUT)
 
 		self.plabric_api_key = Storage(self.plugin).get_saved_setting('plabric_api_key')
 		self.plabric_token = None
 		self.octoprint_api_key = None
 
 		self.init()
-		self._waiting_for_reconnect = False
-		self.retry_time = randrange(30, 120)
+		self._register_metrics()
+		_logger.log('Process: %s' % _utils.process_stats())
+
+	def _register_metrics(self):
+		def janus_stats():
+			pid = self.plabric_webrtc.get_pid()
+			return _utils.process_stats(pid) if pid else {}
+
+		def collect(stats, name, scale=1):
+			def values():
+				value = stats().get(name)
+				return {(): value * scale if value is not None else None}
+			return values
+
+		for prefix, process, stats in (('plabric_process', 'OctoPrint', _utils.process_stats), ('plabric_janus_process', 'Janus', janus_stats)):
+			_metrics.REGISTRY.gauge(prefix + '_resident_memory_bytes', '%s process resident memory in bytes' % process,
+									collect=collect(stats, 'rss_kb', 1024))
+			_metrics.REGISTRY.counter(prefix + '_cpu_seconds_total', '%s process user and system CPU time in seconds' % process,
+									  collect=collect(stats, 'cpu_seconds'))
+		_metrics.REGISTRY.gauge('plabric_process_resident_memory_max_bytes', 'OctoPrint process peak resident memory in bytes',
+								collect=collect(_utils.process_stats, 'rss_peak_kb', 1024))
+		_metrics.REGISTRY.gauge('plabric_process_threads', 'OctoPrint process threads', collect=collect(_utils.process_stats, 'threads'))
+		_metrics.REGISTRY.gauge('plabric_reconnect_attempts', 'Plabric server reconnect attempts',
+								collect=lambda: {(): self.reconnect_backoff.get_stats()['attempts']})
+		_metrics.REGISTRY.register(Summary('plabric_latency_seconds', 'Relay and api_command latency', 'stage', self.latency))
+
+	def start_profile(self, seconds=None):
+		seconds = max(1, min(seconds or config.PROFILE_SECONDS, config.PROFILE_MAX_SECONDS))
+		started = self.profiler.start(seconds, self.plugin.get_plugin_data_folder())
+		self.scheduler.schedule('profile_done', seconds + 1, self.plugin.update_ui_status)
+		self.plugin.update_ui_status()
+		return started
+
+	def set_tracing(self, enabled):
+		_tracing.TRACER.set_enabled(enabled)
+		self.plugin.update_ui_status()
+
+	def get_metrics(self):
+		return _metrics.REGISTRY.render()
 
 	def init(self):
 		self._init_plabric_api()
@@ -56,6 +140,7 @@ class Main:
 		self._init_plabric_webrtc()
 		self._init_octoprint_api()
 		self._init_octoprint_socket()
+		self._init_printer_monitor()
 		self._init_video_stream()
 
 	def start(self, from_oauth=False):
@@ -66,38 +151,46 @@ class Main:
 		else:
 			f = self.connect
 
-		thread = threading.Thread(target=f)
-		thread.daemon = True
-		thread.start()
+		self.scheduler.schedule('connect', 0, f)
 
 	def connect(self):
 		self.plabric_socket.connect()
 
 	def set_step(self, step):
 		self.step = step
+		_steps.inc((step.value, ))
 		self.plugin.update_ui_status()
 
-		if step == Step.ERROR_CONNECTION and not self._waiting_for_reconnect:
-			_logger.log('Retry connection in %d seconds' % self.retry_time)
-			self._waiting_for_reconnect = True
-
-			thread = threading.Thread(target=self.retry_in_seconds, args=(self.retry_time,))
-			thread.daemon = True
-			thread.start()
+		if step == Step.ERROR_CONNECTION:
+			if not self.scheduler.pending('reconnect'):
+				delay = self.reconnect_backoff.failure()
+				_logger.log('Retry connection in %d seconds' % delay)
+				self.scheduler.schedule('reconnect', delay, self.retry_connection)
+			if not self.scheduler.pending('route_watch'):
+				self.route_watcher.reset()
+				self.scheduler.every('route_watch', config.NETWORK_WATCH_INTERVAL, self.route_watcher.poll)
+		else:
+			self.scheduler.cancel('reconnect')
+			self.scheduler.cancel('route_watch')
 
 		if step == Step.CONNECTED or step == Step.READY:
-			self.retry_time = randrange(30, 120)
+			self.reconnect_backoff.success()
 
-	def retry_in_seconds(self, seconds=10):
-		time.sleep(seconds)
-		self._waiting_for_reconnect = False
+	def retry_connection(self):
 		if self.step == Step.ERROR_CONNECTION:
-			self.retry_time = self.retry_time * 3 if self.retry_time < 360 else randrange(360, 720)
-			self.plabric_socket.disconnect()
-			self.plabric_socket = None
-			self._init_plabric_socket()
+			self._renew_plabric_socket()
 			self.connect()
 
+	def on_network_up(self):
+		if self.step == Step.ERROR_CONNECTION:
+			_logger.log('Network changed, retrying connection now')
+			self.scheduler.schedule('reconnect', 0, self.retry_connection)
+
+	def _renew_plabric_socket(self):
+		self.plabric_socket.disconnect()
+		self.plabric_socket = None
+		self._init_plabric_socket()
+
 	def set_error(self, error):
 		self.error = error
 		self.set_loading(False)
@@ -110,34 +203,187 @@ class Main:
 	def _init_plabric_api(self):
 		self.plabric_api = PlabricAPI(domain=config.HOST_PLABRIC_API)
 
-	def download_temporal_file(self, data):
+	def download_temporal_file(self, transfer):
+		data = transfer.data
+		file_id = data['params']['file_id']
+		storage = Storage(self.plugin)
+		parked = PartialFile(storage.get_file_temporal_path(_download.staging_name(file_id)))
+		partial = parked.move_to(storage.get_file_temporal_path(_download.staging_name(file_id, transfer.id)))
+		offset, validator, digest, hasher = partial.resume_point(file_id)
+
+		class Response(APIProtocol):
+			def __init__(self, p):
+				self._p = p
+
+			def on_cached(self, cached):
+				partial.clear()
+				try:
+					self._p.send_cached_file(transfer=transfer, cached=cached)
+				finally:
+					cached.release()
+
+			def on_succeed(self, download):
+				segmented = None
+				try:
+					segmented = _download.split(download, config.DOWNLOAD_SEGMENTS)
+					if segmented:
+						partial.clear()
+						transfer.start('downloading', size=segmented.size)
+						try:
+							segmented.write(partial.path, progress=transfer.advance)
+						except DownloadError:
+							partial.clear()
+							raise
+						self._p.upload_downloaded_file(transfer=transfer, partial=partial, download=segmented)
+					elif download.offset == 0 and download.size:
+						partial.clear()
+						self._p.upload_stream(transfer=transfer, download=download)
+					else:
+						transfer.start('downloading', size=download.size, done=download.offset)
+						partial.write(file_id, download, progress=transfer.advance)
+						self._p.upload_downloaded_file(transfer=transfer, partial=partial, download=download)
+				except DownloadError as e:
+					_logger.warn(e)
+					transfer.fail(e.status)
+				finally:
+					if segmented:
+						segmented.close()
+					download.close()
+
+			def on_error(self, error):
+				if not transfer.cancelled:
+					self._p.set_error(error)
+				transfer.fail(error)
+
+		try:
+			transfer.start('downloading')
+			self.plabric_api.open_temporal_file(file_id=file_id, plabric_api_key=self.plabric_api_key, callback=Response(self),
+												offset=offset, validator=validator, digest=digest, hasher=hasher, cache=self.file_cache,
+												cancelled=transfer.cancel_event)
+		finally:
+			if transfer.cancelled:
+				partial.clear()
+			else:
+				partial.move_to(parked.path)
+
+	def upload_stream(self, transfer, download):
+		data = transfer.data
+		writer = self.file_cache.writer()
+
 		class Response(APIProtocol):
-			def __init__(self, p, file_path):
+			def __init__(self, p):
 				self._p = p
-				self._file_path = file_path
 
 			def on_succeed(self, response):
-				self._p.upload_file(data=data, file_path=self._file_path)
+				cached = writer.commit(data['params']['file_id'], digest=download.digest, validator=download.validator) if writer else None
+				if cached:
+					self._p.record_upload(data=data, cached=cached, response=response)
+					cached.release()
+				transfer.succeed(response)
 
 			def on_error(self, error):
-				self._p.set_error(error)
+				transfer.fail(error)
+
+		transfer.start('transferring', size=download.size)
+		try:
+			self.octoprint_api.upload_stream(data=data, chunks=writer.tee(download) if writer else download, size=download.size,
+											 callback=Response(self), progress=transfer.advance)
+		finally:
+			if writer:
+				writer.discard()
+
+	def upload_downloaded_file(self, transfer, partial, download):
+		cached = self.file_cache.store(transfer.file_id, partial.path, digest=download.digest, validator=download.validator)
+		if cached:
+			partial.clear()
+			try:
+				self.upload_file(transfer=transfer, path=cached.path, cached=cached)
+			finally:
+				cached.release()
+		else:
+			self.upload_file(transfer=transfer, path=partial.path, partial=partial)
 
-		destination = Storage(self.plugin).get_file_temporal_path("tmp.gcode")
-		self.plabric_api.download_temporal_file(file_id=data['params']['file_id'], destination=destination, plabric_api_key=self.plabric_api_key, callback=Response(self, file_path=destination))
+	def upload_file(self, transfer, path, partial=None, cached=None):
+		data = transfer.data
 
-	def upload_file(self, data, file_path):
 		class Response(APIProtocol):
 			def __init__(self, p):
 				self._p = p
 
 			def on_succeed(self, response):
-				Storage(self._p.plugin).delete_file_temporal(path=file_path)
-				self._p.call_octoprint_api_succeed(data=data, response=response)
+				if partial:
+					partial.clear()
+				if cached:
+					self._p.record_upload(data=data, cached=cached, response=response)
+				transfer.succeed(response)
+
+			def on_error(self, error):
+				transfer.fail(error)
+
+		transfer.start('uploading', size=os.path.getsize(path))
+		self.octoprint_api.upload_file(data=data, file_path=path, callback=Response(self), progress=transfer.advance)
+
+	def record_upload(self, data, cached, response):
+		try:
+			path = (response.loads() if isinstance(response, RawJSON) else response)['files']['local']['path']
+		except (TypeError, KeyError, ValueError):
+			return
+
+		class Response(OctoprintAPIProtocol):
+			def __init__(self, p):
+				self._p = p
+
+			def on_succeed(self, info):
+				if info:
+					text = response.text if isinstance(response, RawJSON) else json.dumps(response)
+					self._p.file_cache.record_upload(cached.key, data['params']['file_name'],
+													 {'path': path, 'size': info.get('size'), 'date': info.get('date'), 'response': text})
+
+			def on_error(self, error):
+				pass
+
+		self.octoprint_api.get_file(path=path, callback=Response(self))
+
+	def send_cached_file(self, transfer, cached):
+		upload = cached.uploads.get(transfer.file_name)
+		if upload is None:
+			self.upload_file(transfer=transfer, path=cached.path, cached=cached)
+			return
+
+		class Response(OctoprintAPIProtocol):
+			def __init__(self, p):
+				self._p = p
+
+			def on_succeed(self, info):
+				if info and info.get('size') == upload['size'] and info.get('date') == upload['date']:
+					self._p.select_cached_file(transfer=transfer, cached=cached, upload=upload)
+				else:
+					self._p.upload_file(transfer=transfer, path=cached.path, cached=cached)
 
 			def on_error(self, error):
-				self._p.call_octoprint_api_error(data=data, error=error)
+				self._p.upload_file(transfer=transfer, path=cached.path, cached=cached)
 
-		self.octoprint_api.upload_file(data=data, file_path=file_path, callback=Response(self))
+		self.octoprint_api.get_file(path=upload['path'], callback=Response(self))
+
+	def select_cached_file(self, transfer, cached, upload):
+		class Response(OctoprintAPIProtocol):
+			def __init__(self, p):
+				self._p = p
+
+			def on_succeed(self, response):
+				self._p.file_cache.count_upload_saved(cached.size)
+				transfer.succeed(RawJSON(upload['response']))
+
+			def on_error(self, error):
+				transfer.fail(error)
+
+		_logger.log('Plabric: %s already uploaded, selecting it' % upload['path'])
+		transfer.start('selecting', size=cached.size, done=cached.size)
+		self.octoprint_api.select_file(path=upload['path'], callback=Response(self))
+
+	def send_transfer_progress(self, progress):
+		if self.plabric_socket:
+			self.plabric_socket.send_msg(key='transfer_progress', data=progress, coalesce_key='transfer_%s' % progress['transfer_id'])
 
 	def _init_plabric_socket(self):
 
@@ -147,6 +393,7 @@ class Main:
 				self._p = p
 
 			def on_connected(self):
+				self._p.scheduler.every('probe', config.PROBE_INTERVAL, self._p.probe_relay)
 				self._p.plabric_socket.send_msg(key='jr_slave', data={'api_key': self._p.plabric_api_key} if self._p.plabric_api_key else {'token': self._p.plabric_token})
 				if self._p.plabric_api_key:
 					self._p.set_step(Step.READY)
@@ -163,19 +410,25 @@ class Main:
 					self._p.set_step(Step.LOGIN_NEEDED)
 
 			def on_disconnected(self):
+				self._p.scheduler.cancel('probe')
+				self._p.command_executor.cancel()
 				self._p.set_step(Step.ERROR_CONNECTION) if self._p.plabric_api_key else self._p.set_step(Step.LOGIN_NEEDED)
 				self._p.octoprint_socket.disconnect()
 				self._p.plabric_webrtc.disconnect()
 
 			def on_user_leave(self):
+				self._p.command_executor.cancel()
 				self._p.set_step(Step.READY)
 				self._p.octoprint_socket.disconnect()
 				self._p.plabric_webrtc.disconnect()
 
-			def on_user_joined(self, user_nick, octoprint_api_key):
+			def on_user_joined(self, user_nick, octoprint_api_key, stream_config=None):
 				self._p.plabric_socket.send_msg('ready')
 				self._p.octoprint_api_key = octoprint_api_key
 				self._p.user_nick = user_nick
+				self._p.configure_stream(stream_config or {}, reset=True)
+				if self._p.stream_config.get('history') == 'compact':
+					self._p.send_history_snapshot(joined_at=time.time())
 
 				self._p.login_octoprint_api(octoprint_api_key)
 				if self._p.plabric_api_key and self._p.step != Step.QR_READ:
@@ -184,6 +437,9 @@ class Main:
 				self._p.set_step(Step.CONNECTED)
 				self._p.send_metadata()
 
+			def on_stream_config(self, data):
+				self._p.configure_stream(data)
+
 			def clear_api_key(self):
 				self._p.disable()
 
@@ -198,8 +454,14 @@ class Main:
 				storage = Storage(self._p.plugin)
 				storage.save_setting('plabric_api_key', plabric_api_key)
 
-			def on_api_command(self, data):
-				self._p.call_octoprint_api(data)
+			def on_api_command(self, data, received_at=None, trace=_tracing.NULL_TRACE):
+				self._p.submit_api_command(data, received_at=received_at, trace=trace)
+
+			def on_api_command_batch(self, data):
+				self._p.submit_api_command_batch(data)
+
+			def on_transfer_cancel(self, data):
+				self._p.transfers.cancel(transfer_id=data.get('transfer_id'), file_id=data.get('file_id'))
 
 			def on_video_command(self, data):
 				if data['enable']:
@@ -210,8 +472,20 @@ class Main:
 			def on_signaling(self, data):
 				self._p.plabric_webrtc.on_signaling(data)
 
+			def on_probe(self, rtt, clock_offset):
+				self._p.on_relay_probe(rtt, clock_offset)
+
 		self.plabric_socket = PlabricSocket(domain=config.HOST_PLABRIC_API, callback=Response(self))
 
+	def probe_relay(self):
+		self.plabric_socket.probe()
+
+	def on_relay_probe(self, rtt, clock_offset):
+		self.latency.observe('rtt', rtt)
+		if clock_offset is not None:
+			self.clock_offset = clock_offset
+		self.throttle.set_rtt(rtt)
+
 	def send_metadata(self):
 		if self.plabric_api_key:
 			plugin_version = self.plugin.get_version()
@@ -267,7 +541,7 @@ class Main:
 			def janus_running(self):
 				self._p.plabric_socket.send_msg(key='webrtc_ready')
 
-		self.plabric_webrtc = Janus(system=_utils.system(), machine=_utils.machine(), ports=_utils.get_free_ports(count=3, starting_port=9010), callback=Response(self))
+		self.plabric_webrtc = Janus(system=_utils.system(), machine=_utils.machine(), ports=_utils.get_free_ports(count=3, starting_port=9010), loop=self.loop, callback=Response(self))
 
 	def _init_video_stream(self):
 		class VideoResponse(VideoStreamProtocol):
@@ -280,7 +554,7 @@ class Main:
 			def on_video_stopped(self):
 				self._p.plabric_webrtc.stop_video_stream()
 
-		self.video_streamer = VideoStreamer(janus_url=config.JANUS_VIDEO_HOST, port=self.plabric_webrtc.get_video_port(), system=_utils.system(), machine=_utils.machine(), is_raspberry=_utils.is_raspberry())
+		self.video_streamer = VideoStreamer(janus_url=config.JANUS_VIDEO_HOST, port=self.plabric_webrtc.get_video_port(), system=_utils.system(), machine=_utils.machine(), loop=self.loop, is_raspberry=_utils.is_raspberry())
 		self.video_streamer.set_callback(VideoResponse(self))
 
 	def _init_octoprint_api(self):
@@ -288,6 +562,12 @@ class Main:
 		self.octoprint_api = OctoprintAPI(domain=host)
 
 	def login_octoprint_api(self, octoprint_api_key):
+		if not self.octoprint_socket.requires_login:
+			self.octoprint_api.set_api_key(octoprint_api_key)
+			if not self.octoprint_socket.connect(api_key=octoprint_api_key):
+				self.set_step(Step.LOGIN_NEEDED)
+			return
+
 		class Response(APIProtocol):
 			def __init__(self, p):
 				self._p = p
@@ -300,34 +580,163 @@ class Main:
 
 		self.octoprint_api.login(octoprint_api_key=octoprint_api_key, callback=Response(self))
 
-	def call_octoprint_api_succeed(self, data, response):
+	def call_octoprint_api_succeed(self, data, response, on_sent=None, trace=_tracing.NULL_TRACE):
 		if response:
 			data['response'] = response
 		data['status_code'] = 200
-		self.plabric_socket.send_msg(key='api_command_response', data=data)
+		self.send_api_command_response(data=data, on_sent=on_sent, trace=trace)
 
-	def call_octoprint_api_error(self, data, error):
+	def call_octoprint_api_error(self, data, error, on_sent=None, trace=_tracing.NULL_TRACE):
 		data['status_code'] = error
-		self.plabric_socket.send_msg(key='api_command_response', data=data)
+		self.send_api_command_response(data=data, on_sent=on_sent, trace=trace)
+
+	def send_api_command_response(self, data, on_sent=None, trace=_tracing.NULL_TRACE):
+		def on_dropped():
+			error = dict((k, v) for k, v in data.items() if k != 'response')
+			error['status_code'] = 503
+			self.plabric_socket.send_msg(key='api_command_response', data=error, trace=trace)
+
+		self.plabric_socket.send_msg(key='api_command_response', data=data, on_dropped=on_dropped, on_sent=on_sent, trace=trace)
+
+	def submit_api_command(self, data, received_at=None, trace=_tracing.NULL_TRACE):
+		def on_expired():
+			self.call_octoprint_api_error(data=data, error=504)
+
+		task = self.command_executor.submit(target=self.call_octoprint_api, args=(data, received_at or time.time(), trace),
+											deadline=time.time() + config.API_COMMAND_DEADLINE, on_expired=on_expired)
+		if task is None:
+			self.call_octoprint_api_error(data=data, error=503)
+
+	def submit_api_command_batch(self, data):
+		def on_done(response):
+			self.plabric_socket.send_msg(key='api_command_batch_response', data=response)
+
+		batch = ApiCommandBatch(batch=data, family=self.octoprint_api.resource_family, on_done=on_done)
+		if not batch.commands:
+			on_done(batch.response())
+			return
 
-	def call_octoprint_api(self, data):
+		deadline = time.time() + config.API_COMMAND_DEADLINE
+		for chain in batch.plan():
+			def on_expired(chain=chain):
+				batch.fail(chain, 504)
+
+			task = self.command_executor.submit(target=self.call_octoprint_api_chain, args=(batch, chain), deadline=deadline, on_expired=on_expired)
+			if task is None:
+				batch.fail(chain, 503)
+
+	def call_octoprint_api_chain(self, batch, chain, task=None):
+
+		class ChainResponse(OctoprintAPIProtocol):
+			def __init__(self, index):
+				self._index = index
+				self.done = threading.Event()
+
+			def on_succeed(self, response):
+				batch.succeed(self._index, response)
+				self.done.set()
+
+			def on_error(self, error):
+				batch.error(self._index, error)
+				self.done.set()
+
+			def on_download_first(self, data):
+				self.on_error(400)
+
+		def on_deadline():
+			task.cancel()
+			batch.fail(chain, 504)
+
+		timer = self.loop.call_later(task.remaining(), on_deadline) if task and task.deadline else None
+		try:
+			for position, index in enumerate(chain):
+				if task and task.cancelled:
+					batch.fail(chain[position:], 503)
+					return
+				callback = ChainResponse(index)
+				try:
+					self.dispatch_api_command(data=batch.commands[index], callback=callback)
+				except Exception as e:
+					_logger.warn(e)
+					callback.on_error(400)
+				if not callback.done.wait(task.remaining() if task else None):
+					batch.fail(chain[position:], 504)
+					return
+		finally:
+			if timer:
+				timer.cancel()
+
+	def call_octoprint_api(self, data, received_at=None, trace=_tracing.NULL_TRACE, task=None):
+		dispatched_at = time.time()
+		if received_at is not None:
+			self.latency.observe('queue', dispatched_at - received_at)
+			trace.add('queue', received_at, dispatched_at)
+
+		def on_completed():
+			completed_at = time.time()
+			self.latency.observe('octoprint', completed_at - dispatched_at)
+
+			def on_sent():
+				sent_at = time.time()
+				self.latency.observe('send', sent_at - completed_at)
+				if received_at is not None:
+					self.latency.observe('total', sent_at - received_at)
+
+			return on_sent
+
+		def answered():
+			return task is not None and (task.cancelled or not task.settle())
+
+		def on_deadline():
+			if task.settle():
+				task.cancel()
+				self.call_octoprint_api_error(data=data, error=504, trace=trace)
 
 		class APIResponse(OctoprintAPIProtocol):
 			def __init__(self, p):
 				self._p = p
 
 			def on_succeed(self, response):
-				self._p.call_octoprint_api_succeed(data=data, response=response)
+				if answered():
+					return
+				self._p.call_octoprint_api_succeed(data=data, response=response, on_sent=on_completed(), trace=trace)
 
 			def on_error(self, error):
-				self._p.call_octoprint_api_error(data=data, error=error)
+				if answered():
+					return
+				self._p.call_octoprint_api_error(data=data, error=error, on_sent=on_completed(), trace=trace)
 
 			def on_download_first(self, data):
-				thread = threading.Thread(target=self._p.download_temporal_file, args=(data,))
-				thread.daemon = True
-				thread.start()
+				if answered():
+					return
+				self._p.transfers.submit(data)
+
+		timer = self.loop.call_later(task.remaining(), on_deadline) if task and task.deadline else None
+		try:
+			with _tracing.activate(trace):
+				self.dispatch_api_command(data=data, callback=APIResponse(self))
+		finally:
+			if timer:
+				timer.cancel()
+
+	def dispatch_api_command(self, data, callback):
+		if data.get('url', '').startswith(config.TERMINAL_PATH):
+			params = data.get('params') or {}
+			try:
+				start = params.get('start')
+				start = int(start) if start is not None else None
+				count = max(0, min(int(params.get('count', 100)), config.TERMINAL_PAGE_MAX))
+			except (TypeError, ValueError, OverflowError):
+				callback.on_error(400)
+				return
+			callback.on_succeed(self.terminal_log.read(start=start, count=count))
+		else:
+			self.octoprint_api.call_method(data=data, callback=callback)
 
-		self.octoprint_api.call_method(data=data, callback=APIResponse(self))
+	def _init_printer_monitor(self):
+		if self.plugin.get_printer() is not None:
+			self.printer_monitor = PrinterMonitor(printer=self.plugin.get_printer(), terminal_log=self.terminal_log, history=self.history)
+			self.printer_monitor.start()
 
 	def _init_octoprint_socket(self):
 
@@ -336,7 +745,8 @@ class Main:
 				self._p = p
 
 			def on_event(self, event):
-				self._p.plabric_socket.send_msg(key='socket_event', json=event)
+				message = OctoprintMessage(payload=event) if isinstance(event, dict) else OctoprintMessage(raw=event)
+				self._p.relay_octoprint_message(message)
 
 			def connected(self):
 				pass
@@ -344,8 +754,89 @@ class Main:
 			def disconnected(self):
 				pass
 
-		host = self.plugin.get_host()
-		self.octoprint_socket = OctoprintSocket(domain=host, callback=Response(self))
+		if config.OCTOPRINT_EVENT_BRIDGE and self.plugin.get_printer() is not None:
+			self.octoprint_socket = OctoprintBridge(printer=self.plugin.get_printer(), plugin_manager=self.plugin.get_plugin_manager(),
+													file_manager=self.plugin.get_file_manager(), callback=Response(self))
+		else:
+			host = self.plugin.get_host()
+			self.octoprint_socket = OctoprintSocket(domain=host, callback=Response(self))
+		self.throttle = ThrottleController(apply=self.octoprint_socket.set_throttle, default=config.THROTTLE_DEFAULT,
+										   visible=config.THROTTLE_VISIBLE, hidden=config.THROTTLE_HIDDEN, maximum=config.THROTTLE_MAX,
+										   queue_high=config.THROTTLE_QUEUE_HIGH, rtt_high=config.THROTTLE_RTT_HIGH,
+										   min_interval=config.THROTTLE_MIN_INTERVAL)
+		self.octoprint_socket.set_throttle(self.throttle.current)
+
+	def configure_stream(self, options, reset=False):
+		options = dict(options)
+		resync = options.pop('resync', False)
+		if reset:
+			self.stream_config = {}
+			self.message_filter.reset()
+			self.throttle.reset()
+			self.octoprint_socket.set_throttle(self.throttle.current)
+		self.stream_config.update(options)
+		if reset or resync or 'delta' in options:
+			self.delta_encoder.reset()
+		if 'visible' in options:
+			self.throttle.set_visible(options['visible'])
+		if 'subscriptions' in options:
+			self.message_filter.configure(options['subscriptions'])
+
+	def relay_octoprint_message(self, message):
+		if not self.message_filter.accept(message):
+			return
+		self.throttle.update_queue_depth(self.plabric_socket.get_outbound_depth())
+		coalesce_key = None
+		on_dropped = None
+		if message.type == 'current' and self.printer_monitor is None:
+			self._record_history(message.body)
+		if message.type in ('current', 'history') and self.stream_config.get('terminal') == 'pull':
+			self._pull_terminal_logs(message)
+		if message.type == 'history' and self.stream_config.get('history') == 'compact':
+			self._strip_history_temps(message)
+		if message.type == 'current':
+			if self.stream_config.get('delta'):
+				raw_size = message.raw_size
+				message.replace(self.delta_encoder.encode(message.body))
+				self.delta_encoder.count_bytes(raw_size, len(message.serialize()))
+				on_dropped = self.delta_encoder.force_keyframe
+			else:
+				coalesce_key = 'current'
+		self.plabric_socket.send_msg(key='socket_event', json=message.serialize(), coalesce_key=coalesce_key, on_dropped=on_dropped)
+
+	def _pull_terminal_logs(self, message):
+		body = message.body
+		logs = body.get('logs')
+		if self.printer_monitor is None and logs and message.type == 'current':
+			self.terminal_log.extend(logs)
+		if 'logs' in body:
+			body = dict(body)
+			del body['logs']
+			body['logSeq'] = self.terminal_log.last_seq
+			message.replace({message.type: body})
+
+	def _record_history(self, body):
+		for temperature in body.get('temps') or []:
+			self.history.add_temperature(temperature)
+		self.history.add_progress((body.get('progress') or {}).get('completion'))
+
+	def _strip_history_temps(self, message):
+		body = message.body
+		if 'temps' in body:
+			body = dict(body)
+			del body['temps']
+			message.replace({message.type: body})
+
+	def send_history_snapshot(self, joined_at):
+		started_at = time.time()
+		message = OctoprintMessage(payload={'historySnapshot': self.history.snapshot()})
+		json = message.serialize()
+		self.history.record_snapshot(len(json), time.time() - started_at)
+
+		def on_sent():
+			self.history.record_delivery(time.time() - joined_at)
+
+		self.plabric_socket.send_msg(key='socket_event', json=json, on_sent=on_sent, priority=PRIORITY_STATUS)
 
 	def probe_plugin_appkeys(self):
 		_logger.log('Octoprint API: Probe plugin appkeys')
@@ -397,8 +888,7 @@ class Main:
 					self._p.request_plabric_token()
 				else:
 					if count < 4:
-						time.sleep(3)
-						self._p.polling_for_api_key(token=token, count=count + 1)
+						self._p.scheduler.schedule('api_key_poll', 3, self._p.polling_for_api_key, token, count + 1)
 					else:
 						self._p.set_error('Unable to grant access to Octoprint')
 						self._p.disconnect()
@@ -427,6 +917,17 @@ class Main:
 
 		self.plabric_api.get_temporal_token(octoprint_api_key=self.octoprint_api_key, callback=Response(self))
 
+	def get_stats(self):
+		return dict(api_commands=self.command_executor.get_stats(), octoprint_cache=self.octoprint_api.get_cache_stats(),
+					octoprint_coalescing=self.octoprint_api.get_coalescing_stats(), plabric_socket=self.plabric_socket.get_stats(),
+					delta=self.delta_encoder.get_stats(), throttle=self.throttle.get_stats(),
+					subscriptions=self.message_filter.get_stats(), terminal=self.terminal_log.get_stats(),
+					history=self.history.get_stats(), process=_utils.process_stats(),
+					reconnect=self.reconnect_backoff.get_stats(), network=self.route_watcher.get_stats(),
+					scheduler=self.scheduler.get_stats(), latency=self.latency.get_stats(), clock_offset=self.clock_offset,
+					tracing=_tracing.TRACER.get_stats(), profiler=self.profiler.get_stats(), downloads=_download.get_stats(),
+					file_cache=self.file_cache.get_stats(), transfers=self.transfers.get_stats())
+
 	def get_status(self):
 		if self.step == Step.LOGIN_NEEDED:
 			return 'Login need'
@@ -441,6 +942,10 @@ class Main:
 		elif self.step == Step.ERROR_CONNECTION:
 			return 'Unable to connect'
 
+	def on_octoprint_event(self, event, payload):
+		self.octoprint_api.invalidate_event(event)
+		self.octoprint_socket.push_event(event, payload)
+
 	def send_printer_event(self, event):
 		if self.plabric_api_key:
 			class Response(APIProtocol):
@@ -458,9 +963,18 @@ class Main:
 		_logger.log('Disabling Plabric Plugin')
 		Storage(self.plugin).clear_setting('plabric_api_key')
 
+	def shutdown(self):
+		self.disconnect()
+		if self.printer_monitor:
+			self.printer_monitor.stop()
+		self.scheduler.cancel_all()
+		self.profiler.stop()
+		self.loop.stop()
+
 	def disconnect(self):
 		self.set_loading(True)
 		_logger.log('Disconnecting Plabric Plugin')
+		self.transfers.cancel_all()
 		self.video_streamer.stop()
 		self.octoprint_socket.disconnect()
 		self.plabric_socket.disconnect()
@@ -470,7 +984,10 @@ class Main:
 
 	def reconnect(self):
 		_logger.log('Reconnecting')
-		self.plabric_socket.disconnect()
-		self.plabric_socket = None
-		self._init_plabric_socket()
-		self.start()
+		self.scheduler.cancel('reconnect')
+		self.set_error('')
+		self.scheduler.schedule('connect', 0, self._reconnect)
+
+	def _reconnect(self):
+		self._renew_plabric_socket()
+		self.connect()
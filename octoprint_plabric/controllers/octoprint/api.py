@@ -1,7 +1,15 @@
+import os
+import time
 from enum import Enum
-from octoprint_plabric.controllers.common.api import API, APIProtocol
-from octoprint_plabric.controllers.common import logger as _logger
-import requests
+
+from requests.utils import quote
+
+from octoprint_plabric import config
+from octoprint_plabric.controllers.common.api import API, APIProtocol, count_transfer
+from octoprint_plabric.controllers.common import logger as _logger, tracing as _tracing
+from octoprint_plabric.controllers.common.multipart import MultipartStream
+from octoprint_plabric.controllers.common.singleflight import SingleFlight
+from octoprint_plabric.controllers.octoprint.cache import ResponseCache
 
 
 class OctoprintAPIProtocol(APIProtocol):
@@ -12,13 +20,30 @@ class OctoprintAPIProtocol(APIProtocol):
 class OctoprintAPI(API):
 
 	def __init__(self, domain):
-		super(OctoprintAPI, self).__init__(domain=domain, name='Octoprint API')
+		super(OctoprintAPI, self).__init__(domain=domain, name='Octoprint API', timeout_class='octoprint')
 		# super().__init__(domain=domain, name='Octoprint API')
 		self._api_key = None
+		self._cache = ResponseCache(ttls=config.OCTOPRINT_CACHE_TTLS, max_entries=config.OCTOPRINT_CACHE_MAX_ENTRIES,
+									related=config.OCTOPRINT_CACHE_RELATED, events=config.OCTOPRINT_CACHE_EVENTS)
+		self._single_flight = SingleFlight(name='Octoprint API')
 
 	def set_api_key(self, api_key):
+		if api_key != self._api_key:
+			self._cache.clear()
 		self._api_key = api_key
 
+	def invalidate_event(self, event):
+		self._cache.invalidate_event(event)
+
+	def get_cache_stats(self):
+		return self._cache.get_stats()
+
+	def resource_family(self, path):
+		return self._cache.family(path)
+
+	def get_coalescing_stats(self):
+		return self._single_flight.get_stats()
+
 	def get_headers(self, data=None):
 		h = {'Content-Type': 'application/json'}
 		if self._api_key:
@@ -41,39 +66,123 @@ class OctoprintAPI(API):
 		self.post(path='/api/login', params={'passive': True}, headers=self.get_headers(), callback=callback)
 
 	def call_method(self, data, callback):
-		action = DataAction(raw=data)
+		with _tracing.current().span('parse'):
+			action = DataAction(raw=data)
 		if action.method == Method.GET:
-			self.get(path=action.path, headers=self.get_headers(), callback=callback)
-
-		elif action.method == Method.POST:
+			self._cached_get(action=action, callback=callback)
+			return
+
+		family = self._cache.family(action.path)
+		self._cache.invalidate(family)
+		try:
+			self._call_write_method(action=action, data=data, callback=callback)
+		finally:
+			self._cache.invalidate(family)
+
+	def _cached_get(self, action, callback):
+		family = self._cache.family(action.path)
+		key = self._cache.key(action.method.value, action.path, action.params)
+		hit, response = self._cache.get(key)
+		if hit:
+			callback.on_succeed(response)
+			return
+		generation = self._cache.generation(family)
+
+		def execute(shared_callback):
+			self.get(path=action.path, headers=self.get_headers(), raw=True, callback=_CachingCallback(self._cache, key, family, generation, shared_callback))
+
+		self._single_flight.do(key=key, callback=callback, fn=execute)
+
+	def _call_write_method(self, action, data, callback):
+		if action.method == Method.POST:
 			if action.download_first:
 				callback.on_download_first(data)
 			elif action.create_folder:
 				self.create_folder(data=data, callback=callback)
 			else:
-				self.post(path=action.path, params=action.params, headers=self.get_headers(), callback=callback)
+				self.post(path=action.path, params=action.params, headers=self.get_headers(), callback=callback, raw=True)
 
 		elif action.method == Method.PUT:
-			self.put(path=action.path, params=action.params, headers=self.get_headers(), callback=callback)
+			self.put(path=action.path, params=action.params, headers=self.get_headers(), callback=callback, raw=True)
 		elif action.method == Method.PATCH:
-			self.patch(path=action.path, params=action.params, headers=self.get_headers(), callback=callback)
+			self.patch(path=action.path, params=action.params, headers=self.get_headers(), callback=callback, raw=True)
 		elif action.method == Method.DELETE:
-			self.delete(path=action.path, params=action.params, headers=self.get_headers(), callback=callback)
+			self.delete(path=action.path, params=action.params, headers=self.get_headers(), callback=callback, raw=True)
+
+	def upload_file(self, data, file_path, callback, progress=None):
+		with open(file_path, 'rb') as f:
+			chunks = iter(lambda: f.read(config.TRANSFER_CHUNK_SIZE), b'')
+			self.upload_stream(data=data, chunks=chunks, size=os.path.getsize(file_path), callback=callback, progress=progress)
 
-	def upload_file(self, data, file_path, callback):
+	def upload_stream(self, data, chunks, size, callback, progress=None):
 		_logger.log('Octoprint API: Uploading file')
 		action = DataAction(raw=data)
 		file_name = data['params']['file_name']
 		_logger.log('%s Post file on: %s' % (self._name, self._get_url(action.path)))
 
-		files = {"file": ("%s.gcode" % file_name, open(file_path, "rb").read())}
-		payload = {'path': 'plabric/tmp', 'select': 'true', 'print': 'false'}
-		self._execute(requests.post(self._get_url(action.path), data=payload, files=files, headers={'X-Api-Key': self._api_key}), callback)
+		body = MultipartStream(fields=[('path', 'plabric/tmp'), ('select', 'true'), ('print', 'false')],
+							   name='file', file_name='%s.gcode' % file_name, chunks=chunks, size=size, progress=progress)
+		family = self._cache.family(action.path)
+		self._cache.invalidate(family)
+		started_at = time.time()
+		try:
+			self._request('post', action.path, _SourceErrorCallback(body, callback), timeout_class='upload', raw=True, data=body,
+						  headers={'X-Api-Key': self._api_key, 'Content-Type': body.content_type})
+		finally:
+			count_transfer('upload', body.file_bytes, time.time() - started_at)
+			self._cache.invalidate(family)
+
+	def get_file(self, path, callback):
+		self.get(path='/api/files/local/%s' % quote(path), headers=self.get_headers(), callback=callback)
+
+	def select_file(self, path, callback):
+		family = self._cache.family('/api/files/local')
+		try:
+			self.post(path='/api/files/local/%s' % quote(path), params={'command': 'select', 'print': False}, headers=self.get_headers(),
+					  callback=callback)
+		finally:
+			self._cache.invalidate(family)
 
 	def create_folder(self, data, callback):
 		action = DataAction(raw=data)
 		payload = {'foldername': data['params']['foldername'], 'path': action.path.replace('/api/files/local', '')}
-		self._execute(requests.post(self._get_url('/api/files/local'), data=payload, headers={'X-Api-Key': self._api_key}), callback)
+		self._request('post', '/api/files/local', callback, raw=True, data=payload, headers={'X-Api-Key': self._api_key})
+
+
+class _CachingCallback(OctoprintAPIProtocol):
+
+	def __init__(self, cache, key, family, generation, callback):
+		self._cache = cache
+		self._key = key
+		self._family = family
+		self._generation = generation
+		self._callback = callback
+
+	def on_succeed(self, data):
+		if data is not None:
+			self._cache.put(self._key, self._family, data, self._generation)
+		self._callback.on_succeed(data)
+
+	def on_error(self, error):
+		self._callback.on_error(error)
+
+	def on_download_first(self, data):
+		self._callback.on_download_first(data)
+
+
+class _SourceErrorCallback(APIProtocol):
+	"""Reports the status of the error that aborted a streamed upload body (e.g. 502 for a failed verification) instead
+	of the 503 the wrapping connection error maps to."""
+
+	def __init__(self, body, callback):
+		self._body = body
+		self._callback = callback
+
+	def on_succeed(self, data):
+		self._callback.on_succeed(data)
+
+	def on_error(self, error):
+		self._callback.on_error(getattr(self._body.error, 'status', error))
 
 
 class Method(Enum):
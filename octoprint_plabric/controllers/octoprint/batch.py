@@ -0,0 +1,68 @@
+import threading
+from collections import OrderedDict
+
+from octoprint_plabric.controllers.octoprint.api import Method
+
+
+class ApiCommandBatch(object):
+
+	def __init__(self, batch, family, on_done):
+		self.batch = batch
+		commands = batch.get('commands')
+		self.commands = commands if isinstance(commands, list) else []
+		self._family = family
+		self._on_done = on_done
+		self._done = set()
+		self._lock = threading.Lock()
+
+	def plan(self):
+		"""Chains of command indexes to run one after another; malformed commands are answered with 400 and left out."""
+		groups = OrderedDict()
+		invalid = []
+		for index, command in enumerate(self.commands):
+			try:
+				family = self._family(command.get('url', ''))
+			except Exception:
+				invalid.append(index)
+				continue
+			groups.setdefault(family, []).append(index)
+
+		chains = []
+		for indexes in groups.values():
+			if any(self.commands[i].get('method') != Method.GET.value for i in indexes):
+				chains.append(indexes)
+			else:
+				chains.extend([[i] for i in indexes])
+		self.fail(invalid, 400)
+		return chains
+
+	def succeed(self, index, response):
+		self._complete(index, response=response, status_code=200)
+
+	def error(self, index, error):
+		self._complete(index, response=None, status_code=error)
+
+	def fail(self, indexes, error):
+		for index in indexes:
+			self.error(index, error)
+
+	def _complete(self, index, response, status_code):
+		with self._lock:
+			if index in self._done:
+				return
+			data = self.commands[index]
+			if not isinstance(data, dict):
+				data = self.commands[index] = {}
+			if response:
+				data['response'] = response
+			data['status_code'] = status_code
+			self._done.add(index)
+			finished = len(self._done) == len(self.commands)
+		if finished:
+			self._on_done(self.response())
+
+	def response(self):
+		data = dict(self.batch)
+		data.pop('commands', None)
+		data['responses'] = self.commands
+		return data
@@ -0,0 +1,176 @@
+import hashlib
+import threading
+import time
+
+from octoprint_plabric.controllers.common import logger as _logger
+
+try:
+	from octoprint.access.permissions import Permissions
+except ImportError:
+	Permissions = None
+
+# Same gating as OctoPrint's push socket: events needing more than STATUS, and events whose payload only admins see
+_EVENT_PERMISSIONS = {'UserLoggedIn': ['ADMIN'], 'UserLoggedOut': ['ADMIN']}
+_ADMIN_PAYLOAD_EVENTS = ('ClientOpened', 'ClientAuthed')
+
+
+class OctoprintBridge(object):
+
+	requires_login = False
+
+	def __init__(self, printer, plugin_manager, file_manager, callback):
+		_logger.log('Octoprint Bridge: Initializing')
+		self._printer = printer
+		self._plugin_manager = plugin_manager
+		self._file_manager = file_manager
+		self._callback = callback
+		self._connected = False
+		self._user = None
+		self._throttle = 1
+		self._throttle_counter = 0
+		self._logs = []
+		self._messages = []
+		self._temperatures = []
+		self._lock = threading.Lock()
+
+	def connect(self, api_key):
+		"""Starts pushing for the OctoPrint user owning ``api_key`` (user, global or app key), resolved in-process.
+
+		Returns False when the key belongs to no active user.
+		"""
+		if self._connected:
+			return True
+		try:
+			from octoprint.server.util import get_user_for_apikey
+		except ImportError:
+			get_user_for_apikey = None
+		if get_user_for_apikey is not None:
+			user = get_user_for_apikey(api_key)
+			if user is None or not getattr(user, 'is_active', True):
+				_logger.warn('Octoprint Bridge: API key does not belong to an active user')
+				return False
+			self._user = user
+		_logger.log('Octoprint Bridge: Connecting')
+		self._connected = True
+		self._emit('connected', self._get_connected())
+		if self._allowed(['STATUS']):
+			self._plugin_manager.register_message_receiver(self._on_plugin_message)
+			self._printer.register_callback(self)
+		self._callback.connected()
+		return True
+
+	def connected(self):
+		return self._connected
+
+	def disconnect(self):
+		if not self._connected:
+			return
+		_logger.log('Octoprint Bridge: Disconnecting')
+		self._connected = False
+		self._user = None
+		try:
+			self._printer.unregister_callback(self)
+			self._plugin_manager.unregister_message_receiver(self._on_plugin_message)
+		except Exception as e:
+			_logger.warn(e)
+		with self._lock:
+			self._logs = []
+			self._messages = []
+			self._temperatures = []
+		self._callback.disconnected()
+
+	def set_throttle(self, throttle):
+		self._throttle = throttle
+
+	def push_event(self, event, payload):
+		if self._connected and self._allowed(['STATUS'] + _EVENT_PERMISSIONS.get(event, [])):
+			if event in _ADMIN_PAYLOAD_EVENTS and not self._allowed(['ADMIN']):
+				payload = {}
+			self._emit('event', {'type': event, 'payload': payload})
+
+	def _emit(self, message_type, payload):
+		if self._connected:
+			self._callback.on_event(event={message_type: payload})
+
+	def _allowed(self, permissions):
+		if self._user is None or Permissions is None:
+			return True
+		return all(self._user.has_permission(getattr(Permissions, name)) for name in permissions)
+
+	def _get_connected(self):
+		try:
+			import octoprint.plugin
+			import octoprint.server
+			from octoprint.settings import settings
+
+			kinds = (octoprint.plugin.TemplatePlugin, octoprint.plugin.AssetPlugin)
+			ui_plugins = sorted(set('%s:%s' % (impl._identifier, impl._plugin_version)
+									for kind in kinds for impl in self._plugin_manager.get_implementations(kind)))
+			return dict(version=octoprint.server.VERSION, display_version=octoprint.server.DISPLAY_VERSION, branch=octoprint.server.BRANCH,
+						plugin_hash=hashlib.md5(','.join(ui_plugins).encode('utf-8')).hexdigest(), config_hash=settings().config_hash,
+						debug=octoprint.server.debug, safe_mode=octoprint.server.safe_mode, online=self._get_online(),
+						permissions=[permission.as_dict() for permission in Permissions.all()] if Permissions else [])
+		except (ImportError, AttributeError) as e:
+			_logger.warn(e)
+			return {}
+
+	@staticmethod
+	def _get_online():
+		# OctoPrint 1.5+ reports its connectivity check here; older versions have none and assume online
+		import octoprint.server
+		checker = getattr(octoprint.server, 'connectivityChecker', None)
+		return checker.online if checker is not None else True
+
+	def _on_plugin_message(self, plugin, data, permissions=None):
+		if permissions is not None and self._user is not None and not all(self._user.has_permission(p) for p in permissions):
+			return
+		self._emit('plugin', {'plugin': plugin, 'data': data})
+
+	# ~~ PrinterCallback
+
+	def on_printer_add_log(self, data):
+		with self._lock:
+			self._logs.append(data)
+
+	def on_printer_add_message(self, data):
+		with self._lock:
+			self._messages.append(data)
+
+	def on_printer_add_temperature(self, data):
+		with self._lock:
+			self._temperatures.append(data)
+
+	def on_printer_received_registered_message(self, name, output):
+		pass
+
+	def on_printer_send_initial_data(self, data):
+		data = dict(data)
+		data['serverTime'] = time.time()
+		self._emit('history', data)
+
+	def on_printer_send_current_data(self, data):
+		with self._lock:
+			self._throttle_counter += 1
+			if self._throttle_counter < self._throttle:
+				return
+			self._throttle_counter = 0
+			logs, self._logs = self._logs, []
+			messages, self._messages = self._messages, []
+			temperatures, self._temperatures = self._temperatures, []
+
+		data = dict(data)
+		data.update({'serverTime': time.time(), 'temps': temperatures, 'logs': logs, 'messages': messages,
+					 'busyFiles': self._get_busy_files(data)})
+		self._emit('current', data)
+
+	def _get_busy_files(self, data):
+		busy_files = []
+		try:
+			if self._file_manager:
+				busy_files = [dict(origin=f[0], path=f[1]) for f in self._file_manager.get_busy_files()]
+			job_file = (data.get('job') or {}).get('file') or {}
+			if job_file.get('path') and job_file.get('origin') and (self._printer.is_printing() or self._printer.is_paused()):
+				busy_files.append(dict(origin=job_file['origin'], path=job_file['path']))
+		except Exception as e:
+			_logger.warn(e)
+		return busy_files
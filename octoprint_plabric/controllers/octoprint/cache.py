@@ -0,0 +1,94 @@
+import json as _json
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache(object):
+
+	def __init__(self, ttls, max_entries, related=None, events=None):
+		self._ttls = ttls
+		self._max_entries = max_entries
+		self._related = related or {}
+		self._events = events or {}
+		self._entries = OrderedDict()
+		self._generations = {}
+		self._epoch = 0
+		self._lock = threading.Lock()
+		self._hits = 0
+		self._misses = 0
+		self._evictions = 0
+		self._invalidations = 0
+
+	def family(self, path):
+		path = path.split('?')[0].rstrip('/')
+		best = None
+		for prefix in self._ttls:
+			if path == prefix or path.startswith(prefix + '/'):
+				if best is None or len(prefix) > len(best):
+					best = prefix
+		if best:
+			return best
+		return '/'.join(path.split('/')[:3])
+
+	def ttl(self, family):
+		return self._ttls.get(family, 0)
+
+	@staticmethod
+	def key(method, path, params=None):
+		return '%s %s %s' % (method, path, _json.dumps(params, sort_keys=True) if params else '')
+
+	def generation(self, family):
+		return self._epoch, self._generations.get(family, 0)
+
+	def get(self, key):
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None:
+				expires_at, family, value = entry
+				if expires_at > time.time():
+					self._entries[key] = self._entries.pop(key)
+					self._hits += 1
+					return True, value
+				del self._entries[key]
+			self._misses += 1
+			return False, None
+
+	def put(self, key, family, value, generation):
+		ttl = self.ttl(family)
+		if ttl <= 0:
+			return
+		with self._lock:
+			if self.generation(family) != generation:
+				return
+			self._entries.pop(key, None)
+			self._entries[key] = (time.time() + ttl, family, value)
+			while len(self._entries) > self._max_entries:
+				self._entries.popitem(last=False)
+				self._evictions += 1
+
+	def invalidate(self, family):
+		families = [family] + list(self._related.get(family, []))
+		with self._lock:
+			for f in families:
+				self._generations[f] = self._generations.get(f, 0) + 1
+			for key in [k for k, e in self._entries.items() if e[1] in families]:
+				del self._entries[key]
+				self._invalidations += 1
+
+	def invalidate_event(self, event):
+		for family in self._events.get(event, []):
+			self.invalidate(family)
+
+	def clear(self):
+		with self._lock:
+			self._invalidations += len(self._entries)
+			self._entries.clear()
+			self._epoch += 1
+
+	def get_stats(self):
+		with self._lock:
+			lookups = self._hits + self._misses
+			return dict(entries=len(self._entries), hits=self._hits, misses=self._misses,
+						hit_ratio=float(self._hits) / lookups if lookups else 0.0,
+						evictions=self._evictions, invalidations=self._invalidations)
@@ -0,0 +1,102 @@
+import threading
+import time
+
+VOLATILE_KEYS = ('logs', 'messages', 'temps', 'serverTime')
+
+
+def diff(old, new, removed, path=()):
+	"""Changes from ``old`` to ``new``, nested dicts patched key by key and other values sent whole, null included.
+
+	Keys that disappeared are not in the patch; their paths (lists of keys) are appended to ``removed``.
+	"""
+	patch = {}
+	for key, value in new.items():
+		if key not in old:
+			patch[key] = value
+			continue
+		previous = old[key]
+		if isinstance(value, dict) and isinstance(previous, dict):
+			changes = diff(previous, value, removed, path + (key, ))
+			if changes:
+				patch[key] = changes
+		elif value != previous:
+			patch[key] = value
+	for key in old:
+		if key not in new:
+			removed.append(list(path + (key, )))
+	return patch
+
+
+def apply(state, patch, removed=()):
+	"""What a client does with a current_delta: ``apply(prev, diff(prev, cur, removed), removed) == cur``."""
+	state = dict(state)
+	for key, value in patch.items():
+		previous = state.get(key)
+		state[key] = apply(previous, value) if isinstance(value, dict) and isinstance(previous, dict) else value
+	for path in removed:
+		_remove(state, path)
+	return state
+
+
+def _remove(state, path):
+	if len(path) == 1:
+		state.pop(path[0], None)
+	elif isinstance(state.get(path[0]), dict):
+		state[path[0]] = dict(state[path[0]])
+		_remove(state[path[0]], path[1:])
+
+
+class DeltaEncoder(object):
+
+	def __init__(self, keyframe_interval, keyframe_seconds):
+		self._keyframe_interval = keyframe_interval
+		self._keyframe_seconds = keyframe_seconds
+		self._state = None
+		self._seq = 0
+		self._keyframe_at = 0
+		self._lock = threading.Lock()
+		self._keyframes = 0
+		self._deltas = 0
+		self._raw_bytes = 0
+		self._encoded_bytes = 0
+
+	def reset(self):
+		with self._lock:
+			self._state = None
+
+	force_keyframe = reset
+
+	def encode(self, body):
+		state = dict((k, v) for k, v in body.items() if k not in VOLATILE_KEYS)
+		with self._lock:
+			keyframe = self._state is None or self._seq >= self._keyframe_interval or time.time() - self._keyframe_at >= self._keyframe_seconds
+			if keyframe:
+				self._seq = 0
+				self._keyframe_at = time.time()
+				self._keyframes += 1
+				self._state = state
+				return {'current': body}
+
+			removed = []
+			patch = diff(self._state, state, removed)
+			self._state = state
+			self._seq += 1
+			self._deltas += 1
+			seq = self._seq
+
+		for key in VOLATILE_KEYS:
+			value = body.get(key)
+			if value:
+				patch[key] = value
+		delta = {'seq': seq, 'patch': patch}
+		if removed:
+			delta['removed'] = removed
+		return {'current_delta': delta}
+
+	def count_bytes(self, raw_size, encoded_size):
+		self._raw_bytes += raw_size
+		self._encoded_bytes += encoded_size
+
+	def get_stats(self):
+		return dict(keyframes=self._keyframes, deltas=self._deltas, raw_bytes=self._raw_bytes, encoded_bytes=self._encoded_bytes,
+					ratio=float(self._raw_bytes) / self._encoded_bytes if self._encoded_bytes else 0.0)
@@ -0,0 +1,117 @@
+import math
+import threading
+import time
+from array import array
+
+_NAN = float('nan')
+
+
+class _Tier(object):
+
+	def __init__(self, resolution, capacity):
+		self.resolution = resolution
+		self.capacity = capacity
+		self.times = array('d', [0.0] * capacity)
+		self.channels = {}
+		self.head = 0
+		self.count = 0
+		self._bucket = None
+		self._sums = {}
+		self._samples = {}
+
+	@property
+	def span(self):
+		return self.resolution * self.capacity
+
+	def add(self, t, values):
+		bucket = int(t // self.resolution) * self.resolution
+		if self._bucket is not None and bucket < self._bucket:
+			# A sample that lost the race with a newer one is averaged into the open bucket so times never go backwards
+			bucket = self._bucket
+		if self._bucket is not None and bucket != self._bucket:
+			self._flush()
+		self._bucket = bucket
+		for name, value in values.items():
+			self._sums[name] = self._sums.get(name, 0.0) + value
+			self._samples[name] = self._samples.get(name, 0) + 1
+
+	def _flush(self):
+		for name in self._sums:
+			if name not in self.channels:
+				self.channels[name] = array('d', [_NAN] * self.capacity)
+		for name, column in self.channels.items():
+			samples = self._samples.get(name)
+			column[self.head] = self._sums[name] / samples if samples else _NAN
+		self.times[self.head] = self._bucket
+		self.head = (self.head + 1) % self.capacity
+		self.count = min(self.count + 1, self.capacity)
+		self._sums = {}
+		self._samples = {}
+
+	def indexes(self, start, end):
+		first = (self.head - self.count) % self.capacity
+		for offset in range(self.count):
+			i = (first + offset) % self.capacity
+			if start <= self.times[i] < end:
+				yield i
+
+
+class HistoryRing(object):
+
+	def __init__(self, tiers):
+		self._tiers = [_Tier(resolution, capacity) for resolution, capacity in tiers]
+		self._lock = threading.Lock()
+		self._stats = dict(samples=0, snapshots=0, snapshot_bytes=0, build_time=0.0, time_to_snapshot=0.0)
+
+	def add_temperature(self, data):
+		values = {}
+		for name, value in data.items():
+			if isinstance(value, dict):
+				for key in ('actual', 'target'):
+					if isinstance(value.get(key), (int, float)):
+						values['%s.%s' % (name, key)] = float(value[key])
+		if values:
+			self._add(time.time(), values)
+
+	def add_progress(self, completion):
+		if isinstance(completion, (int, float)):
+			self._add(time.time(), {'progress': float(completion)})
+
+	def _add(self, t, values):
+		with self._lock:
+			self._stats['samples'] += 1
+			for tier in self._tiers:
+				tier.add(t, values)
+
+	def snapshot(self, now=None):
+		now = now or time.time()
+		series = []
+		with self._lock:
+			end = now
+			for tier in self._tiers:
+				start = now - tier.span
+				indexes = list(tier.indexes(start, end))
+				if indexes:
+					channels = {}
+					for name, column in tier.channels.items():
+						channels[name] = [None if math.isnan(column[i]) else round(column[i], 1) for i in indexes]
+					series.append({'resolution': tier.resolution, 't': [int(tier.times[i]) for i in indexes], 'channels': channels})
+					end = min(end, tier.times[indexes[0]])
+		series.reverse()
+		return {'serverTime': now, 'series': series}
+
+	def record_snapshot(self, size, build_time):
+		with self._lock:
+			self._stats['snapshots'] += 1
+			self._stats['snapshot_bytes'] = size
+			self._stats['build_time'] = build_time
+
+	def record_delivery(self, time_to_snapshot):
+		with self._lock:
+			self._stats['time_to_snapshot'] = time_to_snapshot
+
+	def get_stats(self):
+		with self._lock:
+			stats = dict(self._stats)
+			stats['tiers'] = [dict(resolution=t.resolution, count=t.count, channels=len(t.channels)) for t in self._tiers]
+			return stats
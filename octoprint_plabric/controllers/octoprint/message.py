@@ -0,0 +1,53 @@
+import json as _json
+import re
+
+_TYPE_RE = re.compile(r'^\s*\{\s*"([^"]+)"')
+
+
+def _default(o):
+	if isinstance(o, (set, frozenset)):
+		return list(o)
+	return str(o)
+
+
+class OctoprintMessage(object):
+	__slots__ = ('_raw', '_payload', '_type')
+
+	def __init__(self, raw=None, payload=None):
+		self._raw = raw
+		self._payload = payload
+		self._type = None
+
+	@property
+	def type(self):
+		if self._type is None:
+			if self._payload is not None:
+				self._type = next(iter(self._payload), '')
+			else:
+				match = _TYPE_RE.match(self._raw)
+				self._type = match.group(1) if match else ''
+		return self._type
+
+	@property
+	def payload(self):
+		if self._payload is None:
+			self._payload = _json.loads(self._raw)
+		return self._payload
+
+	@property
+	def raw_size(self):
+		return len(self._raw) if self._raw is not None else 0
+
+	@property
+	def body(self):
+		return self.payload.get(self.type)
+
+	def replace(self, payload):
+		self._payload = payload
+		self._raw = None
+		self._type = None
+
+	def serialize(self):
+		if self._raw is None:
+			self._raw = _json.dumps(self._payload, default=_default)
+		return self._raw
@@ -0,0 +1,37 @@
+class PrinterMonitor(object):
+
+	def __init__(self, printer, terminal_log, history):
+		self._printer = printer
+		self._terminal_log = terminal_log
+		self._history = history
+		self._registered = False
+
+	def start(self):
+		if not self._registered:
+			self._printer.register_callback(self)
+			self._registered = True
+
+	def stop(self):
+		if self._registered:
+			self._printer.unregister_callback(self)
+			self._registered = False
+
+	# ~~ PrinterCallback
+
+	def on_printer_add_log(self, data):
+		self._terminal_log.append(data)
+
+	def on_printer_add_message(self, data):
+		pass
+
+	def on_printer_add_temperature(self, data):
+		self._history.add_temperature(data)
+
+	def on_printer_received_registered_message(self, name, output):
+		pass
+
+	def on_printer_send_initial_data(self, data):
+		pass
+
+	def on_printer_send_current_data(self, data):
+		self._history.add_progress((data.get('progress') or {}).get('completion'))
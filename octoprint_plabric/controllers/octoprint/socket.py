@@ -18,12 +18,15 @@ class OctoprintSocketProtocol:
 
 class OctoprintSocket:
 
+	requires_login = True
+
 	def __init__(self, domain, callback):
 		_logger.log('Octoprint Socket: Initializing')
 		self._domain = domain
 		self._ws = None
 		self._callback = callback
 		self._thread = None
+		self._throttle = 10
 
 	def connect(self, username, session):
 		self._connect(username, session)
@@ -31,6 +34,21 @@ class OctoprintSocket:
 	def connected(self):
 		return self._ws and self._ws.sock and self._ws.sock.connected
 
+	def set_throttle(self, throttle):
+		self._throttle = throttle
+		if self.connected():
+			_logger.log('Octoprint Socket: Throttle %d' % throttle)
+			try:
+				self._ws.send(_json.dumps({'throttle': throttle}))
+			except Exception as e:
+				_logger.warn(e)
+
+	def push_event(self, event, payload):
+		pass
+
+	def _get_ws_url(self):
+		return "%s/sockjs/websocket" % self._domain.replace('http', 'ws', 1)
+
 	def disconnect(self):
 		_logger.log('Octoprint Socket: Disconnecting')
 		if self._ws:
@@ -56,11 +74,11 @@ class OctoprintSocket:
 			def _on_open(ws):
 				_logger.log('Octoprint Socket: Ws Opened')
 				self._ws.send(_json.dumps({'auth': '%s:%s' % (username, session)}))
-				self._ws.send(_json.dumps({'throttle': 10}))
+				self._ws.send(_json.dumps({'throttle': self._throttle}))
 				self._callback.connected()
 
 			try:
-				self._ws = websocket.WebSocketApp("ws://localhost:5000/sockjs/websocket", on_message=_on_message, on_error=_on_error, on_close=_on_close, on_open=_on_open)
+				self._ws = websocket.WebSocketApp(self._get_ws_url(), on_message=_on_message, on_error=_on_error, on_close=_on_close, on_open=_on_open)
 
 				self._thread = threading.Thread(target=self._ws.run_forever)
 				self._thread.daemon = True
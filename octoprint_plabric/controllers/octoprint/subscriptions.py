@@ -0,0 +1,52 @@
+import threading
+
+
+class MessageFilter(object):
+
+	def __init__(self):
+		self._types = None
+		self._events = None
+		self._plugins = None
+		self._counters = {}
+		self._lock = threading.Lock()
+
+	def configure(self, subscriptions):
+		subscriptions = subscriptions or {}
+		self._types = self._as_set(subscriptions.get('types'))
+		self._events = self._as_set(subscriptions.get('events'))
+		self._plugins = self._as_set(subscriptions.get('plugins'))
+
+	def reset(self):
+		self.configure(None)
+
+	@staticmethod
+	def _as_set(values):
+		return frozenset(values) if values is not None else None
+
+	def accept(self, message):
+		message_type = message.type
+		reason = None
+		if self._types is not None and message_type not in self._types:
+			reason = 'type'
+		elif message_type == 'event' and self._events is not None:
+			if (message.body or {}).get('type') not in self._events:
+				reason = 'event'
+		elif message_type == 'plugin' and self._plugins is not None:
+			if (message.body or {}).get('plugin') not in self._plugins:
+				reason = 'plugin'
+		self._count(message_type, 'dropped_%s' % reason if reason else 'relayed')
+		return reason is None
+
+	def _count(self, message_type, name):
+		with self._lock:
+			counters = self._counters.get(message_type)
+			if counters is None:
+				counters = self._counters[message_type] = dict(relayed=0, dropped_type=0, dropped_event=0, dropped_plugin=0)
+			counters[name] += 1
+
+	def get_stats(self):
+		with self._lock:
+			return dict(types=sorted(self._types) if self._types is not None else None,
+						events=sorted(self._events) if self._events is not None else None,
+						plugins=sorted(self._plugins) if self._plugins is not None else None,
+						counters=dict((k, dict(v)) for k, v in self._counters.items()))
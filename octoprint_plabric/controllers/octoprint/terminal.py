@@ -0,0 +1,39 @@
+import itertools
+import threading
+from collections import deque
+
+
+class TerminalLog(object):
+
+	def __init__(self, size):
+		self._lines = deque(maxlen=size)
+		self._next_seq = 0
+		self._lock = threading.Lock()
+
+	@property
+	def last_seq(self):
+		return self._next_seq - 1
+
+	def append(self, line):
+		with self._lock:
+			self._lines.append(line)
+			self._next_seq += 1
+
+	def extend(self, lines):
+		with self._lock:
+			self._lines.extend(lines)
+			self._next_seq += len(lines)
+
+	def read(self, start=None, count=100):
+		with self._lock:
+			first = self._next_seq - len(self._lines)
+			if start is None:
+				start = max(first, self._next_seq - count)
+			start = max(start, first)
+			end = min(start + count, self._next_seq)
+			lines = list(itertools.islice(self._lines, start - first, end - first)) if end > start else []
+			return dict(first=first, last=self._next_seq - 1, start=start, lines=lines)
+
+	def get_stats(self):
+		with self._lock:
+			return dict(lines=len(self._lines), capacity=self._lines.maxlen, last_seq=self._next_seq - 1)
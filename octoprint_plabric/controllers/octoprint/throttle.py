@@ -0,0 +1,76 @@
+import threading
+import time
+
+
+class ThrottleController(object):
+
+	def __init__(self, apply, default, visible, hidden, maximum, queue_high, rtt_high, min_interval):
+		self._apply = apply
+		self._default = default
+		self._visible_throttle = visible
+		self._hidden_throttle = hidden
+		self._maximum = maximum
+		self._queue_high = queue_high
+		self._rtt_high = rtt_high
+		self._min_interval = min_interval
+		self._visible = None
+		self._rtt = None
+		self._queue_depth = 0
+		self._current = default
+		self._changed_at = 0
+		self._checked_at = 0
+		self._changes = 0
+		self._lock = threading.Lock()
+
+	@property
+	def current(self):
+		return self._current
+
+	def reset(self):
+		self._visible = None
+		self._rtt = None
+		self._queue_depth = 0
+		self._current = self._default
+		self._changed_at = 0
+
+	def set_visible(self, visible):
+		self._visible = visible
+		self.evaluate(force=True)
+
+	def set_rtt(self, rtt):
+		self._rtt = rtt
+		self.evaluate()
+
+	def update_queue_depth(self, depth):
+		self._queue_depth = depth
+		now = time.time()
+		if now - self._checked_at >= 1:
+			self._checked_at = now
+			self.evaluate()
+
+	def target(self):
+		if self._visible is None:
+			target = self._default
+		else:
+			target = self._visible_throttle if self._visible else self._hidden_throttle
+		if self._queue_depth >= self._queue_high:
+			target *= 2 if self._queue_depth < 2 * self._queue_high else 4
+		if self._rtt is not None and self._rtt >= self._rtt_high:
+			target *= 2
+		return min(target, self._maximum)
+
+	def evaluate(self, force=False):
+		with self._lock:
+			target = self.target()
+			if target == self._current:
+				return
+			now = time.time()
+			if not force and target < self._current and now - self._changed_at < self._min_interval:
+				return
+			self._current = target
+			self._changed_at = now
+			self._changes += 1
+		self._apply(target)
+
+	def get_stats(self):
+		return dict(throttle=self._current, visible=self._visible, rtt=self._rtt, queue_depth=self._queue_depth, changes=self._changes)
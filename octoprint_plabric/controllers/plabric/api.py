@@ -1,12 +1,12 @@
-import requests
 from octoprint_plabric.controllers.common.api import API, APIProtocol
 from octoprint_plabric.controllers.common import logger as _logger
+from octoprint_plabric.controllers.plabric.download import CANCELLED_STATUS, DownloadError, DownloadStream, expected_digest
 
 
 class PlabricAPI(API):
 
 	def __init__(self, domain):
-		super(PlabricAPI, self).__init__(domain=domain, name='Plabric API')
+		super(PlabricAPI, self).__init__(domain=domain, name='Plabric API', timeout_class='plabric')
 
 	def get_temporal_token(self, octoprint_api_key, callback):
 		self.post(path='/octoprint/plugin/token', params={'octoprint_api_key': octoprint_api_key}, callback=callback)
@@ -23,35 +23,47 @@ class PlabricAPI(API):
 	def send_metadata(self, plabric_api_key, plugin_version, machine, system, pi_version, callback):
 		self.post(path='/octoprint/plugin/metadata', params={'api_key': plabric_api_key, 'p': plugin_version, 'm': machine, 's': system, 'r': pi_version}, callback=callback)
 
-	def download_temporal_file(self, plabric_api_key, file_id, destination, callback):
+	def open_temporal_file(self, plabric_api_key, file_id, callback, offset=0, validator=None, digest=None, hasher=None, cache=None, cancelled=None):
+		"""Opens the download of ``file_id``, or calls ``callback.on_cached`` when ``cache`` already holds its content.
+
+		Once the ``cancelled`` event is set no further request is sent and ``callback.on_error`` gets CANCELLED_STATUS.
+		"""
 		class Response(APIProtocol):
-			def __init__(self, p, destination, callback):
+			def __init__(self, p):
 				self._p = p
-				self._callback = callback
-				self._destination = destination
 
 			def on_succeed(self, data):
-				url = data['url']
-				self._p.execute_dowload(url=url, destination=self._destination, callback=callback)
+				announced = expected_digest(data=data)
+				cached = cache.lookup(file_id, digest=announced) if cache and announced else None
+				if cached:
+					callback.on_cached(cached)
+					return
+				resumable = offset and (announced is None or announced == digest)
+				self._p.open_download(url=data['url'], callback=callback, offset=offset if resumable else 0, validator=validator,
+									  digest=announced or digest, hasher=hasher if resumable else None,
+									  cache=cache if not announced else None, file_id=file_id, cancelled=cancelled)
 
 			def on_error(self, error):
-				self._callback.on_error(error)
+				callback.on_error(error)
 
-		self.get_file_url(plabric_api_key=plabric_api_key, file_id=file_id, callback=Response(p=self, destination=destination, callback=callback))
+		if cancelled is not None and cancelled.is_set():
+			callback.on_error(CANCELLED_STATUS)
+			return
+		self.get_file_url(plabric_api_key=plabric_api_key, file_id=file_id, callback=Response(self))
 
-	def execute_dowload(self, url, destination, callback):
+	def open_download(self, url, callback, offset=0, validator=None, digest=None, hasher=None, cache=None, file_id=None, cancelled=None):
 		_logger.log('Plabric API: Downloading file')
-		r = requests.get(url, stream=True)
-		if r.status_code == 200:
-			with open(destination, 'wb') as f:
-				total_size = int(r.headers.get('content-length', 0))
-				if total_size is None:
-					f.write(r.content)
-				else:
-					dl = 0
-					for data in r.iter_content(chunk_size=4096):
-						dl += len(data)
-						f.write(data)
-			callback.on_succeed(None)
-		else:
-			callback.on_error(r.status_code)
+		download = DownloadStream(session=self._session, url=url, timeout=self.get_timeout('download'), offset=offset,
+								  validator=validator, digest=digest, hasher=hasher, cancelled=cancelled)
+		try:
+			download.open()
+		except DownloadError as e:
+			_logger.warn(e)
+			callback.on_error(e.status)
+			return
+		cached = cache.lookup(file_id, digest=download.digest, validator=download.validator) if cache else None
+		if cached:
+			download.close()
+			callback.on_cached(cached)
+			return
+		callback.on_succeed(download)
@@ -0,0 +1,245 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from octoprint_plabric import config
+from octoprint_plabric.controllers.common import logger as _logger, metrics as _metrics
+
+_lookups = _metrics.REGISTRY.counter('plabric_file_cache_lookups_total', 'G-code cache lookups', ('result', ))
+_saved = _metrics.REGISTRY.counter('plabric_file_cache_saved_bytes_total', 'Transfer bytes avoided by the G-code cache', ('direction', ))
+_evictions = _metrics.REGISTRY.counter('plabric_file_cache_evictions_total', 'Files evicted from the G-code cache')
+
+_INDEX = 'index.json'
+_INCOMING = '.incoming-'
+
+
+def digest_key(digest):
+	return '%s:%s' % digest
+
+
+class CachedFile(object):
+	"""A cache entry pinned against eviction until ``release`` is called."""
+
+	def __init__(self, cache, key, path, size, uploads):
+		self.key = key
+		self.path = path
+		self.size = size
+		self.uploads = uploads
+		self._cache = cache
+		self._released = False
+
+	def release(self):
+		if not self._released:
+			self._released = True
+			self._cache.release(self.key)
+
+
+class FileCache(object):
+	"""Downloaded G-code files stored under their sha256, with an index of the Plabric file ids and digests that map to them.
+
+	The index is rewritten on every change so it survives restarts. Files are evicted least recently used first once
+	they take more than ``quota`` bytes, skipping those pinned by an unreleased CachedFile; a quota of 0 disables the cache.
+	"""
+
+	def __init__(self, directory, quota):
+		self._directory = directory
+		self._quota = quota
+		self._lock = threading.Lock()
+		self._entries = {}
+		self._files = {}
+		self._pinned = {}
+		self._hits = 0
+		self._misses = 0
+		self._evictions = 0
+		self._saved = {'download': 0, 'upload': 0}
+		if quota:
+			self._load()
+
+	@property
+	def enabled(self):
+		return self._quota > 0
+
+	def lookup(self, file_id, digest=None, validator=None):
+		"""CachedFile with the content of ``file_id``, matched by its announced digest or else by its HTTP validator."""
+		if not self.enabled:
+			return None
+		with self._lock:
+			key = None
+			if digest:
+				wanted = digest_key(digest)
+				key = next((k for k, entry in self._entries.items() if wanted in entry['digests']), None)
+			elif validator and file_id in self._files:
+				key = self._files[file_id]
+				if self._entries.get(key, {}).get('validator') != validator:
+					key = None
+			entry = self._entries.get(key)
+			if entry is None or not os.path.isfile(self._path(key)):
+				self._misses += 1
+				_lookups.inc(('miss', ))
+				return None
+			self._hits += 1
+			_lookups.inc(('hit', ))
+			self._count_saved('download', entry['size'])
+			entry['used'] = time.time()
+			self._files[file_id] = key
+			self._save()
+			return self._pin(key)
+
+	def writer(self):
+		"""CacheWriter to tee a streamed download into the cache, None when the cache is disabled."""
+		if not self.enabled:
+			return None
+		return CacheWriter(self, os.path.join(self._directory, _INCOMING + uuid.uuid4().hex))
+
+	def store(self, file_id, path, digest=None, validator=None, sha256=None):
+		"""Moves the verified download at ``path`` into the cache and returns its CachedFile, None when it was not kept."""
+		if not self.enabled:
+			return None
+		size = os.path.getsize(path)
+		if size > self._quota:
+			return None
+		if sha256 is None:
+			sha256 = digest[1] if digest and digest[0] == 'sha256' else _file_sha256(path)
+		digests = set([digest_key(('sha256', sha256))])
+		if digest:
+			digests.add(digest_key(digest))
+		with self._lock:
+			entry = self._entries.get(sha256)
+			if entry is None:
+				shutil.move(path, self._path(sha256))
+				entry = self._entries[sha256] = {'size': size, 'digests': [], 'validator': None, 'uploads': {}}
+			elif os.path.exists(path):
+				os.remove(path)
+			entry['digests'] = sorted(digests.union(entry['digests']))
+			entry['validator'] = validator or entry['validator']
+			entry['used'] = time.time()
+			self._files[file_id] = sha256
+			cached = self._pin(sha256)
+			self._evict()
+			self._save()
+			return cached
+
+	def release(self, key):
+		with self._lock:
+			count = self._pinned.pop(key, 0) - 1
+			if count > 0:
+				self._pinned[key] = count
+			elif self._evict():
+				self._save()
+
+	def record_upload(self, key, file_name, upload):
+		"""Remembers where OctoPrint stored the cached file ``key`` as ``file_name`` so a repeat can reuse it."""
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None:
+				entry['uploads'][file_name] = upload
+				self._save()
+
+	def count_upload_saved(self, size):
+		with self._lock:
+			self._count_saved('upload', size)
+
+	def get_stats(self):
+		with self._lock:
+			lookups = self._hits + self._misses
+			return dict(entries=len(self._entries), bytes=sum(entry['size'] for entry in self._entries.values()), quota=self._quota,
+						hits=self._hits, misses=self._misses, hit_rate=float(self._hits) / lookups if lookups else 0.0,
+						saved_download_bytes=self._saved['download'], saved_upload_bytes=self._saved['upload'], evictions=self._evictions)
+
+	def _count_saved(self, direction, size):
+		self._saved[direction] += size
+		_saved.inc((direction, ), size)
+
+	def _path(self, key):
+		return os.path.join(self._directory, '%s.gcode' % key)
+
+	def _pin(self, key):
+		entry = self._entries[key]
+		self._pinned[key] = self._pinned.get(key, 0) + 1
+		return CachedFile(self, key, self._path(key), entry['size'], dict(entry['uploads']))
+
+	def _evict(self):
+		evicted = 0
+		used = sum(entry['size'] for entry in self._entries.values())
+		for key in sorted(self._entries, key=lambda k: self._entries[k]['used']):
+			if used <= self._quota:
+				break
+			if key in self._pinned:
+				continue
+			used -= self._entries.pop(key)['size']
+			self._files = dict((file_id, k) for file_id, k in self._files.items() if k != key)
+			if os.path.exists(self._path(key)):
+				os.remove(self._path(key))
+			self._evictions += 1
+			evicted += 1
+			_evictions.inc()
+			_logger.log('File cache: Evicted %s' % key)
+		return evicted
+
+	def _load(self):
+		if not os.path.exists(self._directory):
+			os.makedirs(self._directory)
+		try:
+			with open(os.path.join(self._directory, _INDEX), 'r') as f:
+				index = json.load(f)
+			self._entries = dict((k, entry) for k, entry in index.get('entries', {}).items() if os.path.isfile(self._path(k)))
+			self._files = dict((file_id, k) for file_id, k in index.get('files', {}).items() if k in self._entries)
+		except (IOError, OSError, ValueError, AttributeError):
+			self._entries, self._files = {}, {}
+		known = set('%s.gcode' % k for k in self._entries)
+		for name in os.listdir(self._directory):
+			if name != _INDEX and name not in known:
+				os.remove(os.path.join(self._directory, name))
+		self._evict()
+
+	def _save(self):
+		path = os.path.join(self._directory, _INDEX)
+		with open(path + '.tmp', 'w') as f:
+			json.dump({'entries': self._entries, 'files': self._files}, f)
+		os.rename(path + '.tmp', path)
+
+
+class CacheWriter(object):
+	"""Copy of a download written next to the cache while it streams elsewhere, hashed with sha256 on the way."""
+
+	def __init__(self, cache, path):
+		self._cache = cache
+		self._path = path
+		self._file = None
+		self._hasher = hashlib.sha256()
+		self.complete = False
+
+	def tee(self, chunks):
+		self._file = open(self._path, 'wb')
+		try:
+			for chunk in chunks:
+				self._file.write(chunk)
+				self._hasher.update(chunk)
+				yield chunk
+			self.complete = True
+		finally:
+			self._file.close()
+
+	def commit(self, file_id, digest=None, validator=None):
+		if not self.complete:
+			self.discard()
+			return None
+		return self._cache.store(file_id, self._path, digest=digest, validator=validator, sha256=self._hasher.hexdigest())
+
+	def discard(self):
+		if self._file is not None:
+			self._file.close()
+		if os.path.exists(self._path):
+			os.remove(self._path)
+
+
+def _file_sha256(path):
+	hasher = hashlib.sha256()
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(config.DOWNLOAD_CHUNK_MAX), b''):
+			hasher.update(chunk)
+	return hasher.hexdigest()
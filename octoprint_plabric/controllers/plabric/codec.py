@@ -0,0 +1,97 @@
+import threading
+import time
+import zlib
+
+from octoprint_plabric.controllers.common import rawjson as _rawjson
+
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
+
+
+COMPRESSION_DEFLATE = 'deflate'
+BINARY_MSGPACK = 'msgpack'
+
+
+class _Unpackable(Exception):
+	pass
+
+
+def supported_codecs():
+	return dict(compression=[COMPRESSION_DEFLATE], binary=[BINARY_MSGPACK] if msgpack else [])
+
+
+class PayloadCodec(object):
+
+	def __init__(self, threshold, level):
+		self._threshold = threshold
+		self._level = level
+		self._compression = None
+		self._binary = None
+		self._stats = {}
+		self._lock = threading.Lock()
+
+	def negotiate(self, capabilities):
+		local = supported_codecs()
+		compression = [c for c in capabilities.get('compression') or [] if c in local['compression']]
+		binary = [c for c in capabilities.get('binary') or [] if c in local['binary']]
+		self._compression = compression[0] if compression else None
+		self._binary = binary[0] if binary else None
+		return dict(compression=self._compression, binary=self._binary)
+
+	def reset(self):
+		self._compression = None
+		self._binary = None
+
+	def encode(self, key, data=None, json=None):
+		started_at = time.time()
+		payload = json if json else None
+		raw_size = 0
+		codec = None
+
+		if payload is None and data:
+			if self._binary == BINARY_MSGPACK:
+				try:
+					payload = msgpack.packb(data, use_bin_type=True, default=self._msgpack_default)
+					codec = BINARY_MSGPACK
+				except _Unpackable:
+					payload = None
+			if payload is None:
+				payload = _rawjson.dumps(data)
+
+		if payload is not None:
+			raw_size = len(payload)
+			if self._compression == COMPRESSION_DEFLATE and raw_size >= self._threshold:
+				if codec is None:
+					payload = payload.encode('utf-8')
+				payload = zlib.compress(payload, self._level)
+				codec = '%s+%s' % (codec, COMPRESSION_DEFLATE) if codec else COMPRESSION_DEFLATE
+
+		if codec:
+			payload = {'codec': codec, 'data': payload}
+			wire_size = len(payload['data'])
+		else:
+			wire_size = raw_size
+
+		self._count(key, raw_size, wire_size, time.time() - started_at)
+		return payload
+
+	@staticmethod
+	def _msgpack_default(o):
+		raise _Unpackable()
+
+	def _count(self, key, raw_size, wire_size, encode_time):
+		with self._lock:
+			stats = self._stats.get(key)
+			if stats is None:
+				stats = self._stats[key] = dict(messages=0, raw_bytes=0, wire_bytes=0, encode_time=0.0)
+			stats['messages'] += 1
+			stats['raw_bytes'] += raw_size
+			stats['wire_bytes'] += wire_size
+			stats['encode_time'] += encode_time
+
+	def get_stats(self):
+		with self._lock:
+			return dict(compression=self._compression, binary=self._binary,
+						keys=dict((k, dict(v)) for k, v in self._stats.items()))
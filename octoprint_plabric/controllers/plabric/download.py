@@ -0,0 +1,452 @@
+import base64
+import binascii
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import requests
+
+try:
+	from urllib3.exceptions import HTTPError as _ReadError
+except ImportError:
+	from requests.packages.urllib3.exceptions import HTTPError as _ReadError
+
+from octoprint_plabric import config
+from octoprint_plabric.controllers.common import logger as _logger, metrics as _metrics
+from octoprint_plabric.controllers.common.api import count_transfer
+from octoprint_plabric.controllers.common.scheduler import DecorrelatedJitterBackoff
+
+_resumes = _metrics.REGISTRY.counter('plabric_download_resumes_total', 'Downloads resumed after a dropped connection', ('mode', ))
+_redownloaded = _metrics.REGISTRY.counter('plabric_download_redownloaded_bytes_total', 'Bytes downloaded again after an interruption')
+_failures = _metrics.REGISTRY.counter('plabric_download_failures_total', 'Downloads given up', ('reason', ))
+_segments = _metrics.REGISTRY.counter('plabric_download_segments_total', 'Byte ranges fetched concurrently by segmented downloads')
+
+_CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+_CONTENT_RANGE_TOTAL = re.compile(r'bytes \*/(\d+)')
+_UNSAFE = re.compile(r'[^A-Za-z0-9_.-]')
+_DIGEST_ALGORITHMS = (('sha-256', 'sha256'), ('md5', 'md5'))
+
+CANCELLED_STATUS = 499
+
+
+class DownloadError(IOError):
+
+	def __init__(self, message, status=503):
+		super(DownloadError, self).__init__(message)
+		self.status = status
+
+
+class VerificationError(DownloadError):
+
+	def __init__(self, message):
+		super(VerificationError, self).__init__(message, status=502)
+
+
+class TransferCancelled(DownloadError):
+
+	def __init__(self):
+		super(TransferCancelled, self).__init__('Transfer cancelled', status=CANCELLED_STATUS)
+
+
+def expected_digest(headers=None, data=None):
+	"""(hashlib name, hex digest) announced by Plabric for a file, from the file url response or a Digest header."""
+	if isinstance(data, dict):
+		for name in ('sha256', 'md5'):
+			if data.get(name):
+				return name, str(data[name]).lower()
+	for part in (headers or {}).get('digest', '').split(','):
+		algorithm, _, value = part.strip().partition('=')
+		for label, name in _DIGEST_ALGORITHMS:
+			if algorithm.lower() == label and value:
+				try:
+					return name, binascii.hexlify(base64.b64decode(value)).decode('ascii')
+				except (TypeError, ValueError):
+					pass
+	return None
+
+
+class DownloadStream(object):
+	"""Chunks of one file download from ``offset`` on, reopened with Range requests when the connection drops.
+
+	Bytes the server sends again (a 200 answer to a Range request) are skipped. The length and, when known, the digest
+	are checked once the last byte arrived; any failure raises DownloadError from the iteration. With ``end`` set the
+	stream only covers the bytes up to it and the server must answer with 206. Setting the ``cancelled`` event stops the
+	waits between reconnects and every later request with TransferCancelled.
+	"""
+
+	def __init__(self, session, url, timeout, offset=0, validator=None, digest=None, hasher=None, end=None, cancelled=None):
+		self._session = session
+		self._cancelled = cancelled
+		self._url = url
+		self._timeout = timeout
+		self._validator = validator
+		self._hasher = hasher or (hashlib.new(digest[0]) if digest else None)
+		self.digest = digest
+		self._response = None
+		self._skip = 0
+		self._chunk_size = config.TRANSFER_CHUNK_SIZE
+		self.offset = offset
+		self.position = offset
+		self.end = end
+		self.size = None
+		self.validator = None
+		self.ranges = False
+		self.resumes = 0
+		self.redownloaded = 0
+
+	def open(self):
+		"""Sends the first request; ``offset`` drops to 0 when the server restarts the file instead of resuming it."""
+		response = self._request(self.offset, self._validator)
+		if response.status_code == 416 and self.offset:
+			match = _CONTENT_RANGE_TOTAL.match(response.headers.get('content-range', ''))
+			response.close()
+			if match and int(match.group(1)) == self.offset:
+				self.size = self.offset
+				self.validator = self._validator
+				return self
+			raise DownloadError('Unable to resume at %d bytes' % self.offset, status=416)
+		if self.end is not None and response.status_code != 206:
+			response.close()
+			raise DownloadError('Range request answered with status %d' % response.status_code, status=416)
+		if response.status_code == 200 and self.offset:
+			_logger.log('Plabric API: Download restarted from the beginning')
+			self.offset = self.position = 0
+			if self.digest:
+				self._hasher = hashlib.new(self.digest[0])
+		elif response.status_code not in (200, 206):
+			response.close()
+			raise DownloadError('Download failed with status %d' % response.status_code, status=response.status_code)
+		self._accept(response, self.position)
+		self.validator = response.headers.get('etag') or response.headers.get('last-modified')
+		self.ranges = response.status_code == 206 or response.headers.get('accept-ranges', '').lower() == 'bytes'
+		if self.digest is None and self.position == 0:
+			self.digest = expected_digest(headers=response.headers)
+			self._hasher = hashlib.new(self.digest[0]) if self.digest else None
+		return self
+
+	def segment(self, start, end):
+		"""Unopened stream over bytes ``start`` to ``end`` of the same file, pinned to this download's validator."""
+		return DownloadStream(self._session, self._url, self._timeout, offset=start, validator=self.validator, end=end, cancelled=self._cancelled)
+
+	def limit(self, end):
+		"""Stops this stream at ``end``; the digest can then only be checked over the whole file by the caller."""
+		self.end = end
+		self._hasher = None
+
+	def close(self):
+		if self._response is not None:
+			self._response.close()
+			self._response = None
+
+	def _request(self, offset, validator):
+		if self._cancelled is not None and self._cancelled.is_set():
+			raise TransferCancelled()
+		headers = {'Accept-Encoding': 'identity'}
+		if offset or self.end is not None:
+			headers['Range'] = 'bytes=%d-%s' % (offset, self.end - 1 if self.end is not None else '')
+			if validator:
+				headers['If-Range'] = validator
+		try:
+			return self._session.get(self._url, stream=True, timeout=self._timeout, headers=headers)
+		except requests.exceptions.RequestException as e:
+			raise DownloadError(str(e))
+
+	def _accept(self, response, position):
+		start, total = 0, None
+		if response.status_code == 206:
+			match = _CONTENT_RANGE.match(response.headers.get('content-range', ''))
+			if not match or int(match.group(1)) > position:
+				response.close()
+				raise DownloadError('Unexpected Content-Range %s' % response.headers.get('content-range'))
+			start = int(match.group(1))
+			total = int(match.group(3)) if match.group(3) != '*' else None
+		else:
+			validator = response.headers.get('etag') or response.headers.get('last-modified')
+			if position and self.validator and validator != self.validator:
+				response.close()
+				raise VerificationError('File changed on the server while downloading')
+			if response.headers.get('content-length') and response.headers.get('content-encoding', 'identity') == 'identity':
+				total = int(response.headers['content-length'])
+		self._skip = position - start
+		if total is not None:
+			self.size = total
+		self._response = response
+
+	def _chunks(self, response):
+		"""Reads sized to take about DOWNLOAD_CHUNK_TIME each: doubled while they come in fast, halved when they stall."""
+		while True:
+			started_at = time.time()
+			chunk = response.raw.read(self._chunk_size, decode_content=True)
+			if not chunk:
+				return
+			elapsed = time.time() - started_at
+			if len(chunk) == self._chunk_size and elapsed < config.DOWNLOAD_CHUNK_TIME / 2:
+				self._chunk_size = min(self._chunk_size * 2, config.DOWNLOAD_CHUNK_MAX)
+			elif elapsed > config.DOWNLOAD_CHUNK_TIME * 2:
+				self._chunk_size = max(self._chunk_size // 2, config.TRANSFER_CHUNK_SIZE)
+			yield chunk
+
+	def __iter__(self):
+		started_at = time.time()
+		received = self.position
+		backoff = None
+		try:
+			while self._response is not None:
+				progressed = False
+				end = self.end if self.end is not None else self.size
+				try:
+					for chunk in self._chunks(self._response):
+						if self._skip:
+							skipped = min(self._skip, len(chunk))
+							self._skip -= skipped
+							self.redownloaded += skipped
+							_redownloaded.inc((), skipped)
+							chunk = chunk[skipped:]
+							if not chunk:
+								continue
+						if end is not None and self.position + len(chunk) > end:
+							chunk = chunk[:end - self.position]
+						progressed = True
+						self.position += len(chunk)
+						if self._hasher:
+							self._hasher.update(chunk)
+						yield chunk
+						if end is not None and self.position >= end:
+							break
+					if end is None or self.position >= end:
+						self.close()
+						break
+					error = 'connection closed after %d of %d bytes' % (self.position, end)
+				except (requests.exceptions.RequestException, _ReadError, IOError) as e:
+					error = e
+				self.close()
+				if backoff is None or progressed:
+					backoff = DecorrelatedJitterBackoff(base=config.DOWNLOAD_RETRY_BASE, cap=config.DOWNLOAD_RETRY_CAP)
+				self._resume(backoff, error)
+			self._verify()
+		finally:
+			self.close()
+			count_transfer('download', self.position - received, time.time() - started_at)
+
+	def _resume(self, backoff, error):
+		while True:
+			if backoff.get_stats()['attempts'] >= config.DOWNLOAD_RETRIES:
+				_failures.inc(('retries', ))
+				raise DownloadError('Download interrupted: %s' % error)
+			delay = backoff.failure()
+			_logger.log('Plabric API: Download interrupted at %d bytes (%s), resuming in %.1fs' % (self.position, error, delay))
+			if self._cancelled is None:
+				time.sleep(delay)
+			elif self._cancelled.wait(delay):
+				raise TransferCancelled()
+			try:
+				response = self._request(self.position, self.validator)
+				if response.status_code not in (200, 206) or (self.end is not None and response.status_code != 206):
+					response.close()
+					raise DownloadError('Resume failed with status %d' % response.status_code)
+				self._accept(response, self.position)
+			except VerificationError:
+				raise
+			except DownloadError as e:
+				error = e
+				continue
+			self.resumes += 1
+			_resumes.inc(('range' if response.status_code == 206 else 'restart', ))
+			return
+
+	def _verify(self):
+		end = self.end if self.end is not None else self.size
+		if end is not None and self.position != end:
+			_failures.inc(('length', ))
+			raise VerificationError('Downloaded %d bytes, expected %d' % (self.position, end))
+		if self.digest and self._hasher and self._hasher.hexdigest() != self.digest[1]:
+			_failures.inc(('checksum', ))
+			raise VerificationError('Downloaded file does not match its %s checksum' % self.digest[0])
+
+
+def split(download, segments):
+	"""SegmentedDownload continuing ``download`` as up to ``segments`` concurrent ranges, or None to keep the single stream.
+
+	The single stream is kept for resumed or small files, when the size is unknown and when the server does not answer
+	the extra Range requests with 206.
+	"""
+	if download.offset or not download.ranges or not download.size:
+		return None
+	count = min(segments, download.size // config.DOWNLOAD_SEGMENT_MIN_SIZE)
+	if count < 2:
+		return None
+	bounds = [download.size * i // count for i in range(count + 1)]
+	streams = []
+	try:
+		for i in range(1, count):
+			streams.append(download.segment(bounds[i], bounds[i + 1]))
+			streams[-1].open()
+	except DownloadError as e:
+		_logger.log('Plabric API: Segmented download unavailable (%s), using a single stream' % e)
+		for stream in streams:
+			stream.close()
+		return None
+	download.limit(bounds[1])
+	return SegmentedDownload(download, [download] + streams)
+
+
+class SegmentedDownload(object):
+	"""Byte ranges of one file fetched concurrently, each written in place into a preallocated file."""
+
+	def __init__(self, download, streams):
+		self._streams = streams
+		self._error = None
+		self.size = download.size
+		self.digest = download.digest
+		self.validator = download.validator
+
+	def write(self, path, progress=None):
+		"""Fetches every range into ``path``, raising the first DownloadError once all of them stopped.
+
+		``progress`` is called with the length of every chunk written, from the download threads.
+		"""
+		fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+		try:
+			_preallocate(fd, self.size)
+		finally:
+			os.close(fd)
+		_segments.inc((), len(self._streams))
+		threads = []
+		for i, stream in enumerate(self._streams):
+			thread = threading.Thread(target=self._fetch, args=(stream, path, progress), name='Plabric download %d' % i)
+			thread.daemon = True
+			thread.start()
+			threads.append(thread)
+		for thread in threads:
+			thread.join()
+		if self._error is not None:
+			raise self._error
+		if self.digest:
+			self._verify(path)
+
+	def close(self):
+		for stream in self._streams:
+			stream.close()
+
+	def _fetch(self, stream, path, progress):
+		fd = os.open(path, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+		chunks = iter(stream)
+		try:
+			offset = stream.position
+			for chunk in chunks:
+				if self._error is not None:
+					break
+				_pwrite(fd, chunk, offset)
+				offset += len(chunk)
+				if progress:
+					progress(len(chunk))
+		except Exception as e:
+			if self._error is None:
+				self._error = e if isinstance(e, DownloadError) else DownloadError(str(e))
+		finally:
+			chunks.close()
+			os.close(fd)
+
+	def _verify(self, path):
+		hasher = hashlib.new(self.digest[0])
+		with open(path, 'rb') as f:
+			for chunk in iter(lambda: f.read(config.DOWNLOAD_CHUNK_MAX), b''):
+				hasher.update(chunk)
+		if hasher.hexdigest() != self.digest[1]:
+			_failures.inc(('checksum', ))
+			raise VerificationError('Downloaded file does not match its %s checksum' % self.digest[0])
+
+
+def _preallocate(fd, size):
+	try:
+		os.posix_fallocate(fd, 0, size)
+	except (AttributeError, OSError):
+		os.ftruncate(fd, size)
+
+
+def _pwrite(fd, data, offset):
+	while data:
+		if hasattr(os, 'pwrite'):
+			written = os.pwrite(fd, data, offset)
+		else:
+			os.lseek(fd, offset, os.SEEK_SET)
+			written = os.write(fd, data)
+		data = data[written:]
+		offset += written
+
+
+def staging_name(file_id, transfer_id=None):
+	name = _UNSAFE.sub('_', str(file_id))
+	return '%s.%s.gcode' % (name, transfer_id) if transfer_id else '%s.gcode' % name
+
+
+def get_stats():
+	return dict(resumes=_resumes.total(), redownloaded_bytes=_redownloaded.total(), failures=_failures.total(), segments=_segments.total())
+
+
+class PartialFile(object):
+	"""Staging file for a download plus a JSON sidecar describing it, so a later attempt can resume it."""
+
+	def __init__(self, path):
+		self.path = path
+		self._meta_path = path + '.json'
+
+	def resume_point(self, file_id):
+		"""(offset, validator, digest, hasher over the bytes on disk) for ``file_id``; offset 0 when nothing is resumable."""
+		meta = self._load()
+		if not meta or meta.get('file_id') != file_id or not (meta.get('validator') or meta.get('digest')) or not os.path.isfile(self.path):
+			self.clear()
+			return 0, None, None, None
+		digest = tuple(meta['digest']) if meta.get('digest') else None
+		hasher = hashlib.new(digest[0]) if digest else None
+		offset = 0
+		with open(self.path, 'rb') as f:
+			for chunk in iter(lambda: f.read(config.TRANSFER_CHUNK_SIZE), b''):
+				offset += len(chunk)
+				if hasher:
+					hasher.update(chunk)
+		return offset, meta.get('validator'), digest, hasher
+
+	def write(self, file_id, download, progress=None):
+		self._save({'file_id': file_id, 'validator': download.validator, 'digest': list(download.digest) if download.digest else None,
+					'size': download.size})
+		try:
+			with open(self.path, 'r+b' if download.offset and os.path.isfile(self.path) else 'wb') as f:
+				f.seek(download.offset)
+				f.truncate()
+				for chunk in download:
+					f.write(chunk)
+					if progress:
+						progress(len(chunk))
+		except VerificationError:
+			self.clear()
+			raise
+
+	def move_to(self, path):
+		"""Renames the staging file and its sidecar to ``path``; a concurrent move of the same files leaves only one owner."""
+		moved = PartialFile(path)
+		for source, target in ((self.path, moved.path), (self._meta_path, moved._meta_path)):
+			try:
+				os.rename(source, target)
+			except OSError:
+				pass
+		return moved
+
+	def clear(self):
+		for path in (self.path, self._meta_path):
+			if os.path.exists(path):
+				os.remove(path)
+
+	def _load(self):
+		try:
+			with open(self._meta_path, 'r') as f:
+				return json.load(f)
+		except (IOError, OSError, ValueError):
+			return None
+
+	def _save(self, meta):
+		with open(self._meta_path, 'w') as f:
+			json.dump(meta, f)
@@ -40,7 +40,7 @@ class JanusProtocol:
 
 class Janus:
 
-	def __init__(self, machine, system, ports, callback=None):
+	def __init__(self, machine, system, ports, loop, callback=None):
 		_logger.log('Janus Socket: Initializing')
 
 		# websocket.enableTrace(True)
@@ -48,7 +48,7 @@ class Janus:
 		self._janus_api_port = ports[1]
 		self._janus_video_port = ports[2]
 		self._url = 'ws://%s:%d/' % (config.JANUS_HOST, self._janus_ws_port)
-		self._janus_thread = None
+		self._loop = loop
 		self._janus_proc = None
 		self._ws = None
 		self._transaction = None
@@ -75,25 +75,32 @@ class Janus:
 
 	def _run_janus(self):
 		if config.JANUS_RUN_LOCAL and self._enabled:
-
-			def ll():
-				_logger.log('Janus: Starting')
-				janus_cmd = os.path.join(self._janus_dir, 'run_janus.sh')
+			_logger.log('Janus: Starting')
+			janus_cmd = os.path.join(self._janus_dir, 'run_janus.sh')
+			try:
 				self._janus_proc = subprocess.Popen(janus_cmd.split(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-
-				# if config.DEBUG:
-				# 	while self._janus_proc:
-				# 		line = self._janus_proc.stdout.readline()
-				# 		if line:
-				# 			_logger.log('JANUS: ' + line)
-
-			self._janus_thread = threading.Thread(target=ll)
-			self._janus_thread.daemon = True
-			self._janus_thread.start()
+				self._drain_output(self._janus_proc)
+			except Exception as e:
+				_logger.warn(e)
 
 		self._started_at = time.time()
 		self._callback.janus_running()
 
+	def _drain_output(self, proc):
+		fd = proc.stdout.fileno()
+
+		def on_output():
+			output = os.read(fd, 4096)
+			if not output:
+				self._loop.remove_reader(fd)
+			elif config.DEBUG:
+				_logger.log('JANUS: %s' % output.decode('utf-8', 'replace'))
+
+		self._loop.add_reader(fd, on_output)
+
+	def get_pid(self):
+		return self._janus_proc.pid if self._janus_proc else None
+
 	def get_video_port(self):
 		return self._janus_video_port
 
@@ -170,7 +177,7 @@ class Janus:
 				self._create_session()
 
 			try:
-				if self._janus_thread is None:
+				if self._janus_proc is None:
 					self._run_janus()
 
 				if self._started_at is not None and time.time() - self._started_at < 4:
@@ -214,7 +221,7 @@ class Janus:
 			except Exception as e:
 				_logger.warn(e)
 
-		self._janus_thread = None
+		self._janus_proc = None
 
 	def _create_session(self):
 		_logger.log('Janus: Creating transaction')
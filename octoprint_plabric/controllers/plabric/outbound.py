@@ -0,0 +1,169 @@
+import threading
+import time
+from collections import deque
+
+from octoprint_plabric.controllers.common import logger as _logger, tracing as _tracing
+
+PRIORITY_SIGNALING = 0
+PRIORITY_COMMAND = 1
+PRIORITY_STATUS = 2
+PRIORITY_TELEMETRY = 3
+PRIORITY_NAMES = ['signaling', 'command', 'status', 'telemetry']
+
+MESSAGE_PRIORITIES = {
+	'signaling': PRIORITY_SIGNALING,
+	'webrtc_ready': PRIORITY_SIGNALING,
+	'socket_event': PRIORITY_TELEMETRY,
+	'transfer_progress': PRIORITY_STATUS,
+}
+
+_BASE_SIZE = 256
+
+
+class OutboundMessage(object):
+	__slots__ = ('key', 'data', 'json', 'priority', 'coalesce_key', 'on_dropped', 'on_sent', 'trace', 'size', 'enqueued_at')
+
+	def __init__(self, key, data, json, priority, coalesce_key=None, on_dropped=None, on_sent=None, trace=_tracing.NULL_TRACE):
+		self.key = key
+		self.data = data
+		self.json = json
+		self.priority = priority
+		self.coalesce_key = coalesce_key
+		self.on_dropped = on_dropped
+		self.on_sent = on_sent
+		self.trace = trace
+		self.size = _estimate_size(data, json)
+		self.enqueued_at = time.time()
+
+
+def _estimate_size(data, json):
+	if json:
+		return len(json)
+	size = _BASE_SIZE
+	if isinstance(data, dict):
+		for value in data.values():
+			try:
+				size += len(value)
+			except TypeError:
+				pass
+	return size
+
+
+class OutboundQueue(object):
+
+	def __init__(self, max_bytes, max_messages):
+		self._max_bytes = max_bytes
+		self._max_messages = max_messages
+		self._queues = [deque() for _ in PRIORITY_NAMES]
+		self._coalescing = {}
+		self._bytes = 0
+		self._condition = threading.Condition()
+		self._closed = False
+		self._stats = [dict(enqueued=0, sent=0, dropped=0, coalesced=0, latency_total=0.0, latency_max=0.0) for _ in PRIORITY_NAMES]
+
+	def put(self, message):
+		dropped = []
+		with self._condition:
+			if self._closed:
+				return False
+			stats = self._stats[message.priority]
+			stats['enqueued'] += 1
+
+			pending = self._coalescing.get(message.coalesce_key) if message.coalesce_key else None
+			if pending is not None:
+				dropped.append(pending.on_dropped)
+				self._bytes += message.size - pending.size
+				pending.data, pending.json, pending.size = message.data, message.json, message.size
+				pending.on_dropped, pending.on_sent, pending.trace = message.on_dropped, message.on_sent, message.trace
+				stats['coalesced'] += 1
+			else:
+				self._queues[message.priority].append(message)
+				self._bytes += message.size
+				if message.coalesce_key:
+					self._coalescing[message.coalesce_key] = message
+
+			while self._bytes > self._max_bytes or len(self._queues[message.priority]) > self._max_messages[message.priority]:
+				victim = self._drop_oldest(message)
+				if victim is None:
+					break
+				dropped.append(victim.on_dropped)
+			self._condition.notify()
+
+		for on_dropped in dropped:
+			if on_dropped:
+				try:
+					on_dropped()
+				except Exception as e:
+					_logger.warn(e)
+		return True
+
+	def _drop_oldest(self, message):
+		# The message being queued is never evicted, and signaling or command messages only when on_dropped answers them
+		if len(self._queues[message.priority]) > self._max_messages[message.priority]:
+			candidates = [message.priority]
+		else:
+			candidates = reversed(range(len(self._queues)))
+		for p in candidates:
+			victim = next((m for m in self._queues[p] if m is not message and (p >= PRIORITY_STATUS or m.on_dropped)), None)
+			if victim is not None:
+				self._queues[p].remove(victim)
+				self._forget(victim)
+				self._stats[p]['dropped'] += 1
+				return victim
+		return None
+
+	def _forget(self, message):
+		self._bytes -= message.size
+		if message.coalesce_key and self._coalescing.get(message.coalesce_key) is message:
+			del self._coalescing[message.coalesce_key]
+
+	def get(self):
+		with self._condition:
+			while not self._closed:
+				for q in self._queues:
+					if q:
+						message = q.popleft()
+						self._forget(message)
+						return message
+				self._condition.wait()
+			return None
+
+	def sent(self, message):
+		latency = time.time() - message.enqueued_at
+		with self._condition:
+			stats = self._stats[message.priority]
+			stats['sent'] += 1
+			stats['latency_total'] += latency
+			stats['latency_max'] = max(stats['latency_max'], latency)
+		if message.on_sent:
+			try:
+				message.on_sent()
+			except Exception as e:
+				_logger.warn(e)
+
+	def open(self):
+		with self._condition:
+			self._closed = False
+
+	def close(self):
+		with self._condition:
+			self._closed = True
+			for q in self._queues:
+				q.clear()
+			self._coalescing.clear()
+			self._bytes = 0
+			self._condition.notify_all()
+
+	def get_stats(self):
+		with self._condition:
+			classes = {}
+			for p, name in enumerate(PRIORITY_NAMES):
+				stats = dict(self._stats[p])
+				stats['depth'] = len(self._queues[p])
+				stats['latency_avg'] = stats['latency_total'] / stats['sent'] if stats['sent'] else 0.0
+				classes[name] = stats
+			return dict(bytes=self._bytes, depth=sum(len(q) for q in self._queues), classes=classes)
+
+	def depth(self):
+		with self._condition:
+			return sum(len(q) for q in self._queues)
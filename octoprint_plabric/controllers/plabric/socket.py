@@ -1,9 +1,27 @@
+import itertools
+import threading
+import time
+
 import socketio
 
 from octoprint_plabric import config
-from octoprint_plabric.controllers.common import logger as _logger
+from octoprint_plabric.controllers.common import logger as _logger, metrics as _metrics, tracing as _tracing
+from octoprint_plabric.controllers.plabric.codec import PayloadCodec
+from octoprint_plabric.controllers.plabric.outbound import OutboundMessage, OutboundQueue, MESSAGE_PRIORITIES, PRIORITY_COMMAND
 import json as _json
 
+_messages = _metrics.REGISTRY.counter('plabric_socket_messages_total', 'Messages exchanged on the Plabric socket', ('direction', 'key'))
+_bytes = _metrics.REGISTRY.counter('plabric_socket_bytes_total', 'Payload bytes exchanged on the Plabric socket', ('direction', 'key'))
+
+
+def _payload_size(payload):
+	if isinstance(payload, dict) and 'codec' in payload:
+		payload = payload['data']
+	try:
+		return len(payload)
+	except TypeError:
+		return 0
+
 
 class PlabricSocketProtocol:
 	def on_connected(self):
@@ -15,7 +33,10 @@ class PlabricSocketProtocol:
 	def on_user_leave(self):
 		raise NotImplementedError
 
-	def on_user_joined(self, user_nick, octoprint_api_key):
+	def on_user_joined(self, user_nick, octoprint_api_key, stream_config=None):
+		raise NotImplementedError
+
+	def on_stream_config(self, data):
 		raise NotImplementedError
 
 	def on_config_done(self):
@@ -24,7 +45,13 @@ class PlabricSocketProtocol:
 	def on_connection_registered(self, plabric_api_key):
 		raise NotImplementedError
 
-	def on_api_command(self, data):
+	def on_api_command(self, data, received_at=None, trace=_tracing.NULL_TRACE):
+		raise NotImplementedError
+
+	def on_api_command_batch(self, data):
+		raise NotImplementedError
+
+	def on_transfer_cancel(self, data):
 		raise NotImplementedError
 
 	def on_video_command(self, data):
@@ -36,6 +63,9 @@ class PlabricSocketProtocol:
 	def on_connection_error(self):
 		raise NotImplementedError
 
+	def on_probe(self, rtt, clock_offset):
+		raise NotImplementedError
+
 	def clear_api_key(self):
 		raise NotImplementedError
 
@@ -53,6 +83,12 @@ class PlabricSocket:
 		self._callback = callback
 		self._t = None
 		self._connecting = False
+		self._codec = PayloadCodec(threshold=config.SOCKET_COMPRESSION_THRESHOLD, level=config.SOCKET_COMPRESSION_LEVEL)
+		self._outbound = OutboundQueue(max_bytes=config.OUTBOUND_MAX_BYTES, max_messages=config.OUTBOUND_MAX_MESSAGES)
+		self._emit_lock = threading.Lock()
+		self._sender = None
+		self._probe_ids = itertools.count()
+		self._probes = {}
 
 	def connect(self):
 		try:
@@ -71,51 +107,135 @@ class PlabricSocket:
 
 	def disconnect(self):
 		_logger.log('Plabric Socket: Disconnecting')
+		self._outbound.close()
 		if self._sio and self._sio.connected:
 			self._sio.disconnect()
 
-	def send_msg(self, key, data=None, json=None):
+	def send_msg(self, key, data=None, json=None, coalesce_key=None, on_dropped=None, on_sent=None, priority=None, trace=_tracing.NULL_TRACE):
 		if self._sio.connected:
-			data_json = _json.dumps(data) if data else None
-			data_json = json if json else data_json
-			self._sio.emit(key, data_json, namespace=config.PLABRIC_SOCKET_NAMESPACE) if data_json else self._sio.emit(key, namespace=config.PLABRIC_SOCKET_NAMESPACE)
+			if priority is None:
+				priority = MESSAGE_PRIORITIES.get(key, PRIORITY_COMMAND)
+			self._outbound.put(OutboundMessage(key, data, json, priority, coalesce_key=coalesce_key, on_dropped=on_dropped, on_sent=on_sent, trace=trace))
+
+	def get_outbound_depth(self):
+		return self._outbound.depth()
+
+	def probe(self):
+		if self._sio.connected:
+			probe_id = next(self._probe_ids)
+			self._probes = dict((k, v) for k, v in self._probes.items() if k > probe_id - config.PROBE_PENDING_MAX)
+			try:
+				with self._emit_lock:
+					self._probes[probe_id] = time.time()
+					self._sio.emit('ping_probe', _json.dumps({'id': probe_id}), namespace=config.PLABRIC_SOCKET_NAMESPACE)
+			except Exception as e:
+				_logger.warn('Plabric Socket: Probe error - %s' % e)
+
+	def _on_pong(self, data):
+		received_at = time.time()
+		sent_at = self._probes.pop(data.get('id'), None)
+		if sent_at is None:
+			return
+		rtt = received_at - sent_at
+		server_time = data.get('server_time')
+		clock_offset = server_time - (sent_at + rtt / 2) if isinstance(server_time, (int, float)) else None
+		if self._callback:
+			self._callback.on_probe(rtt, clock_offset)
+
+	def get_stats(self):
+		return dict(codec=self._codec.get_stats(), outbound=self._outbound.get_stats())
+
+	def _start_sender(self):
+		self._outbound.open()
+		if self._sender is None or not self._sender.is_alive():
+			self._sender = threading.Thread(target=self._send_loop)
+			self._sender.daemon = True
+			self._sender.start()
+
+	def _send_loop(self):
+		while True:
+			message = self._outbound.get()
+			if message is None:
+				return
+			message.trace.add('outbound', message.enqueued_at, time.time())
+			try:
+				with self._emit_lock:
+					with message.trace.span('serialize'):
+						payload = self._codec.encode(message.key, data=message.data, json=message.json)
+					with message.trace.span('emit'):
+						self._sio.emit(message.key, payload, namespace=config.PLABRIC_SOCKET_NAMESPACE) if payload else self._sio.emit(message.key, namespace=config.PLABRIC_SOCKET_NAMESPACE)
+				_messages.inc(('sent', message.key))
+				_bytes.inc(('sent', message.key), _payload_size(payload))
+				self._outbound.sent(message)
+				message.trace.finish()
+			except Exception as e:
+				_logger.warn('Plabric Socket: Send error - %s' % e)
+
+	def _on(self, event):
+		def decorator(handler):
+			def counted(*args):
+				_messages.inc(('received', event))
+				if args:
+					_bytes.inc(('received', event), _payload_size(args[0]))
+				return handler(*args)
+
+			self._sio.on(event, counted, namespace=config.PLABRIC_SOCKET_NAMESPACE)
+			return handler
+		return decorator
 
 	def _add_event_handlers(self):
-		@self._sio.on('connect', namespace=config.PLABRIC_SOCKET_NAMESPACE)
+		@self._on('connect')
 		def connect():
 			_logger.log('Plabric Socket: Connected')
 			self._connecting = False
+			self._codec.reset()
+			self._start_sender()
 			if self._callback:
 				self._callback.on_connected()
 
-		@self._sio.on('disconnect', namespace=config.PLABRIC_SOCKET_NAMESPACE)
+		@self._on('disconnect')
 		def disconnect():
 			_logger.log('Plabric Socket: Disconnected')
+			self._outbound.close()
 			if self._callback:
 				self._callback.on_disconnected()
 
-		@self._sio.on('user_joined', namespace=config.PLABRIC_SOCKET_NAMESPACE)
+		@self._on('codecs')
+		def codecs(data):
+			data = _json.loads(data) if isinstance(data, str) else data
+			with self._emit_lock:
+				selected = self._codec.negotiate(data or {})
+				_logger.log('Plabric Socket: Codecs selected %s' % selected)
+				self._sio.emit('codecs_selected', _json.dumps(selected), namespace=config.PLABRIC_SOCKET_NAMESPACE)
+
+		@self._on('user_joined')
 		def user_joined(data):
 			_logger.log('Plabric Socket: User joined')
 			if self._callback:
 				data = _json.loads(data) if isinstance(data, str) else data
 				user_nick = data['user_nick']
 				octoprint_api_key = data['octoprint_api_key']
-				self._callback.on_user_joined(user_nick, octoprint_api_key)
+				self._callback.on_user_joined(user_nick, octoprint_api_key, stream_config=data.get('stream_config'))
+
+		@self._on('stream_config')
+		def stream_config(data):
+			_logger.log('Plabric Socket: Stream config received')
+			if self._callback:
+				self._callback.on_stream_config(_json.loads(data) if isinstance(data, str) else data)
 
-		@self._sio.on('user_leave', namespace=config.PLABRIC_SOCKET_NAMESPACE)
+		@self._on('user_leave')
 		def user_leave(data):
 			_logger.log('Plabric Socket: User leave')
 			if self._callback:
 				self._callback.on_user_leave()
 
-		@self._sio.on('config_done', namespace=config.PLABRIC_SOCKET_NAMESPACE)
+		@self._on('config_done')
 		def config_done():
 			_logger.log('Plabric Socket: Config done')
 			if self._callback:
 				self._callback.on_config_done()
 
-		@self._sio.on('connection_registered', namespace=config.PLABRIC_SOCKET_NAMESPACE)
+		@self._on('connection_registered')
 		def connection_registered(data):
 			_logger.log('Plabric Socket: Connection registered')
 			if self._callback:
@@ -123,39 +243,59 @@ class PlabricSocket:
 				api_key = data['api_key']
 				self._callback.on_connection_registered(api_key)
 
-		@self._sio.on('api_command', namespace=config.PLABRIC_SOCKET_NAMESPACE)
+		@self._on('api_command')
 		def api_command(data):
+			received_at = time.time()
+			trace = _tracing.TRACER.start('api_command', started_at=received_at)
 			_logger.log('Plabric Socket: Api command received')
 			if self._callback:
 				_logger.log(data)
-				self._callback.on_api_command(_json.loads(data))
+				with trace.span('decode'):
+					data = _json.loads(data)
+				self._callback.on_api_command(data, received_at=received_at, trace=trace)
+
+		@self._on('pong_probe')
+		def pong_probe(data):
+			self._on_pong(_json.loads(data) if isinstance(data, str) else data or {})
+
+		@self._on('api_command_batch')
+		def api_command_batch(data):
+			_logger.log('Plabric Socket: Api command batch received')
+			if self._callback:
+				self._callback.on_api_command_batch(_json.loads(data) if isinstance(data, str) else data)
+
+		@self._on('transfer_cancel')
+		def transfer_cancel(data):
+			_logger.log('Plabric Socket: Transfer cancel received')
+			if self._callback:
+				self._callback.on_transfer_cancel(_json.loads(data) if isinstance(data, str) else data or {})
 
-		@self._sio.on('video_command', namespace=config.PLABRIC_SOCKET_NAMESPACE)
+		@self._on('video_command')
 		def video_command(data):
 			_logger.log('Plabric Socket: Video command received')
 			if self._callback:
 				self._callback.on_video_command(_json.loads(data))
 
-		@self._sio.on('signaling', namespace=config.PLABRIC_SOCKET_NAMESPACE)
+		@self._on('signaling')
 		def signaling(data):
 			_logger.log('Plabric Socket: Signaling received')
 			if self._callback:
 				self._callback.on_signaling(_json.loads(data))
 
-		@self._sio.on('clear_api_key', namespace=config.PLABRIC_SOCKET_NAMESPACE)
+		@self._on('clear_api_key')
 		def clear_api_key():
 			_logger.log('Plabric Socket: Clear api key')
 			if self._callback:
 				self._callback.clear_api_key()
 
-		@self._sio.on('connect_failed', namespace=config.PLABRIC_SOCKET_NAMESPACE)
+		@self._on('connect_failed')
 		def connect_failed():
 			_logger.log('Plabric Socket: Connect failed')
 
-		@self._sio.on('connect_error', namespace=config.PLABRIC_SOCKET_NAMESPACE)
+		@self._on('connect_error')
 		def connect_error():
 			_logger.log('Plabric Socket: Connect error')
 
-		@self._sio.on('reconnect', namespace=config.PLABRIC_SOCKET_NAMESPACE)
+		@self._on('reconnect')
 		def reconnect():
 			_logger.log('Plabric Socket: Reconnect')
@@ -0,0 +1,168 @@
+import threading
+import time
+import uuid
+
+from octoprint_plabric.controllers.common import logger as _logger, metrics as _metrics
+from octoprint_plabric.controllers.common.executor import Executor
+from octoprint_plabric.controllers.plabric.download import CANCELLED_STATUS, TransferCancelled
+
+_transfers = _metrics.REGISTRY.counter('plabric_transfers_total', 'File transfers finished', ('state', ))
+_progress_events = _metrics.REGISTRY.counter('plabric_transfer_progress_events_total', 'Transfer progress events sent')
+
+class Transfer(object):
+	"""One file transfer requested by an api_command, answered exactly once through ``succeed`` or ``fail``.
+
+	``advance`` is called for every chunk moved; it only takes the time and a lock, a progress event is built at most
+	once per ``interval`` and on every state change.
+	"""
+
+	def __init__(self, data, send, on_succeed, on_error, interval):
+		params = data.get('params') or {}
+		self.id = uuid.uuid4().hex[:12]
+		self.data = data
+		self.file_id = params.get('file_id')
+		self.file_name = params.get('file_name')
+		self.state = 'queued'
+		self.size = None
+		self.bytes = 0
+		self.cancelled = False
+		self.cancel_event = threading.Event()
+		self.finished = False
+		self._send = send
+		self._on_succeed = on_succeed
+		self._on_error = on_error
+		self._interval = interval
+		self._lock = threading.Lock()
+		self._started_at = time.time()
+		self._started_bytes = 0
+		self._next_report = 0
+
+	def start(self, state, size=None, done=0):
+		with self._lock:
+			if self.finished:
+				return
+			self.state = state
+			self.size = size
+			self.bytes = self._started_bytes = done
+			self._started_at = time.time()
+			self._next_report = self._started_at + self._interval
+		self.report()
+
+	def cancel(self):
+		self.cancelled = True
+		self.cancel_event.set()
+
+	def advance(self, count):
+		if self.cancelled:
+			raise TransferCancelled()
+		now = time.time()
+		with self._lock:
+			self.bytes += count
+			if now < self._next_report:
+				return
+			self._next_report = now + self._interval
+		self.report(now)
+
+	def succeed(self, response):
+		if self._finish('done'):
+			self._on_succeed(data=self.data, response=response)
+
+	def fail(self, error):
+		if self._finish('cancelled' if self.cancelled else 'failed'):
+			self._on_error(data=self.data, error=CANCELLED_STATUS if self.cancelled else error)
+
+	def _finish(self, state):
+		with self._lock:
+			if self.finished:
+				return False
+			self.finished = True
+			self.state = state
+		_transfers.inc((state, ))
+		self.report()
+		return True
+
+	def report(self, now=None):
+		self._send(self.progress(now))
+
+	def progress(self, now=None):
+		with self._lock:
+			elapsed = (now or time.time()) - self._started_at
+			rate = (self.bytes - self._started_bytes) / elapsed if elapsed > 0 else 0.0
+			eta = (self.size - self.bytes) / rate if rate and self.size else None
+			return {'transfer_id': self.id, 'file_id': self.file_id, 'file_name': self.file_name, 'state': self.state,
+					'bytes': self.bytes, 'size': self.size, 'rate': int(rate), 'eta': round(eta, 1) if eta is not None else None}
+
+
+class TransferManager(object):
+	"""File transfers run by ``run(transfer)`` on their own workers, behind a bounded queue, cancellable by id or file id."""
+
+	def __init__(self, run, send, on_succeed, on_error, workers, max_queue, interval, idle_timeout=None):
+		self._run = run
+		self._send = send
+		self._on_succeed = on_succeed
+		self._on_error = on_error
+		self._interval = interval
+		self._executor = Executor(name='Plabric transfers', workers=workers, max_queue=max_queue, idle_timeout=idle_timeout)
+		self._transfers = {}
+		self._finished = {'done': 0, 'failed': 0, 'cancelled': 0}
+		self._events = 0
+		self._lock = threading.Lock()
+
+	def submit(self, data):
+		"""Queues the transfer for an api_command; it fails with 503 right away when the queue is full."""
+		transfer = Transfer(data, send=self._report, on_succeed=self._on_succeed, on_error=self._on_error, interval=self._interval)
+		data['transfer_id'] = transfer.id
+		with self._lock:
+			self._transfers[transfer.id] = transfer
+		transfer.report()
+		if self._executor.submit(target=self._execute, args=(transfer, )) is None:
+			with self._lock:
+				self._transfers.pop(transfer.id, None)
+				self._finished['failed'] += 1
+			transfer.fail(503)
+		return transfer
+
+	def cancel(self, transfer_id=None, file_id=None):
+		"""Cancels matching transfers: queued ones are answered with 499 right away, running ones at their next chunk."""
+		with self._lock:
+			transfers = [t for t in self._transfers.values() if t.id == transfer_id or (file_id is not None and t.file_id == file_id)]
+		self._cancel(transfers)
+		return len(transfers)
+
+	def cancel_all(self):
+		with self._lock:
+			transfers = list(self._transfers.values())
+		self._cancel(transfers)
+
+	def _cancel(self, transfers):
+		for transfer in transfers:
+			_logger.log('Transfers: Cancelling %s' % transfer.id)
+			transfer.cancel()
+			if transfer.state == 'queued':
+				transfer.fail(CANCELLED_STATUS)
+
+	def _execute(self, transfer, task=None):
+		try:
+			if transfer.cancelled:
+				transfer.fail(CANCELLED_STATUS)
+			else:
+				self._run(transfer)
+		except Exception as e:
+			_logger.warn('Transfers: %s failed - %s' % (transfer.id, e))
+			transfer.fail(500)
+		finally:
+			if not transfer.finished:
+				transfer.fail(500)
+			with self._lock:
+				self._transfers.pop(transfer.id, None)
+				self._finished[transfer.state] += 1
+
+	def _report(self, progress):
+		with self._lock:
+			self._events += 1
+		_progress_events.inc()
+		self._send(progress)
+
+	def get_stats(self):
+		with self._lock:
+			return dict(self._executor.get_stats(), active=len(self._transfers), progress_events=self._events, **self._finished)
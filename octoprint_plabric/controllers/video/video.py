@@ -1,16 +1,23 @@
 import os
-import threading
+import re
 from collections import deque
 import ffmpeg
 
 from octoprint_plabric import config
-from octoprint_plabric.controllers.common import logger as _logger, utils as _utils
+from octoprint_plabric.controllers.common import logger as _logger, metrics as _metrics, utils as _utils
 
 if _utils.is_python3():
 	from urllib.request import urlopen
 else:
 	from urllib2 import urlopen
 
+_PROGRESS = re.compile(br'fps=\s*([\d.]+).*bitrate=\s*([\d.]+)kbits/s')
+_LINE_END = re.compile(br'[\r\n]')
+
+_starts = _metrics.REGISTRY.counter('plabric_video_starts_total', 'ffmpeg stream starts')
+_fps = _metrics.REGISTRY.gauge('plabric_video_fps', 'ffmpeg output frame rate')
+_bitrate = _metrics.REGISTRY.gauge('plabric_video_bitrate_kbps', 'ffmpeg output bitrate in kbit/s')
+
 
 class VideoStreamProtocol:
 	def on_video_started(self):
@@ -21,7 +28,8 @@ class VideoStreamProtocol:
 
 
 class VideoStreamer:
-	def __init__(self, janus_url, port, machine, system, is_raspberry=False):
+	def __init__(self, janus_url, port, machine, system, loop, is_raspberry=False):
+		self._loop = loop
 		self._url = "rtp://%s:%d?pkt_size=1300" % (janus_url, port)
 		self._callback = None
 		self._process = None
@@ -74,6 +82,7 @@ class VideoStreamer:
 			self._process = base\
 				.output(self._url, format='rtp', vcodec=self._vcodec, pix_fmt='yuv420p', an=None, ** arguments)\
 				.run_async(cmd=self._ffmpeg_dir, pipe_stdin=True, pipe_stderr=True, quiet=True)
+			_starts.inc()
 		except Exception as e:
 			_logger.warn(e)
 
@@ -109,27 +118,39 @@ class VideoStreamer:
 			except Exception as e:
 				_logger.warn(e)
 			self._process = None
+			_fps.set(0)
+			_bitrate.set(0)
 			self._callback.on_video_stopped()
 
 	def monitor(self, process):
-
-		def monitor_ffmpeg_process():
-			while True:
-				ring_buffer = deque(maxlen=200)
-				err = process.stderr.readline()
-				if not err:
-					if self._shutting_down:
-						return
-					process.wait()
-					_logger.warn('STDERR:\n{}\n'.format('\n'.join(ring_buffer)))
-					self.stop()
+		ring_buffer = deque(maxlen=200)
+		pending = [b'']
+
+		def on_stderr():
+			chunk = os.read(fd, 4096)
+			if not chunk:
+				self._loop.remove_reader(fd)
+				if pending[0]:
+					ring_buffer.append(pending[0])
+				if self._shutting_down:
 					return
-				else:
-					ring_buffer.append(err)
-
-		gst_thread = threading.Thread(target=monitor_ffmpeg_process)
-		gst_thread.daemon = True
-		gst_thread.start()
+				process.wait()
+				_logger.warn('STDERR:\n{}\n'.format('\n'.join(line.decode('utf-8', 'replace') for line in ring_buffer)))
+				self.stop()
+				return
+			lines = _LINE_END.split(pending[0] + chunk)
+			pending[0] = lines.pop()
+			for line in lines:
+				if line:
+					ring_buffer.append(line)
+					progress = _PROGRESS.search(line)
+					if progress:
+						_fps.set(float(progress.group(1)))
+						_bitrate.set(float(progress.group(2)))
+
+		if process:
+			fd = process.stderr.fileno()
+			self._loop.add_reader(fd, on_stderr)
 
 	def get_rotation_params(self):
 		rotation = []
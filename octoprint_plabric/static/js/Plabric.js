@@ -61,6 +61,30 @@ $(function() {
                 error: function (error) {}
             });
         };
+
+        self.switch_tracing = function () {
+            $.ajax({
+                type: "POST",
+                url: "/plugin/Plabric/tracing/switch",
+                success: function (data) {},
+                error: function (error) {}
+            });
+        };
+
+        self.profile = function () {
+            $.ajax({
+                type: "POST",
+                url: "/plugin/Plabric/profile",
+                data: JSON.stringify({seconds: 30}),
+                contentType: "application/json",
+                success: function (data) {
+                    console.log("Plabric: Profiling started");
+                },
+                error: function (error) {
+                    console.error("Plabric: Unable to start profiling");
+                }
+            });
+        };
     }
 
     OCTOPRINT_VIEWMODELS.push({
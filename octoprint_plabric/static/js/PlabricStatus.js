@@ -10,6 +10,8 @@ $(function() {
         self.status = ko.observable(null);
         self.status_color = ko.observable(null);
         self.navbar_enabled = ko.observable(true);
+        self.profiling = ko.observable(false);
+        self.tracing_enabled = ko.observable(false);
 
         self.refreshState = function(state) {
             self.plabric_token(state.plabric_token);
@@ -18,6 +20,8 @@ $(function() {
             self.loading(state.loading);
             self.status(state.status);
             self.navbar_enabled(state.navbar_enabled);
+            self.profiling(state.profiling);
+            self.tracing_enabled(state.tracing_enabled);
             setStatusColor();
         };
 